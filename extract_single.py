@@ -2,91 +2,391 @@
 """
 Single image extraction script for PHP integration
 This script processes a single image and returns JSON output
+
+Usage:
+  python extract_single.py <image_url>     Extract one image (through the daemon when it runs)
+  python extract_single.py --daemon        Keep the models warm and serve requests on a Unix socket
+  python extract_single.py --serve         Keep the models warm and serve JSON lines on stdin/stdout
+  python extract_single.py <input> ...     Extract many images as JSON lines; inputs may be URLs,
+                                           files, directories, globs or .zip/.tar archives
 """
 
 import sys
 import json
 import os
-import tempfile
-import requests
+import glob
+import queue
+import base64
+import tarfile
+import zipfile
+import signal
 import logging
 import warnings
-from utils import detect_and_process_id_card
-
-# Suppress all logging and warnings
-logging.disable(logging.CRITICAL)
-warnings.filterwarnings("ignore")
-
-# Redirect stderr to devnull to suppress warnings
-sys.stderr = open(os.devnull, 'w')
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import ocr_daemon
+import http_client
 
 # Suppress ultralytics warnings
 os.environ['ULTRALYTICS_OFFLINE'] = '1'
 
-def download_image_from_url(url):
-    """Download image from URL and save to temporary file"""
-    try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            temp_file.write(response.content)
-            return temp_file.name
-    except Exception as e:
-        raise Exception(f"Failed to download image: {str(e)}")
+# Pipeline configuration for --serve (overridable through the environment)
+DEFAULT_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+DEFAULT_DOWNLOADS = int(os.environ.get("OCR_DOWNLOAD_CONCURRENCY", 8))
 
-def main():
-    if len(sys.argv) != 2:
-        print(json.dumps({"error": "Usage: python extract_single.py <image_url>"}))
+# File extensions picked up from directories, globs and archives
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+# Fields of a successful result, in output order
+RESULT_FIELDS = ("first_name", "second_name", "full_name", "national_id", "address", "birth_date", "governorate", "gender")
+
+# OCR'd text fields each result field depends on; the rest come from the national ID
+TEXT_FIELD_SOURCES = {
+    "first_name": ("first_name",),
+    "second_name": ("second_name",),
+    "full_name": ("first_name", "second_name"),
+    "address": ("address",),
+}
+
+class JsonArgumentParser(argparse.ArgumentParser):
+    """Report usage errors as JSON on stdout, like every other outcome of this script"""
+
+    def error(self, message):
+        print(json.dumps({"error": f"{message}. Usage: python extract_single.py <image_url>", "status": "error"}))
         sys.exit(1)
-    
-    image_url = sys.argv[1]
-    temp_file_path = None
-    
+
+def silence_output():
+    """Suppress all logging and warnings so stdout carries only the JSON result"""
+    logging.disable(logging.CRITICAL)
+    warnings.filterwarnings("ignore")
+
+    # Redirect stderr to devnull to suppress warnings
+    sys.stderr = open(os.devnull, 'w')
+
+def claim_stdout():
+    """Keep the real stdout for JSON lines; anything the libraries print goes to stderr instead"""
+    out = sys.stdout
+    sys.stdout = sys.stderr
+    return out
+
+def resolve_local_path(image_url):
+    """Absolute path for a file:// URL or local path (the daemon runs in another directory)"""
+    if image_url.startswith('file://'):
+        image_url = image_url[7:]  # Remove 'file://' prefix
+    return os.path.abspath(image_url)
+
+def read_image_source(request):
+    """Image bytes for a request holding one of url, path, base64 or image (URL or path)"""
+    if request.get("error"):
+        raise ValueError(request["error"])  # The input could not be expanded
+    if request.get("content") is not None:
+        return request["content"]  # Archive member read by iter_inputs
+    if request.get("image"):
+        image = request["image"]
+        request = {"url": image} if image.startswith(('http://', 'https://')) else {"path": image}
+
+    if request.get("url") and not request["url"].startswith('file://'):
+        return http_client.fetch_sync(request["url"])
+    if request.get("url") or request.get("path"):
+        with open(resolve_local_path(request.get("path") or request["url"]), 'rb') as f:
+            return f.read()
+    if request.get("base64"):
+        try:
+            return base64.b64decode(request["base64"], validate=True)
+        except ValueError:
+            raise ValueError("Invalid base64 image data")
+    raise ValueError("Request must contain url, path or base64")
+
+def fields_to_skip(fields):
+    """Text fields OCR can skip when only fields (None for all) are wanted"""
+    if fields is None:
+        fields = RESULT_FIELDS
+    unknown = [name for name in fields if name not in RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(RESULT_FIELDS)}")
+    needed = {source for name in fields for source in TEXT_FIELD_SOURCES.get(name, ())}
+    # The serial number is never part of the output
+    return {"serial"} | {name for name in ("first_name", "second_name", "address") if name not in needed}
+
+def format_result(result, fields=None):
+    """Output dict for an extraction tuple, limited to fields (None for all)"""
+    values = dict(zip(RESULT_FIELDS, result))
+    output = {name: values[name] for name in RESULT_FIELDS if fields is None or name in fields}
+    output["status"] = "success"
+    return output
+
+def error_result(exc):
+    return {"error": str(exc), "status": "error"}
+
+def extract_request(request):
+    """Extract the ID card for one request dict (url, path, base64 or image, and optional fields)
+
+    Returns the JSON result dict; errors are reported in it rather than raised.
+    """
+    # Imported on first use: loading torch and the OCR models is what the daemon client avoids
+    from utils import detect_and_process_id_cards, decode_image
+
     try:
-        # Handle URL vs local file
-        if image_url.startswith(('http://', 'https://')):
-            # Download image from URL
-            temp_file_path = download_image_from_url(image_url)
-            image_path = temp_file_path
-        elif image_url.startswith('file://'):
-            # Handle file:// URLs
-            image_path = image_url[7:]  # Remove 'file://' prefix
-        else:
-            # Assume it's a local file path
-            image_path = image_url
-        
-        # Process the image
-        first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = detect_and_process_id_card(image_path)
-        
-        # Create result dictionary
-        result = {
-            "first_name": first_name,
-            "second_name": second_name,
-            "full_name": full_name,
-            "national_id": national_id,
-            "address": address,
-            "birth_date": birth_date,
-            "governorate": governorate,
-            "gender": gender,
-            "status": "success"
-        }
-        
-        # Output only JSON (no other output)
-        print(json.dumps(result, ensure_ascii=False))
-        
+        skip = fields_to_skip(request.get("fields"))
+        image = decode_image(read_image_source(request))
+        outcome = detect_and_process_id_cards([image], skips=[skip])[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return format_result(outcome, request.get("fields"))
     except Exception as e:
-        error_result = {
-            "error": str(e),
-            "status": "error"
-        }
-        print(json.dumps(error_result, ensure_ascii=False))
-        sys.exit(1)
+        return error_result(e)
+
+def run_pipeline(requests, emit, threads=1, batch_size=DEFAULT_BATCH_SIZE, downloads=DEFAULT_DOWNLOADS):
+    """Extract a stream of request dicts, calling emit(request, result) as each one finishes
+
+    Images are read on `downloads` I/O threads while `threads` inference threads (each with
+    its own warm models) run whatever is ready through the pipeline in batches of up to
+    batch_size. Results are emitted in completion order, and at most downloads +
+    threads * batch_size requests are held in memory at once.
+    """
+    from utils import detect_and_process_id_cards, decode_image, warm_up_models
+
+    ready = queue.Queue()
+    in_flight = threading.BoundedSemaphore(downloads + threads * batch_size)
+
+    def finish(request, result):
+        try:
+            emit(request, result)
+        finally:
+            in_flight.release()
+
+    def load(request):
+        try:
+            skip = fields_to_skip(request.get("fields"))
+            image = decode_image(read_image_source(request))
+        except Exception as e:
+            finish(request, error_result(e))
+            return
+        ready.put((request, image, skip))
+
+    def infer():
+        warm_up_models()
+        stopping = False
+        while not stopping:
+            batch = [ready.get()]
+            while len(batch) < batch_size and batch[-1] is not None:
+                try:
+                    batch.append(ready.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                # One end marker per inference thread
+                batch.pop()
+                stopping = True
+            if not batch:
+                continue
+
+            try:
+                outcomes = detect_and_process_id_cards([image for _, image, _ in batch], skips=[skip for _, _, skip in batch])
+            except Exception as e:
+                outcomes = [e] * len(batch)
+            for (request, _, _), outcome in zip(batch, outcomes):
+                if isinstance(outcome, Exception):
+                    finish(request, error_result(outcome))
+                else:
+                    finish(request, format_result(outcome, request.get("fields")))
+
+    workers = [threading.Thread(target=infer, name=f"ocr-infer-{i}") for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    with ThreadPoolExecutor(max_workers=downloads, thread_name_prefix="ocr-load") as loaders:
+        for request in requests:
+            in_flight.acquire()
+            loaders.submit(load, request)
+    for _ in workers:
+        ready.put(None)
+    for worker in workers:
+        worker.join()
+
+def is_image_file(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+def iter_archive(path):
+    """Requests for the image members of a zip or tar archive, read one at a time (never extracted to disk)"""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and is_image_file(member.filename):
+                    yield {"input": f"{path}:{member.filename}", "content": archive.read(member)}
+    else:
+        # Stream mode: members are read in archive order without seeking
+        with tarfile.open(path, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile() and is_image_file(member.name):
+                    yield {"input": f"{path}:{member.name}", "content": archive.extractfile(member).read()}
+
+def iter_inputs(inputs):
+    """Expand command line inputs (URLs, files, directories, globs, archives) into requests, lazily"""
+    for source in inputs:
+        if source.startswith(('http://', 'https://')):
+            yield {"input": source, "url": source}
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if is_image_file(name):
+                        yield {"input": os.path.join(root, name), "path": os.path.join(root, name)}
+        elif any(char in source for char in "*?["):
+            for path in sorted(glob.glob(source, recursive=True)):
+                if os.path.isfile(path):
+                    yield {"input": path, "path": path}
+        elif source.lower().endswith(('.zip',) + TAR_EXTENSIONS):
+            try:
+                yield from iter_archive(source)
+            except (OSError, zipfile.BadZipFile, tarfile.TarError) as e:
+                yield {"input": source, "error": f"Could not read archive: {str(e)}"}
+        else:
+            yield {"input": source, "path": source}
+
+def is_single_image(inputs):
+    """True when the command line names exactly one image (the original one-object output)"""
+    if len(inputs) != 1:
+        return False
+    source = inputs[0]
+    if source.startswith(('http://', 'https://')):
+        return True
+    return not (os.path.isdir(source) or any(char in source for char in "*?[")
+                or source.lower().endswith(('.zip',) + TAR_EXTENSIONS))
+
+def run_batch(args):
+    """Extract every input image, writing one JSON line per image; exit status 1 if any failed"""
+    silence_output()
+    out = claim_stdout()
+    lock = threading.Lock()
+    pending = {}
+    state = {"next": 0, "failed": 0}
+
+    def write(request, result):
+        out.write(json.dumps({"input": request["input"], **result}, ensure_ascii=False) + "\n")
+
+    def emit(request, result):
+        with lock:
+            if result.get("status") != "success":
+                state["failed"] += 1
+            if args.order == "completion":
+                write(request, result)
+            else:
+                # Hold results back until every earlier input has been written
+                pending[request["seq"]] = (request, result)
+                while state["next"] in pending:
+                    write(*pending.pop(state["next"]))
+                    state["next"] += 1
+            out.flush()
+
+    requests = ({**request, "seq": i} for i, request in enumerate(iter_inputs(args.inputs)))
+    try:
+        run_pipeline(requests, emit, args.threads, args.batch_size, args.downloads)
     finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        http_client.run_sync(http_client.close())
+    return 1 if state["failed"] else 0
+
+def read_requests(lines, emit):
+    """Parse JSON request lines, answering malformed ones directly through emit"""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+        except ValueError as e:
+            emit({}, error_result(f"Invalid request: {str(e)}"))
+            continue
+        yield request
+
+def run_server(args):
+    """Answer JSON requests read line by line from stdin with JSON lines on stdout"""
+    silence_output()
+    # Anything the libraries print must not end up in the protocol stream
+    out = claim_stdout()
+    lock = threading.Lock()
+
+    def emit(request, result):
+        line = json.dumps({"id": request.get("id"), **result}, ensure_ascii=False)
+        with lock:
+            out.write(line + "\n")
+            out.flush()
+
+    try:
+        run_pipeline(read_requests(sys.stdin, emit), emit, args.threads, args.batch_size, args.downloads)
+    finally:
+        http_client.run_sync(http_client.close())
+    return 0
+
+def run_daemon(args):
+    """Serve extraction requests on the Unix socket until SIGTERM/SIGINT"""
+    from utils import warm_up_models
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    try:
+        ocr_daemon.serve(extract_request, args.socket, args.threads, warm_up=warm_up_models, stop=stop)
+    except RuntimeError as e:
+        logging.getLogger("ocr_daemon").error(str(e))
+        return 1
+    finally:
+        http_client.run_sync(http_client.close())
+    return 0
+
+def main():
+    parser = JsonArgumentParser(description="Extract Egyptian ID card data as JSON")
+    parser.add_argument("inputs", nargs="*", metavar="image_url", help="Image URLs, file:// URLs, paths, directories, globs or .zip/.tar archives")
+    parser.add_argument("--daemon", action="store_true", help="Keep the models loaded and serve requests on --socket")
+    parser.add_argument("--serve", action="store_true", help="Keep the models loaded and answer JSON lines from stdin on stdout")
+    parser.add_argument("--socket", default=ocr_daemon.DEFAULT_SOCKET, help="Daemon socket path (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=ocr_daemon.DEFAULT_THREADS, help="Inference threads, each with its own models")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Images per inference batch with --serve or several inputs")
+    parser.add_argument("--downloads", type=int, default=DEFAULT_DOWNLOADS, help="Concurrent image downloads with --serve or several inputs")
+    parser.add_argument("--order", choices=("input", "completion"), default="input", help="Order of JSON lines for several inputs (default: %(default)s)")
+    parser.add_argument("--no-daemon", action="store_true", help="Always extract in this process")
+    args = parser.parse_args()
+
+    if args.daemon:
+        sys.exit(run_daemon(args))
+    if args.serve:
+        sys.exit(run_server(args))
+    if not args.inputs:
+        parser.error("an image URL or path is required")
+    if not is_single_image(args.inputs):
+        sys.exit(run_batch(args))
+
+    silence_output()
+    image_url = args.inputs[0]
+
+    # Local files are resolved here: the daemon may run in another directory
+    request = {"url": image_url} if image_url.startswith(('http://', 'https://')) else {"path": resolve_local_path(image_url)}
+
+    result = None
+    if not args.no_daemon:
+        try:
+            result = ocr_daemon.request(request, args.socket)
+        except ocr_daemon.DaemonUnavailable:
+            pass
+        except Exception as e:
+            result = {"error": f"Extraction daemon error: {str(e)}", "status": "error"}
+
+    if result is None:
+        # No daemon running: load the models in this process
+        result = extract_request(request)
+
+    # Output only JSON (no other output)
+    print(json.dumps(result, ensure_ascii=False))
+    if result.get("status") != "success":
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
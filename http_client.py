@@ -0,0 +1,340 @@
+"""
+Shared async HTTP client for downloading ID card images
+Keeps a pooled keep-alive session per event loop and streams bodies with a hard size cap
+"""
+
+import io
+import os
+import asyncio
+import threading
+from urllib.parse import urlsplit, urlunsplit
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+# Download limits and pool configuration (overridable through the environment)
+MAX_DOWNLOAD_BYTES = int(os.environ.get("OCR_MAX_DOWNLOAD_BYTES", 10 * 1024 * 1024))
+DOWNLOAD_TIMEOUT = float(os.environ.get("OCR_DOWNLOAD_TIMEOUT", 30))
+POOL_SIZE = int(os.environ.get("OCR_HTTP_POOL_SIZE", 100))
+POOL_SIZE_PER_HOST = int(os.environ.get("OCR_HTTP_POOL_PER_HOST", 10))
+DNS_CACHE_TTL = int(os.environ.get("OCR_HTTP_DNS_TTL", 300))
+CHUNK_SIZE = 64 * 1024
+
+# Limits on the parts of a multipart upload other than the image
+MAX_FORM_FIELDS = 16
+MAX_FORM_FIELD_BYTES = 64 * 1024
+
+# Leading bytes needed to identify a file by its signature
+SNIFF_BYTES = 12
+IMAGE_TYPES = ("jpeg", "png", "webp")
+
+class DownloadError(Exception):
+    """Raised when an image cannot be downloaded"""
+
+class DownloadTooLargeError(DownloadError):
+    """Raised as soon as a response body exceeds the size cap"""
+
+class DownloadTimeoutError(DownloadError):
+    """Raised when the origin does not answer in time"""
+
+class UnsupportedContentError(DownloadError):
+    """Raised when the leading bytes do not match an allowed file type"""
+
+def sniff_file_type(head: bytes) -> Optional[str]:
+    """Identify JPEG/PNG/WebP/PDF content from its magic bytes"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head.startswith(b"%PDF-"):
+        return "pdf"
+    return None
+
+def _check_file_type(head: bytes, allowed_types: Optional[Tuple[str, ...]]):
+    """Raise UnsupportedContentError unless head matches one of allowed_types"""
+    if allowed_types is not None and sniff_file_type(head) not in allowed_types:
+        raise UnsupportedContentError("Invalid image URL or unsupported image format")
+
+def normalize_url(url: str) -> str:
+    """Canonical form of url for deduplication: lower-case scheme and host, no default port or fragment"""
+    parts = urlsplit(str(url).strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # IPv6 literal
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        host = f"{parts.username}{':' + parts.password if parts.password else ''}@{host}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+_sessions: Dict[asyncio.AbstractEventLoop, aiohttp.ClientSession] = {}
+_sync_loop: Optional[asyncio.AbstractEventLoop] = None
+_sync_lock = threading.Lock()
+
+def get_session() -> aiohttp.ClientSession:
+    """Return the pooled session bound to the running event loop, creating it on first use"""
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_SIZE,
+            limit_per_host=POOL_SIZE_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=30
+        )
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[loop] = session
+    return session
+
+class _LimitedBuffer:
+    """In-memory body that raises as soon as it exceeds max_bytes or starts with a disallowed signature"""
+
+    def __init__(self, max_bytes: int, allowed_types: Optional[Tuple[str, ...]]):
+        self.max_bytes = max_bytes
+        self.allowed_types = allowed_types
+        self.buffer = io.BytesIO()
+        self.sniffed = allowed_types is None
+
+    def write(self, chunk: bytes):
+        self.buffer.write(chunk)
+        if not self.sniffed and self.buffer.tell() >= SNIFF_BYTES:
+            _check_file_type(self.buffer.getbuffer()[:SNIFF_BYTES].tobytes(), self.allowed_types)
+            self.sniffed = True
+        if self.buffer.tell() > self.max_bytes:
+            raise DownloadTooLargeError(f"Image file too large. Maximum size is {self.max_bytes / (1024 * 1024):g}MB")
+
+    def getvalue(self) -> bytes:
+        content = self.buffer.getvalue()
+        if not self.sniffed:
+            _check_file_type(content, self.allowed_types)
+        return content
+
+async def read_limited(chunks: AsyncIterator[bytes], max_bytes: int = MAX_DOWNLOAD_BYTES,
+                       allowed_types: Optional[Tuple[str, ...]] = None) -> bytes:
+    """Collect an async byte stream into memory, aborting as soon as it exceeds max_bytes
+
+    When allowed_types is given, the magic bytes at the head of the stream are checked
+    before the rest of it is read.
+    """
+    buffer = _LimitedBuffer(max_bytes, allowed_types)
+    async for chunk in chunks:
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+class _UploadedFile:
+    """One file of a multipart upload with several files
+
+    Buffered like _LimitedBuffer, but a file that fails the checks keeps the error as its
+    outcome and the rest of it is dropped, so one bad file does not abort the whole body.
+    """
+
+    def __init__(self, filename: str, max_bytes: int, allowed_types: Optional[Tuple[str, ...]]):
+        self.filename = filename
+        self.buffer: Optional[_LimitedBuffer] = _LimitedBuffer(max_bytes, allowed_types)
+        self.error: Optional[DownloadError] = None
+
+    def write(self, chunk: bytes):
+        if self.error is not None:
+            return
+        try:
+            self.buffer.write(chunk)
+        except DownloadError as e:
+            self.error = e
+            self.buffer = None  # Free what was received so far
+
+    def outcome(self) -> Any:
+        """The file bytes, or the DownloadError that rejected the file"""
+        if self.error is not None:
+            return self.error
+        try:
+            return self.buffer.getvalue()
+        except DownloadError as e:
+            return e
+
+async def _parse_multipart(chunks: AsyncIterator[bytes], content_type: str, file_field: str, max_files: int,
+                           open_file: Callable[[str], Any],
+                           max_total_bytes: Optional[int] = None) -> Tuple[List[Any], Dict[str, str]]:
+    """Parse a multipart/form-data stream as it arrives, without spooling it to disk
+
+    Each file_field part is written to open_file(filename), for at most max_files parts;
+    other parts are read as short text fields. Raises ValueError for a malformed body or
+    too many parts, and DownloadTooLargeError once the files together pass max_total_bytes.
+    """
+    try:
+        from python_multipart.multipart import MultipartParser, parse_options_header
+    except ImportError:  # python-multipart before 0.0.13
+        from multipart.multipart import MultipartParser, parse_options_header
+
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing multipart boundary")
+
+    files: List[Any] = []
+    fields: Dict[str, str] = {}
+    part: Dict[str, Any] = {}
+    received = 0
+    finished = []
+
+    def on_part_begin():
+        part.clear()
+        part.update(headers={}, field=b"", value=b"")
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = disposition.get(b"name", b"").decode("utf-8", "replace")
+        part["is_file"] = part["name"] == file_field
+        if part["is_file"]:
+            if len(files) >= max_files:
+                raise ValueError(f"More than {max_files} {file_field} parts")
+            part["body"] = open_file(disposition.get(b"filename", b"").decode("utf-8", "replace"))
+            files.append(part["body"])
+        elif len(fields) >= MAX_FORM_FIELDS:
+            raise ValueError("Too many form fields")
+        else:
+            part["body"] = io.BytesIO()
+
+    def on_part_data(data, start, end):
+        nonlocal received
+        part["body"].write(data[start:end])
+        if not part["is_file"]:
+            if part["body"].tell() > MAX_FORM_FIELD_BYTES:
+                raise ValueError(f"Form field {part['name']} is too large")
+            return
+        received += end - start
+        if max_total_bytes is not None and received > max_total_bytes:
+            raise DownloadTooLargeError(f"Upload too large. Maximum total size is {max_total_bytes / (1024 * 1024):g}MB")
+
+    def on_part_end():
+        if not part["is_file"]:
+            fields[part["name"]] = part["body"].getvalue().decode("utf-8", "replace")
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data, "on_part_end": on_part_end, "on_end": lambda: finished.append(True),
+    })
+    async for chunk in chunks:
+        parser.write(chunk)
+    parser.finalize()
+    if not finished:
+        raise ValueError("Incomplete multipart body")
+    return files, fields
+
+async def read_multipart(chunks: AsyncIterator[bytes], content_type: str, file_field: str = "file",
+                         max_bytes: int = MAX_DOWNLOAD_BYTES,
+                         allowed_types: Optional[Tuple[str, ...]] = None) -> Tuple[bytes, Dict[str, str]]:
+    """Parse a multipart/form-data stream into (file bytes, text fields) without spooling it to disk
+
+    The file_field part is checked as it arrives, as in read_limited; other parts are
+    read as short text fields. Raises ValueError for a malformed body or a missing file.
+    """
+    files, fields = await _parse_multipart(
+        chunks, content_type, file_field, 1, lambda filename: _LimitedBuffer(max_bytes, allowed_types)
+    )
+    if not files:
+        raise ValueError(f"Missing {file_field} field")
+    return files[0].getvalue(), fields
+
+async def read_multipart_files(chunks: AsyncIterator[bytes], content_type: str, max_files: int,
+                               file_field: str = "files", max_bytes: int = MAX_DOWNLOAD_BYTES,
+                               allowed_types: Optional[Tuple[str, ...]] = None) -> Tuple[List[Tuple[str, Any]], Dict[str, str]]:
+    """Parse a multipart/form-data stream with several files into ([(filename, outcome)], text fields)
+
+    Each file is capped and checked as it arrives, as in read_limited; its outcome is the
+    bytes, or the DownloadError that rejected it. The body is rejected with ValueError as
+    soon as it carries more than max_files files, and with DownloadTooLargeError once they
+    add up to more than max_files * max_bytes.
+    """
+    files, fields = await _parse_multipart(
+        chunks, content_type, file_field, max_files,
+        lambda filename: _UploadedFile(filename, max_bytes, allowed_types), max_files * max_bytes
+    )
+    return [(upload.filename, upload.outcome()) for upload in files], fields
+
+async def fetch(url: str, max_bytes: int = MAX_DOWNLOAD_BYTES, timeout: float = DOWNLOAD_TIMEOUT,
+                allowed_types: Optional[Tuple[str, ...]] = None) -> bytes:
+    """Stream url into memory, aborting once more than max_bytes have been received
+
+    Checking allowed_types on the GET stream itself means no separate HEAD preflight is needed.
+    """
+    try:
+        async with get_session().get(str(url), timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            response.raise_for_status()
+
+            # Reject early when the origin announces the size
+            if response.content_length is not None and response.content_length > max_bytes:
+                raise DownloadTooLargeError(f"Image file too large. Maximum size is {max_bytes / (1024 * 1024):g}MB")
+
+            return await read_limited(response.content.iter_chunked(CHUNK_SIZE), max_bytes, allowed_types)
+    except asyncio.TimeoutError:
+        raise DownloadTimeoutError("Request timeout while downloading image")
+    except aiohttp.ClientError as e:
+        raise DownloadError(f"Failed to download image: {str(e)}")
+
+async def probe(url: str, timeout: float = 10) -> Optional[str]:
+    """Identify the file type behind url with a ranged GET for the header bytes only"""
+    headers = {"Range": f"bytes=0-{SNIFF_BYTES - 1}"}
+    try:
+        async with get_session().get(str(url), headers=headers, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            if response.status not in (200, 206):
+                return None
+            # Origins that ignore Range send the whole body; only the head is read
+            head = b""
+            while len(head) < SNIFF_BYTES:
+                chunk = await response.content.read(SNIFF_BYTES - len(head))
+                if not chunk:
+                    break
+                head += chunk
+            return sniff_file_type(head)
+    except (asyncio.TimeoutError, aiohttp.ClientError):
+        return None
+
+async def post_json(url: str, payload: Dict[str, Any], timeout: float = 10, retries: int = 3) -> bool:
+    """POST a JSON payload (e.g. a webhook), retrying with backoff; returns True on a 2xx answer"""
+    for attempt in range(retries):
+        try:
+            async with get_session().post(str(url), json=payload, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status < 300:
+                    return True
+        except (asyncio.TimeoutError, aiohttp.ClientError):
+            pass
+        if attempt < retries - 1:
+            await asyncio.sleep(2 ** attempt)
+    return False
+
+def _get_sync_loop() -> asyncio.AbstractEventLoop:
+    """Background event loop used by synchronous callers so they share one pool"""
+    global _sync_loop
+    with _sync_lock:
+        if _sync_loop is None:
+            _sync_loop = asyncio.new_event_loop()
+            threading.Thread(target=_sync_loop.run_forever, name="http-client", daemon=True).start()
+        return _sync_loop
+
+def run_sync(coro: Awaitable[Any]) -> Any:
+    """Run a coroutine from this module on the background loop and wait for its result"""
+    return asyncio.run_coroutine_threadsafe(coro, _get_sync_loop()).result()
+
+def fetch_sync(url: str, max_bytes: int = MAX_DOWNLOAD_BYTES, timeout: float = DOWNLOAD_TIMEOUT) -> bytes:
+    """Blocking wrapper around fetch for the command line tools"""
+    return run_sync(fetch(url, max_bytes, timeout))
+
+async def close():
+    """Close the session bound to the running event loop"""
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
@@ -0,0 +1,292 @@
+"""
+Persistent job queue for asynchronous ID extraction
+Jobs are handed out with a lease (visibility timeout): a job whose worker dies is picked up
+again once its lease expires. The HTTP service and the standalone workers (worker.py) share
+a queue through the JobQueue interface; SQLite is the built-in backend and others can be
+added with register_backend.
+"""
+
+import os
+import json
+import time
+import uuid
+import sqlite3
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Queue configuration (overridable through the environment)
+DEFAULT_DB_PATH = os.environ.get("OCR_JOB_DB", "jobs.db")
+DEFAULT_QUEUE_URL = os.environ.get("OCR_JOB_QUEUE", f"sqlite:///{DEFAULT_DB_PATH}")
+DEFAULT_VISIBILITY_TIMEOUT = float(os.environ.get("OCR_JOB_VISIBILITY_TIMEOUT", 300))
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get("OCR_JOB_MAX_ATTEMPTS", 3))
+DEFAULT_RETENTION = int(os.environ.get("OCR_JOB_RETENTION", 1000))
+DEFAULT_TTL = float(os.environ.get("OCR_JOB_TTL", 24 * 3600))
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    callback_url TEXT,
+    result TEXT,
+    error TEXT,
+    error_code TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+"""
+
+def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+    """Decode a jobs row into a plain dict"""
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+def public_view(job: Dict[str, Any]) -> Dict[str, Any]:
+    """Job fields exposed by GET /jobs/{id} and sent to callback URLs"""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "request_id": job["payload"]["request_id"],
+        "extracted_data": job["result"],
+        "error": job["error"],
+        "error_code": job["error_code"],
+        "created_at": datetime.fromtimestamp(job["created_at"]).isoformat(),
+        "finished_at": datetime.fromtimestamp(job["finished_at"]).isoformat() if job["finished_at"] else None,
+    }
+
+class JobQueue(ABC):
+    """Interface shared by queue backends; a backend must implement every abstract method
+
+    Jobs are dicts with id, status, payload, callback_url, result, error, error_code,
+    attempts, lease_owner, lease_expires, created_at, updated_at and finished_at.
+    """
+
+    @abstractmethod
+    def enqueue(self, payload: Dict[str, Any], callback_url: Optional[str] = None,
+                job_id: Optional[str] = None) -> str:
+        """Add a job and return its id"""
+
+    @abstractmethod
+    def lease(self, worker_id: str, abandoned: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """Claim the next job for worker_id until its visibility timeout expires
+
+        Jobs given up on along the way (out of attempts) are appended to abandoned, in
+        their final failed state, so the caller can deliver their callbacks.
+        """
+
+    def lease_many(self, worker_id: str, limit: int,
+                   abandoned: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Claim up to limit jobs"""
+        jobs = []
+        while len(jobs) < limit:
+            job = self.lease(worker_id, abandoned)
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    @abstractmethod
+    def extend(self, job_id: str, worker_id: str) -> bool:
+        """Push back the lease expiry of a job still being worked on"""
+
+    @abstractmethod
+    def release(self, job_id: str, worker_id: str):
+        """Give a leased job back to the queue without counting the attempt"""
+
+    @abstractmethod
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Store a job result; returns False if the lease was lost to another worker"""
+
+    @abstractmethod
+    def fail(self, job_id: str, worker_id: str, error: str, error_code: str) -> bool:
+        """Store a job failure; returns False if the lease was lost to another worker"""
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job by id"""
+
+    @abstractmethod
+    def purge(self) -> int:
+        """Drop old finished jobs and return how many were removed"""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        """Number of jobs per state"""
+
+class SQLiteJobQueue(JobQueue):
+    """Job queue backed by a SQLite database in WAL mode (safe for several processes sharing a filesystem)"""
+
+    def __init__(self, path: str = DEFAULT_DB_PATH, visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, retention: int = DEFAULT_RETENTION,
+                 ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.retention = retention
+        self.ttl = ttl
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection; SQLite connections are cheap and not shared between threads"""
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def enqueue(self, payload: Dict[str, Any], callback_url: Optional[str] = None,
+                job_id: Optional[str] = None) -> str:
+        """Add a job and return its id"""
+        job_id = job_id or str(uuid.uuid4())
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, payload, callback_url, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(payload), callback_url, now, now)
+            )
+        return job_id
+
+    def lease(self, worker_id: str, abandoned: Optional[List[Dict[str, Any]]] = None) -> Optional[Dict[str, Any]]:
+        """Claim the oldest queued job, or a running job whose lease has expired"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status = ? OR (status = ? AND lease_expires < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+
+                if row["attempts"] >= self.max_attempts:
+                    # The job keeps killing its workers; give up on it
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, error_code = ?, lease_owner = NULL, "
+                        "updated_at = ?, finished_at = ? WHERE id = ?",
+                        (FAILED, "Job abandoned after repeated lease expiry", "PROCESSING_FAILED", now, now, row["id"])
+                    )
+                    conn.execute("COMMIT")
+                    given_up = True
+                else:
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_expires = ?, "
+                        "updated_at = ? WHERE id = ?",
+                        (RUNNING, worker_id, now + self.visibility_timeout, now, row["id"])
+                    )
+                    conn.execute("COMMIT")
+                    given_up = False
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        if not given_up:
+            return self.get(row["id"])
+        if abandoned is not None:
+            abandoned.append(self.get(row["id"]))
+        return self.lease(worker_id, abandoned)
+
+    def extend(self, job_id: str, worker_id: str) -> bool:
+        """Push back the lease expiry of a job still being worked on"""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (now + self.visibility_timeout, now, job_id, worker_id, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def release(self, job_id: str, worker_id: str):
+        """Give a leased job back to the queue without counting the attempt"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = MAX(attempts - 1, 0), lease_owner = NULL, "
+                "lease_expires = NULL, updated_at = ? WHERE id = ? AND lease_owner = ? AND status = ?",
+                (QUEUED, time.time(), job_id, worker_id, RUNNING)
+            )
+
+    def complete(self, job_id: str, worker_id: str, result: Dict[str, Any]) -> bool:
+        """Store a job result; returns False if the lease was lost to another worker"""
+        return self._finish(job_id, worker_id, COMPLETED, result=json.dumps(result, ensure_ascii=False))
+
+    def fail(self, job_id: str, worker_id: str, error: str, error_code: str) -> bool:
+        """Store a job failure; returns False if the lease was lost to another worker"""
+        return self._finish(job_id, worker_id, FAILED, error=error, error_code=error_code)
+
+    def _finish(self, job_id: str, worker_id: str, status: str, result: Optional[str] = None,
+                error: Optional[str] = None, error_code: Optional[str] = None) -> bool:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, error_code = ?, lease_owner = NULL, "
+                "lease_expires = NULL, updated_at = ?, finished_at = ? "
+                "WHERE id = ? AND lease_owner = ? AND status = ?",
+                (status, result, error, error_code, now, now, job_id, worker_id, RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a job by id"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return _row_to_job(row) if row else None
+
+    def purge(self) -> int:
+        """Drop finished jobs older than the TTL or beyond the newest `retention` ones"""
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "DELETE FROM jobs WHERE finished_at IS NOT NULL AND (finished_at < ? OR id NOT IN ("
+                "SELECT id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?))",
+                (time.time() - self.ttl, self.retention)
+            )
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        """Number of jobs per state"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        counts = {QUEUED: 0, RUNNING: 0, COMPLETED: 0, FAILED: 0}
+        counts.update({row["status"]: row["count"] for row in rows})
+        return counts
+
+# Queue backends by URL scheme
+BACKENDS: Dict[str, Callable[[str], JobQueue]] = {
+    "sqlite": lambda location: SQLiteJobQueue(location),
+}
+
+def register_backend(scheme: str, factory: Callable[[str], JobQueue]):
+    """Make a queue backend available to open_queue under scheme://"""
+    BACKENDS[scheme] = factory
+
+def open_queue(url: str = DEFAULT_QUEUE_URL) -> JobQueue:
+    """Open a job queue from a URL such as sqlite:///jobs.db (relative) or sqlite:////var/lib/ocr/jobs.db"""
+    scheme, separator, location = url.partition("://")
+    if not separator:
+        # A bare path means a SQLite database
+        scheme, location = "sqlite", url
+    elif scheme == "sqlite":
+        location = location[1:]
+    if scheme not in BACKENDS:
+        raise ValueError(f"Unknown job queue backend: {scheme}")
+    return BACKENDS[scheme](location)
@@ -1,12 +1,9 @@
-import os
-import tempfile
-import requests
-from fastapi import FastAPI, HTTPException, Form
+from fastapi import FastAPI, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, HttpUrl
-from PIL import Image
-import cv2
-from utils import detect_and_process_id_card
+from utils import detect_and_process_id_card, decode_image
+from scheduler import InferenceExecutor, QueueFullError
+import http_client
 
 app = FastAPI(title="Egyptian ID OCR Service", version="1.0.0")
 
@@ -36,25 +33,91 @@ class ErrorResponse(BaseModel):
     error: str
     detail: str
 
-def download_image_from_url(url: str) -> str:
-    """Download image from URL and save to temporary file"""
+# Dedicated executor for blocking validation and model inference
+inference_executor = InferenceExecutor()
+
+async def download_image_from_url(url: str) -> bytes:
+    """Download image from URL into memory through the shared pooled client"""
     try:
-        response = requests.get(str(url), timeout=30)
-        response.raise_for_status()
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            temp_file.write(response.content)
-            return temp_file.name
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=400, detail=f"Failed to download image: {str(e)}")
+        return await http_client.fetch(url)
+    except http_client.DownloadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except http_client.DownloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing image URL: {str(e)}")
 
+def extract_from_bytes(content: bytes) -> IDCardResponse:
+    """Validate and process an ID card image held in memory (blocking, runs on the executor)"""
+    # Decoding doubles as validation: corrupt or non-image content fails here
+    try:
+        image = decode_image(content)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+    
+    # Process the image
+    first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = detect_and_process_id_card(image)
+    
+    return IDCardResponse(
+        first_name=first_name,
+        second_name=second_name,
+        full_name=full_name,
+        national_id=national_id,
+        address=address,
+        birth_date=birth_date,
+        governorate=governorate,
+        gender=gender
+    )
+
+async def read_upload(chunks) -> bytes:
+    """Stream an uploaded image into memory, enforcing the size cap"""
+    try:
+        content = await http_client.read_limited(chunks, allowed_types=http_client.IMAGE_TYPES)
+    except http_client.DownloadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except http_client.UnsupportedContentError:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    return content
+
+async def read_upload_form(request: Request) -> bytes:
+    """Stream the file field of a multipart upload into memory, enforcing the size cap as it arrives"""
+    try:
+        content, _ = await http_client.read_multipart(
+            request.stream(), request.headers.get("content-type", ""), allowed_types=http_client.IMAGE_TYPES
+        )
+    except http_client.DownloadTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except http_client.UnsupportedContentError:
+        raise HTTPException(status_code=400, detail="Invalid image format")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Malformed multipart upload: {str(e)}")
+    if not content:
+        raise HTTPException(status_code=400, detail="Empty image upload")
+    return content
+
+async def run_extraction(content: bytes) -> IDCardResponse:
+    """Run extraction on the executor, shedding load with 429 when the queue is full"""
+    try:
+        result, _, _ = await inference_executor.run(extract_from_bytes, content)
+    except QueueFullError as e:
+        raise HTTPException(
+            status_code=429,
+            detail="Service is busy, please retry later",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    return result
+
 @app.get("/")
 async def root():
     return {"message": "Egyptian ID OCR Service", "version": "1.0.0"}
 
+@app.on_event("shutdown")
+async def shutdown():
+    inference_executor.shutdown()
+    await http_client.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy"}
@@ -64,85 +127,67 @@ async def extract_id_data(request: ImageUrlRequest):
     """
     Extract data from Egyptian ID card image URL (JSON format)
     """
-    temp_file_path = None
-    
     try:
-        # Download image from URL
-        temp_file_path = download_image_from_url(request.image_url)
-        
-        # Validate image
-        try:
-            with Image.open(temp_file_path) as img:
-                img.verify()
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid image format")
-        
-        # Process the image
-        first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = detect_and_process_id_card(temp_file_path)
-        
-        return IDCardResponse(
-            first_name=first_name,
-            second_name=second_name,
-            full_name=full_name,
-            national_id=national_id,
-            address=address,
-            birth_date=birth_date,
-            governorate=governorate,
-            gender=gender
-        )
-        
+        return await run_extraction(await download_image_from_url(request.image_url))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
 
 @app.post("/extract-id-data-form", response_model=IDCardResponse)
 async def extract_id_data_form(image_url: str = Form(...)):
     """
     Extract data from Egyptian ID card image URL (Form-data format)
     """
-    temp_file_path = None
-    
     try:
         # Clean the URL (remove quotes if present)
         clean_url = image_url.strip().strip('"').strip("'")
         
-        # Download image from URL
-        temp_file_path = download_image_from_url(clean_url)
-        
-        # Validate image
-        try:
-            with Image.open(temp_file_path) as img:
-                img.verify()
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid image format")
-        
-        # Process the image
-        first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = detect_and_process_id_card(temp_file_path)
-        
-        return IDCardResponse(
-            first_name=first_name,
-            second_name=second_name,
-            full_name=full_name,
-            national_id=national_id,
-            address=address,
-            birth_date=birth_date,
-            governorate=governorate,
-            gender=gender
-        )
-        
+        return await run_extraction(await download_image_from_url(clean_url))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+
+# The multipart body is parsed by hand as it streams in, so it is described here for the docs
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+@app.post("/extract-id-data/upload", response_model=IDCardResponse, openapi_extra=UPLOAD_REQUEST_BODY)
+async def extract_id_data_upload(request: Request):
+    """
+    Extract data from an uploaded Egyptian ID card image (multipart/form-data)
+    """
+    try:
+        return await run_extraction(await read_upload_form(request))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
+
+@app.post("/extract-id-data/raw", response_model=IDCardResponse)
+async def extract_id_data_raw(request: Request):
+    """
+    Extract data from raw image bytes sent as the request body (application/octet-stream)
+    """
+    try:
+        return await run_extraction(await read_upload(request.stream()))
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing error: {str(e)}")
-    finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,16 +1,28 @@
+import io
 import os
-import tempfile
-import requests
+import hashlib
+import json
+import math
+import socket
 import logging
-from typing import Optional, Dict, Any
-from fastapi import FastAPI, HTTPException, status
+import threading
+from contextlib import contextmanager
+from typing import Optional, Dict, Any, Awaitable, Callable, List, NamedTuple, Tuple
+from fastapi import FastAPI, HTTPException, status, Header, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel, HttpUrl, validator
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel, HttpUrl, ValidationError, validator
 from PIL import Image
 import cv2
 import numpy as np
-from utils import detect_and_process_id_card
+from utils import detect_and_process_id_cards, decode_image, to_response_fields, to_partial_response_fields, Deadline, DeadlineExceeded, NoIDCardDetected, deadline_expired
+from scheduler import AdaptiveLimiter, DegradationPolicy, InferenceExecutor, MicroBatcher, QueueFullError, SingleFlight
+from scheduler import DEFAULT_LANES, INTERACTIVE, BULK
+from job_queue import DEFAULT_VISIBILITY_TIMEOUT, open_queue, public_view
+from rate_limit import RateLimiter
+import http_client
+import asyncio
 import traceback
 from datetime import datetime
 import uuid
@@ -30,6 +42,76 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+class RateLimitMiddleware:
+    """Token-bucket limits per API key (X-API-Key) or client IP, with X-RateLimit-* quota headers"""
+
+    # Cheap endpoints used by load balancers, monitoring and API docs
+    EXEMPT_PATHS = {"/", "/health", "/metrics", "/docs", "/redoc", "/openapi.json"}
+
+    def __init__(self, app, limiter: RateLimiter, trust_proxy: bool = False):
+        self.app = app
+        self.limiter = limiter
+        self.trust_proxy = trust_proxy
+
+    def client_key(self, scope) -> str:
+        """Identify the caller by API key, falling back to its IP address"""
+        headers = dict(scope["headers"])
+        api_key = headers.get(b"x-api-key")
+        if api_key:
+            return f"key:{api_key.decode('latin-1')}"
+        forwarded = headers.get(b"x-forwarded-for")
+        if self.trust_proxy and forwarded:
+            return f"ip:{forwarded.decode('latin-1').split(',')[0].strip()}"
+        return f"ip:{scope['client'][0] if scope.get('client') else 'unknown'}"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.limiter.enabled or scope["path"] in self.EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        client = self.client_key(scope)
+        scope.setdefault("state", {})["rate_limit_client"] = client
+        decision = await self.limiter.check_async(client)
+        quota_headers = [
+            (b"x-ratelimit-limit", str(decision.limit).encode()),
+            (b"x-ratelimit-remaining", str(decision.remaining).encode()),
+            (b"x-ratelimit-reset", str(math.ceil(decision.reset)).encode()),
+        ]
+
+        if not decision.allowed:
+            request_id = str(uuid.uuid4())
+            logger.warning(f"[{request_id}] Rate limit exceeded for {client.partition(':')[0]} client on {scope['path']}")
+            response = JSONResponse(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                content=ErrorResponse(
+                    success=False,
+                    request_id=request_id,
+                    error="Rate limit exceeded",
+                    error_code=ErrorCodes.RATE_LIMITED,
+                    detail=f"Request quota exhausted; retry in {math.ceil(decision.retry_after)}s",
+                    timestamp=datetime.now().isoformat()
+                ).dict(),
+                headers={"Retry-After": str(math.ceil(decision.retry_after))}
+            )
+            response.raw_headers.extend(quota_headers)
+            await response(scope, receive, send)
+            return
+
+        async def send_with_quota(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + quota_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_quota)
+
+# Per-client rate limiting; registered before CORS so rejections still carry CORS headers
+rate_limiter = RateLimiter()
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    trust_proxy=os.environ.get("OCR_RATE_LIMIT_TRUST_PROXY", "").lower() in ("1", "true", "yes")
+)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -40,21 +122,118 @@ app.add_middleware(
 )
 
 # Request/Response Models
+def check_priority(v: Optional[str]) -> Optional[str]:
+    """Validate an optional priority lane name"""
+    if v is not None and v.lower() not in DEFAULT_LANES:
+        raise ValueError(f"priority must be one of: {', '.join(DEFAULT_LANES)}")
+    return v.lower() if v else v
+
 class ImageUrlRequest(BaseModel):
     image_url: HttpUrl
     request_id: Optional[str] = None
+    deadline_ms: Optional[int] = None
+    allow_partial: bool = False
+    priority: Optional[str] = None
+    
+    @validator('request_id', pre=True, always=True)
+    def generate_request_id(cls, v):
+        return v or str(uuid.uuid4())
+    
+    _check_priority = validator('priority', allow_reuse=True)(check_priority)
+    
+    @validator('deadline_ms')
+    def check_deadline(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError("deadline_ms must be positive")
+        return v
+
+class UploadForm(BaseModel):
+    """Text fields of a multipart upload to /extract-id/upload"""
+    request_id: Optional[str] = None
+    deadline_ms: Optional[int] = None
+    allow_partial: bool = False
+    priority: Optional[str] = None
+    
+    @validator('deadline_ms')
+    def check_deadline(cls, v):
+        if v is not None and v <= 0:
+            raise ValueError("deadline_ms must be positive")
+        return v
+
+# Documents the multipart body of /extract-id/upload, which is parsed by hand as it streams in
+UPLOAD_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "request_id": {"type": "string"},
+                        "deadline_ms": {"type": "integer", "exclusiveMinimum": 0},
+                        "allow_partial": {"type": "boolean", "default": False},
+                        "priority": {"type": "string", "enum": list(DEFAULT_LANES)},
+                    },
+                }
+            }
+        },
+    }
+}
+
+class BatchRequest(BaseModel):
+    image_urls: List[HttpUrl]
+    request_id: Optional[str] = None
+    priority: Optional[str] = None
     
     @validator('request_id', pre=True, always=True)
     def generate_request_id(cls, v):
         return v or str(uuid.uuid4())
+    
+    _check_priority = validator('priority', allow_reuse=True)(check_priority)
+
+class JobRequest(BaseModel):
+    image_url: HttpUrl
+    request_id: Optional[str] = None
+    callback_url: Optional[HttpUrl] = None
+    priority: Optional[str] = None
+    
+    @validator('request_id', pre=True, always=True)
+    def generate_request_id(cls, v):
+        return v or str(uuid.uuid4())
+    
+    _check_priority = validator('priority', allow_reuse=True)(check_priority)
+
+class JobResponse(BaseModel):
+    job_id: str
+    status: str
+    request_id: str
+    extracted_data: Optional[Dict[str, str]] = None
+    error: Optional[str] = None
+    error_code: Optional[str] = None
+    created_at: str
+    finished_at: Optional[str] = None
 
 class IDCardResponse(BaseModel):
     success: bool = True
     request_id: str
     extracted_data: Dict[str, str]
     processing_time: float
+    queue_time: float = 0.0
+    partial: bool = False
+    degraded: bool = False
+    skipped_fields: List[str] = []
     timestamp: str
 
+class ExtractionItem(NamedTuple):
+    """One image submitted to the micro-batcher"""
+    content: bytes
+    request_id: str
+    deadline: Optional[Deadline] = None
+    degradable: bool = True  # Optional fields may be skipped under load
+    started: Optional[threading.Event] = None  # Set once a worker starts on the item's batch
+
 class ErrorResponse(BaseModel):
     success: bool = False
     request_id: str
@@ -72,6 +251,22 @@ class HealthResponse(BaseModel):
 # Global variables for health monitoring
 start_time = datetime.now()
 
+# Dedicated executor for blocking validation and model inference
+inference_executor = InferenceExecutor()
+
+# Batch extraction limits
+MAX_BATCH_ITEMS = int(os.environ.get("OCR_MAX_BATCH_ITEMS", 32))
+BATCH_PREFETCH = int(os.environ.get("OCR_BATCH_PREFETCH", 8))
+
+# Pixels per side sampled by the blank-image check
+VALIDATION_SAMPLE_SIZE = 64
+
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_INTERVAL = 0.5
+
+class InvalidImageError(Exception):
+    """Raised when an image fails validation or decoding"""
+
 # Error codes
 class ErrorCodes:
     INVALID_URL = "INVALID_URL"
@@ -80,66 +275,60 @@ class ErrorCodes:
     PROCESSING_FAILED = "PROCESSING_FAILED"
     NO_ID_DETECTED = "NO_ID_DETECTED"
     EXTRACTION_FAILED = "EXTRACTION_FAILED"
+    SERVICE_OVERLOADED = "SERVICE_OVERLOADED"
+    JOB_NOT_FOUND = "JOB_NOT_FOUND"
+    DEADLINE_EXCEEDED = "DEADLINE_EXCEEDED"
+    RATE_LIMITED = "RATE_LIMITED"
     INTERNAL_ERROR = "INTERNAL_ERROR"
 
-def validate_image_url(url: str) -> bool:
-    """Validate if the URL points to a valid image"""
-    try:
-        # Check if URL is accessible
-        response = requests.head(str(url), timeout=10)
-        if response.status_code != 200:
-            return False
-        
-        # Check content type
-        content_type = response.headers.get('content-type', '').lower()
-        valid_types = ['image/jpeg', 'image/jpg', 'image/png', 'image/webp']
-        return any(valid_type in content_type for valid_type in valid_types)
-    except Exception:
-        return False
+# Error codes for HTTP statuses that have a specific meaning
+STATUS_ERROR_CODES = {
+    status.HTTP_404_NOT_FOUND: ErrorCodes.JOB_NOT_FOUND,
+    status.HTTP_429_TOO_MANY_REQUESTS: ErrorCodes.SERVICE_OVERLOADED,
+    status.HTTP_504_GATEWAY_TIMEOUT: ErrorCodes.DEADLINE_EXCEEDED,
+}
+
+async def validate_image_url(url: str) -> bool:
+    """Validate if the URL points to a valid image using a ranged GET for the header bytes"""
+    return await http_client.probe(url) in http_client.IMAGE_TYPES
 
-def download_image_from_url(url: str, request_id: str) -> str:
-    """Download image from URL and save to temporary file with enhanced error handling"""
+async def download_image_from_url(url: str, request_id: str) -> bytes:
+    """Download image from URL into memory with enhanced error handling"""
     try:
         logger.info(f"[{request_id}] Downloading image from URL: {url}")
         
-        # Validate URL first
-        if not validate_image_url(url):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid image URL or unsupported image format"
-            )
-        
-        response = requests.get(str(url), timeout=30, stream=True)
-        response.raise_for_status()
-        
-        # Check file size (limit to 10MB)
-        content_length = response.headers.get('content-length')
-        if content_length and int(content_length) > 10 * 1024 * 1024:
-            raise HTTPException(
-                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
-                detail="Image file too large. Maximum size is 10MB"
-            )
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as temp_file:
-            for chunk in response.iter_content(chunk_size=8192):
-                temp_file.write(chunk)
-            temp_file_path = temp_file.name
+        # Single GET through the pooled client: the magic bytes of the first chunk
+        # are checked before the body is read and the 10MB cap is enforced while streaming
+        content = await http_client.fetch(url, allowed_types=http_client.IMAGE_TYPES)
         
-        logger.info(f"[{request_id}] Image downloaded successfully to: {temp_file_path}")
-        return temp_file_path
+        logger.info(f"[{request_id}] Image downloaded successfully ({len(content)} bytes)")
+        return content
         
-    except requests.exceptions.Timeout:
+    except HTTPException:
+        raise
+    except http_client.DownloadTooLargeError as e:
+        logger.error(f"[{request_id}] Image too large: {url}")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except http_client.UnsupportedContentError as e:
+        logger.error(f"[{request_id}] Unsupported content at URL: {url}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+    except http_client.DownloadTimeoutError:
         logger.error(f"[{request_id}] Timeout downloading image from URL: {url}")
         raise HTTPException(
             status_code=status.HTTP_408_REQUEST_TIMEOUT,
             detail="Request timeout while downloading image"
         )
-    except requests.exceptions.RequestException as e:
+    except http_client.DownloadError as e:
         logger.error(f"[{request_id}] Request error downloading image: {str(e)}")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to download image: {str(e)}"
+            detail=str(e)
         )
     except Exception as e:
         logger.error(f"[{request_id}] Unexpected error downloading image: {str(e)}")
@@ -148,145 +337,367 @@ def download_image_from_url(url: str, request_id: str) -> str:
             detail=f"Error processing image URL: {str(e)}"
         )
 
-def validate_image_file(file_path: str, request_id: str) -> bool:
-    """Validate image file format and content"""
+async def read_upload(chunks, request_id: str) -> bytes:
+    """Stream an uploaded image into memory, enforcing the size cap and image signature"""
+    with upload_errors(request_id):
+        content = await http_client.read_limited(chunks, allowed_types=http_client.IMAGE_TYPES)
+    return check_upload(content, request_id)
+
+async def read_upload_form(http_request: Request, request_id: str) -> Tuple[bytes, Dict[str, str]]:
+    """Stream a multipart upload into memory: the image in the file field, and the text fields
+    
+    The body is parsed as it arrives, so the size cap applies while receiving it and
+    nothing is spooled to a temporary file.
+    """
+    try:
+        with upload_errors(request_id):
+            content, fields = await http_client.read_multipart(
+                http_request.stream(), http_request.headers.get("content-type", ""),
+                allowed_types=http_client.IMAGE_TYPES
+            )
+    except ValueError as e:
+        logger.error(f"[{request_id}] Malformed multipart upload: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Malformed multipart upload: {str(e)}"
+        )
+    return check_upload(content, request_id), fields
+
+@contextmanager
+def upload_errors(request_id: str):
+    """Map upload size and signature failures to HTTP errors"""
     try:
-        logger.info(f"[{request_id}] Validating image file: {file_path}")
-        
-        with Image.open(file_path) as img:
-            # Verify image can be opened
-            img.verify()
-            
-            # Check image dimensions
-            img = Image.open(file_path)  # Reopen after verify
-            width, height = img.size
-            
-            if width < 100 or height < 100:
-                logger.warning(f"[{request_id}] Image too small: {width}x{height}")
-                return False
-            
-            if width > 5000 or height > 5000:
-                logger.warning(f"[{request_id}] Image too large: {width}x{height}")
-                return False
-            
-            # Check if image has content (not just blank)
-            img_array = np.array(img.convert('L'))
-            if np.std(img_array) < 10:  # Very low variance suggests blank image
-                logger.warning(f"[{request_id}] Image appears to be blank or very uniform")
-                return False
-            
-            logger.info(f"[{request_id}] Image validation successful: {width}x{height}")
-            return True
-            
-    except Exception as e:
-        logger.error(f"[{request_id}] Image validation failed: {str(e)}")
-        return False
+        yield
+    except http_client.DownloadTooLargeError as e:
+        logger.error(f"[{request_id}] Uploaded image too large")
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=str(e)
+        )
+    except http_client.UnsupportedContentError:
+        logger.error(f"[{request_id}] Unsupported uploaded content")
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Unsupported image format"
+        )
 
-def process_id_extraction(file_path: str, request_id: str) -> Dict[str, str]:
-    """Process ID card extraction with error handling"""
+def check_upload(content: bytes, request_id: str) -> bytes:
+    """Reject an empty upload"""
+    if not content:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Empty image upload"
+        )
+    
+    logger.info(f"[{request_id}] Image received ({len(content)} bytes)")
+    return content
+
+def validate_image(content: bytes, request_id: str) -> Optional[np.ndarray]:
+    """Decode an image and check it is usable; returns the BGR array, or None when it is not
+    
+    Dimensions come from the file header, so oversized images are rejected before they are
+    decoded, and the blank-image check runs on a strided sample of the decoded pixels.
+    """
     try:
-        logger.info(f"[{request_id}] Starting ID card extraction")
+        logger.info(f"[{request_id}] Validating image ({len(content)} bytes)")
         
-        result = detect_and_process_id_card(file_path)
+        # Check image dimensions (header only, no pixel data is read)
+        with Image.open(io.BytesIO(content)) as img:
+            width, height = img.size
         
-        if not result or len(result) != 8:
-            logger.error(f"[{request_id}] Invalid extraction result: {result}")
-            raise ValueError("Invalid extraction result")
+        if width < 100 or height < 100:
+            logger.warning(f"[{request_id}] Image too small: {width}x{height}")
+            return None
         
-        first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = result
+        if width > 5000 or height > 5000:
+            logger.warning(f"[{request_id}] Image too large: {width}x{height}")
+            return None
         
-        # Validate extracted data
-        if not national_id or len(national_id) != 14:
-            logger.warning(f"[{request_id}] Invalid national ID format: {national_id}")
-            national_id = "Invalid format"
+        # Decode once; the pipeline works on these pixels
+        image = decode_image(content)
         
-        extracted_data = {
-            "first_name": first_name or "Not detected",
-            "second_name": second_name or "Not detected", 
-            "full_name": full_name or "Not detected",
-            "national_id": national_id,
-            "address": address or "Not detected",
-            "birth_date": birth_date or "Not detected",
-            "governorate": governorate or "Not detected",
-            "gender": gender or "Not detected"
-        }
+        # Check if image has content (not just blank) on a sample grid of the pixels
+        sample = image[::max(1, image.shape[0] // VALIDATION_SAMPLE_SIZE), ::max(1, image.shape[1] // VALIDATION_SAMPLE_SIZE)]
+        if np.std(cv2.cvtColor(np.ascontiguousarray(sample), cv2.COLOR_BGR2GRAY)) < 10:  # Very low variance suggests blank image
+            logger.warning(f"[{request_id}] Image appears to be blank or very uniform")
+            return None
         
-        logger.info(f"[{request_id}] ID card extraction completed successfully")
-        return extracted_data
+        logger.info(f"[{request_id}] Image validation successful: {width}x{height}")
+        return image
         
     except Exception as e:
-        logger.error(f"[{request_id}] ID card extraction failed: {str(e)}")
-        logger.error(f"[{request_id}] Traceback: {traceback.format_exc()}")
+        logger.error(f"[{request_id}] Image validation failed: {str(e)}")
+        return None
+
+def format_extracted_data(result: tuple, request_id: str, skipped: Tuple[str, ...] = ()) -> Dict[str, str]:
+    """Turn the pipeline result tuple into the response fields"""
+    try:
+        extracted_data = to_response_fields(result, skipped)
+    except ValueError:
+        logger.error(f"[{request_id}] Invalid extraction result: {result}")
         raise
+    
+    if extracted_data["national_id"] == "Invalid format":
+        logger.warning(f"[{request_id}] Invalid national ID format: {result[3]}")
+    return extracted_data
 
-# API Endpoints
-@app.get("/", response_model=Dict[str, str])
-async def root():
-    """Root endpoint with service information"""
-    return {
-        "service": "Egyptian ID OCR Microservice",
-        "version": "2.0.0",
-        "status": "running",
-        "docs": "/docs"
-    }
+def validate_and_extract_batch(items: List[ExtractionItem]) -> List[Any]:
+    """Validate a batch of items and run the valid ones through the batched pipeline
+    (blocking, runs on the executor)
+    
+    Returns one entry per image: the extracted data, or the exception raised for that image.
+    Under heavy backlog, optional fields of degradable items are not read.
+    """
+    for item in items:
+        if item.started is not None:
+            item.started.set()
+    outcomes: List[Any] = [None] * len(items)
+    request_ids = [item.request_id for item in items]
+    skip = degradation.fields_to_skip(sum(item.degradable for item in items))
+    skips = [skip if item.degradable else () for item in items]
+    images, indexes = [], []
+    for i, item in enumerate(items):
+        image = validate_image(item.content, item.request_id)
+        if image is None:
+            outcomes[i] = InvalidImageError("Invalid image format or corrupted image file")
+            continue
+        images.append(image)
+        indexes.append(i)
+    
+    if images:
+        logger.info(f"Starting ID card extraction for a batch of {len(images)} images")
+    results = detect_and_process_id_cards(images, [items[i].deadline for i in indexes], [skips[i] for i in indexes])
+    for i, result in zip(indexes, results):
+        if isinstance(result, Exception):
+            logger.error(f"[{request_ids[i]}] ID card extraction failed: {str(result)}")
+            outcomes[i] = result
+            continue
+        try:
+            outcomes[i] = format_extracted_data(result, request_ids[i], skips[i])
+            logger.info(f"[{request_ids[i]}] ID card extraction completed successfully")
+        except Exception as e:
+            outcomes[i] = e
+    return outcomes
 
-@app.get("/health", response_model=HealthResponse)
-async def health_check():
-    """Health check endpoint"""
-    uptime = (datetime.now() - start_time).total_seconds()
-    return HealthResponse(
-        status="healthy",
-        version="2.0.0",
-        timestamp=datetime.now().isoformat(),
-        uptime=uptime
-    )
+def expired_item_outcome(item: ExtractionItem) -> Optional[DeadlineExceeded]:
+    """Outcome for an item whose deadline ran out while it waited for a batch"""
+    return DeadlineExceeded() if deadline_expired(item.deadline) else None
 
-@app.post("/extract-id", response_model=IDCardResponse)
-async def extract_id_data(request: ImageUrlRequest):
+def batch_error_code(exc: Exception) -> str:
+    """Map a per-image batch failure to one of the ErrorCodes"""
+    if isinstance(exc, QueueFullError):
+        return ErrorCodes.SERVICE_OVERLOADED
+    if isinstance(exc, (InvalidImageError, http_client.UnsupportedContentError, http_client.DownloadTooLargeError)):
+        return ErrorCodes.INVALID_IMAGE
+    if isinstance(exc, http_client.DownloadError):
+        return ErrorCodes.DOWNLOAD_FAILED
+    if isinstance(exc, NoIDCardDetected):
+        return ErrorCodes.NO_ID_DETECTED
+    return ErrorCodes.EXTRACTION_FAILED
+
+def batch_line(index: int, request_id: str, source: Dict[str, str], outcome: Any) -> str:
+    """Serialize one batch result as an NDJSON line"""
+    line = {"index": index, "request_id": request_id, **source}
+    if isinstance(outcome, Exception):
+        line.update(success=False, error=str(outcome), error_code=batch_error_code(outcome))
+    else:
+        line.update(success=True, extracted_data=outcome)
+    line["timestamp"] = datetime.now().isoformat()
+    return json.dumps(line, ensure_ascii=False) + "\n"
+
+def resolve_priority(value: Optional[str], default: str = INTERACTIVE) -> str:
+    """Priority lane from a body field or X-Priority header, defaulting to default"""
+    try:
+        return check_priority(value) or default
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+async def resolved(outcome: Any) -> bytes:
+    """Awaitable for an upload that has already been read (or failed to read)"""
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+async def stream_batch(request_id: str, sources: List[Dict[str, str]], loaders: List[Callable[[], Awaitable[bytes]]],
+                       priority: str = INTERACTIVE):
+    """Fetch images concurrently and feed them to the micro-batcher, yielding NDJSON lines as they finish
+    
+    Each loader is only called once its image gets a prefetch slot, so nothing is started
+    if the stream is never consumed.
     """
-    Extract data from Egyptian ID card image URL
+    request_ids = [f"{request_id}-{i}" for i in range(len(sources))]
+    prefetch_slots = asyncio.Semaphore(BATCH_PREFETCH)
+    inference_slots = asyncio.Semaphore(micro_batcher.max_batch_size)
     
-    - **image_url**: Valid URL pointing to an image file
-    - **request_id**: Optional request identifier (auto-generated if not provided)
+    async def prefetch_and_extract(index: int, loader: Callable[[], Awaitable[bytes]]):
+        try:
+            async with prefetch_slots:
+                content = await loader()
+            # Downloads continue while earlier images are being inferred
+            async with inference_slots:
+                item = ExtractionItem(content, request_ids[index], degradable=priority == INTERACTIVE)
+                outcome, _, _ = await micro_batcher.submit(item, priority)
+        except Exception as e:
+            logger.error(f"[{request_ids[index]}] Batch item failed: {str(e)}")
+            outcome = e
+        return index, outcome
     
-    Returns extracted ID card data or detailed error information.
+    tasks = [asyncio.create_task(prefetch_and_extract(i, loader)) for i, loader in enumerate(loaders)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            index, outcome = await finished
+            yield batch_line(index, request_ids[index], sources[index], outcome)
+    finally:
+        # Client went away or the stream failed: stop outstanding work
+        for task in tasks:
+            task.cancel()
+
+async def run_extraction(request_id: str, load_image: Awaitable[bytes], deadline: Deadline,
+                         priority: str) -> Tuple[Any, float, float]:
+    """Await the image bytes and validate and extract them through the micro-batcher
+    
+    The download and the wait for a worker are cut off once the deadline is spent. Once a
+    worker has started on the image, the pipeline's own checks between stages enforce the
+    deadline, so the fields read so far are kept for a partial response.
+    """
+    try:
+        content = await within_deadline(load_image, deadline)
+        if deadline.expired():
+            return DeadlineExceeded(), 0.0, 0.0
+        item = ExtractionItem(content, request_id, deadline, priority == INTERACTIVE, threading.Event())
+        submission = asyncio.ensure_future(submit_extraction(item, priority))
+        try:
+            await asyncio.wait({submission}, timeout=deadline.remaining())
+            if not submission.done() and not item.started.is_set():
+                deadline.cancel()
+                return DeadlineExceeded(), 0.0, 0.0
+            return await submission
+        finally:
+            submission.cancel()  # No-op once it has finished
+    except asyncio.CancelledError:
+        # Nobody waits for the result any more: stop the pipeline at its next stage
+        deadline.cancel()
+        raise
+
+async def submit_extraction(item: ExtractionItem, priority: str) -> Tuple[Any, float, float]:
+    """Run one image through the micro-batcher in its priority lane
+    
+    Interactive work is admitted within the adaptive concurrency limit; bulk work is bounded
+    by its own lane queue instead, so it cannot use up the limit.
+    """
+    if priority != INTERACTIVE:
+        return await micro_batcher.submit(item, priority)
+    with concurrency_limiter.acquire():
+        return await micro_batcher.submit(item, priority)
+
+async def within_deadline(awaitable: Awaitable[Any], deadline: Deadline) -> Any:
+    """Await awaitable for what is left of deadline; raises DeadlineExceeded once it is spent"""
+    remaining = deadline.remaining()
+    if remaining is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, remaining)
+    except asyncio.TimeoutError as e:
+        if isinstance(e, DeadlineExceeded):
+            raise
+        deadline.cancel()  # Stop the pipeline at its next stage
+        raise DeadlineExceeded()
+
+async def cancel_on_disconnect(http_request: Request, task: asyncio.Task, request_id: str):
+    """Cancel task once the client has gone away"""
+    while not await http_request.is_disconnected():
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    logger.info(f"[{request_id}] Client disconnected, abandoning request")
+    task.cancel()
+
+async def handle_extraction(request_id: str, load_image: Callable[[], Awaitable[bytes]], dedup_key: Optional[str] = None,
+                            deadline_ms: Optional[int] = None, allow_partial: bool = False,
+                            http_request: Optional[Request] = None, priority: str = INTERACTIVE):
+    """Load the image bytes, run extraction on the executor and build the response
+    
+    Concurrent requests with the same dedup_key (the normalized URL, or the content hash when
+    no key is given) share a single download and extraction. With deadline_ms, the pipeline
+    stops at the next stage once the time budget is spent and the request fails with 504, or
+    returns the fields read so far when allow_partial is set; such requests run on their own,
+    as each one has its own budget. Work stops as well when the client of http_request
+    disconnects. priority selects the scheduler lane.
     """
-    request_id = request.request_id
     start_time = datetime.now()
-    temp_file_path = None
+    deadline = Deadline(deadline_ms / 1000 if deadline_ms else None)
+    watcher = None
     
     try:
         logger.info(f"[{request_id}] Processing new ID extraction request")
         
-        # Download image
-        temp_file_path = download_image_from_url(request.image_url, request_id)
+        try:
+            if dedup_key is None and not deadline_ms:
+                content = await load_image()
+                dedup_key = "sha256:" + hashlib.sha256(content).hexdigest()
+                load_image = lambda: resolved(content)
+            
+            # The request body has been consumed, so polling for a disconnect is now safe
+            if http_request is not None:
+                watcher = asyncio.create_task(cancel_on_disconnect(http_request, asyncio.current_task(), request_id))
+            
+            # Validate and extract through the micro-batcher on the dedicated inference executor
+            extract = lambda: run_extraction(request_id, load_image(), deadline, priority)
+            if deadline_ms:
+                # Not shared: a later caller would inherit an earlier one's budget, and one
+                # caller running out of time would stop the work the others wait for
+                outcome, queue_time, _ = await extract()
+            else:
+                outcome, queue_time, _ = await single_flight.do(f"{dedup_key}|{priority}", extract)
+        except DeadlineExceeded as e:
+            outcome, queue_time = e, 0.0
+        except QueueFullError as e:
+            logger.warning(f"[{request_id}] Rejected: {str(e)}")
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Service is busy, please retry later",
+                headers={"Retry-After": str(e.retry_after)}
+            )
         
-        # Validate image
-        if not validate_image_file(temp_file_path, request_id):
+        if isinstance(outcome, InvalidImageError):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Invalid image format or corrupted image file"
             )
+        skipped_fields = []
+        if isinstance(outcome, DeadlineExceeded):
+            if not (allow_partial and outcome.partial):
+                raise HTTPException(
+                    status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                    detail=f"Processing deadline of {deadline_ms}ms exceeded"
+                )
+            extracted_data, skipped_fields = to_partial_response_fields(outcome.partial)
+            logger.warning(f"[{request_id}] Deadline exceeded, returning partial result without {', '.join(skipped_fields)}")
+        elif isinstance(outcome, Exception):
+            raise outcome
+        else:
+            extracted_data = outcome
+            skipped_fields = [name for name, value in extracted_data.items() if value == "Not processed"]
+            if skipped_fields:
+                logger.info(f"[{request_id}] Degraded under load, skipped {', '.join(skipped_fields)}")
         
-        # Process ID extraction
-        extracted_data = process_id_extraction(temp_file_path, request_id)
-        
-        processing_time = (datetime.now() - start_time).total_seconds()
+        processing_time = (datetime.now() - start_time).total_seconds() - queue_time
         
-        logger.info(f"[{request_id}] Request completed successfully in {processing_time:.2f}s")
+        logger.info(f"[{request_id}] Request completed successfully in {processing_time:.2f}s (queued {queue_time:.2f}s)")
         
         return IDCardResponse(
             success=True,
             request_id=request_id,
             extracted_data=extracted_data,
             processing_time=processing_time,
+            queue_time=queue_time,
+            partial=isinstance(outcome, DeadlineExceeded),
+            degraded=bool(skipped_fields) and not isinstance(outcome, DeadlineExceeded),
+            skipped_fields=skipped_fields,
             timestamp=datetime.now().isoformat()
         )
         
     except HTTPException:
         raise
     except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds()
         logger.error(f"[{request_id}] Unexpected error: {str(e)}")
         logger.error(f"[{request_id}] Traceback: {traceback.format_exc()}")
         
@@ -302,13 +713,354 @@ async def extract_id_data(request: ImageUrlRequest):
             ).dict()
         )
     finally:
-        # Clean up temporary file
-        if temp_file_path and os.path.exists(temp_file_path):
-            try:
-                os.remove(temp_file_path)
-                logger.info(f"[{request_id}] Temporary file cleaned up: {temp_file_path}")
-            except Exception as e:
-                logger.warning(f"[{request_id}] Failed to clean up temporary file: {str(e)}")
+        if watcher is not None:
+            watcher.cancel()
+
+# Concurrent single-image requests are coalesced into batches for the pipeline, with
+# interactive traffic scheduled ahead of bulk work
+micro_batcher = MicroBatcher(inference_executor, validate_and_extract_batch, expired_outcome=expired_item_outcome)
+
+# Under heavy backlog, optional OCR fields are skipped to keep latency down
+degradation = DegradationPolicy(lambda: micro_batcher.depth(INTERACTIVE))
+
+# Single-image requests and jobs beyond the latency-driven limit are shed with 429
+concurrency_limiter = AdaptiveLimiter(retry_after=inference_executor.retry_after)
+
+# Identical concurrent requests (retries, double submits) share one computation
+single_flight = SingleFlight()
+
+# Asynchronous jobs: persisted in the shared job queue and executed by in-process runners
+# and/or standalone workers (worker.py); set OCR_JOB_CONCURRENCY=0 to leave them to the workers
+JOB_CONCURRENCY = int(os.environ.get("OCR_JOB_CONCURRENCY", 2))
+JOB_POLL_INTERVAL = float(os.environ.get("OCR_JOB_POLL_INTERVAL", 1.0))
+JOB_PURGE_INTERVAL = float(os.environ.get("OCR_JOB_PURGE_INTERVAL", 60))
+JOB_LEASE_RENEW_INTERVAL = DEFAULT_VISIBILITY_TIMEOUT / 3  # A running job's lease is extended this often
+job_queue = open_queue()
+job_wakeup = asyncio.Event()
+job_tasks: List[asyncio.Task] = []
+
+def job_response(job: Dict[str, Any]) -> JobResponse:
+    """Public view of a stored job"""
+    return JobResponse(**public_view(job))
+
+async def renew_lease(job: Dict[str, Any], worker_id: str):
+    """Extend a job's lease while it waits for its download and batch, so it is not leased again"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_RENEW_INTERVAL)
+        try:
+            if not await asyncio.to_thread(job_queue.extend, job["id"], worker_id):
+                logger.warning(f"[{job['payload']['request_id']}] Lost the lease on job {job['id']}")
+                return
+        except Exception as e:
+            logger.error(f"[{job['payload']['request_id']}] Could not extend the lease on job {job['id']}: {str(e)}")
+
+async def send_job_callback(job: Dict[str, Any]):
+    """Deliver the final state of a finished job to its callback URL"""
+    if not await http_client.post_json(job["callback_url"], job_response(job).dict()):
+        logger.warning(f"[{job['payload']['request_id']}] Callback for job {job['id']} could not be delivered")
+
+async def process_job(job: Dict[str, Any], worker_id: str) -> bool:
+    """Run one leased job; returns False when it was handed back because the service is saturated"""
+    request_id = job["payload"]["request_id"]
+    renewer = asyncio.create_task(renew_lease(job, worker_id))
+    try:
+        logger.info(f"[{request_id}] Running job {job['id']} (attempt {job['attempts']})")
+        content = await http_client.fetch(job["payload"]["image_url"], allowed_types=http_client.IMAGE_TYPES)
+        # Jobs run in the bulk lane unless queued as interactive; bulk work is never degraded
+        priority = job["payload"].get("priority") or BULK
+        item = ExtractionItem(content, request_id, degradable=priority == INTERACTIVE)
+        outcome, _, _ = await submit_extraction(item, priority)
+    except QueueFullError:
+        await asyncio.to_thread(job_queue.release, job["id"], worker_id)
+        return False
+    except asyncio.CancelledError:
+        # Shutting down: hand the job back so it runs again after restart
+        job_queue.release(job["id"], worker_id)
+        raise
+    except Exception as e:
+        outcome = e
+    finally:
+        renewer.cancel()
+    
+    if isinstance(outcome, Exception):
+        logger.error(f"[{request_id}] Job {job['id']} failed: {str(outcome)}")
+        finished = await asyncio.to_thread(job_queue.fail, job["id"], worker_id, str(outcome), batch_error_code(outcome))
+    else:
+        finished = await asyncio.to_thread(job_queue.complete, job["id"], worker_id, outcome)
+    
+    if finished and job["callback_url"]:
+        await send_job_callback(await asyncio.to_thread(job_queue.get, job["id"]))
+    return True
+
+async def run_jobs(worker_id: str):
+    """Lease and process jobs until cancelled"""
+    while True:
+        try:
+            abandoned = []
+            job = await asyncio.to_thread(job_queue.lease, worker_id, abandoned)
+            for given_up in abandoned:
+                logger.error(f"[{given_up['payload']['request_id']}] Job {given_up['id']} abandoned: {given_up['error']}")
+                if given_up["callback_url"]:
+                    await send_job_callback(given_up)
+            if job is None:
+                job_wakeup.clear()
+                try:
+                    await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            if not await process_job(job, worker_id):
+                await asyncio.sleep(inference_executor.retry_after)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job runner {worker_id} error: {str(e)}")
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+
+async def purge_jobs():
+    """Bound the number and age of finished jobs kept in the queue"""
+    while True:
+        try:
+            purged = await asyncio.to_thread(job_queue.purge)
+            if purged:
+                logger.info(f"Purged {purged} finished jobs")
+        except Exception as e:
+            logger.error(f"Job purge failed: {str(e)}")
+        await asyncio.sleep(JOB_PURGE_INTERVAL)
+
+# API Endpoints
+@app.get("/", response_model=Dict[str, str])
+async def root():
+    """Root endpoint with service information"""
+    return {
+        "service": "Egyptian ID OCR Microservice",
+        "version": "2.0.0",
+        "status": "running",
+        "docs": "/docs"
+    }
+
+@app.get("/health", response_model=HealthResponse)
+async def health_check():
+    """Health check endpoint"""
+    uptime = (datetime.now() - start_time).total_seconds()
+    return HealthResponse(
+        status="healthy",
+        version="2.0.0",
+        timestamp=datetime.now().isoformat(),
+        uptime=uptime
+    )
+
+@app.get("/metrics")
+async def metrics():
+    """Executor, micro-batching, concurrency limit, degradation, deduplication and rate limiting metrics"""
+    return {
+        "executor": inference_executor.stats(),
+        "batching": micro_batcher.stats(),
+        "concurrency": concurrency_limiter.stats(),
+        "degradation": degradation.stats(),
+        "deduplication": single_flight.stats(),
+        "rate_limiting": rate_limiter.stats(),
+        "jobs": await asyncio.to_thread(job_queue.stats),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.on_event("startup")
+async def start_job_runners():
+    """Start the in-process job runners and the retention janitor"""
+    worker_prefix = f"{socket.gethostname()}-{os.getpid()}"
+    for i in range(JOB_CONCURRENCY):
+        job_tasks.append(asyncio.create_task(run_jobs(f"{worker_prefix}-{i}")))
+    job_tasks.append(asyncio.create_task(purge_jobs()))
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    """Stop job runners and the inference executor, and close pooled connections"""
+    for task in job_tasks:
+        task.cancel()
+    await asyncio.gather(*job_tasks, return_exceptions=True)
+    job_tasks.clear()
+    await micro_batcher.shutdown()
+    inference_executor.shutdown()
+    await http_client.close()
+
+@app.post("/extract-id", response_model=IDCardResponse)
+async def extract_id_data(request: ImageUrlRequest, http_request: Request, x_priority: Optional[str] = Header(None)):
+    """
+    Extract data from Egyptian ID card image URL
+    
+    - **image_url**: Valid URL pointing to an image file
+    - **request_id**: Optional request identifier (auto-generated if not provided)
+    - **deadline_ms**: Optional time budget for the whole request, download included
+    - **allow_partial**: Return the fields read so far instead of a 504 when the deadline passes
+    - **priority** (or **X-Priority** header): `interactive` (default) or `bulk`
+    
+    Returns extracted ID card data or detailed error information.
+    """
+    request_id = request.request_id
+    return await handle_extraction(
+        request_id,
+        lambda: download_image_from_url(request.image_url, request_id),
+        dedup_key="url:" + http_client.normalize_url(request.image_url),
+        deadline_ms=request.deadline_ms,
+        allow_partial=request.allow_partial,
+        http_request=http_request,
+        priority=resolve_priority(request.priority or x_priority)
+    )
+
+@app.post("/extract-id/upload", response_model=IDCardResponse, openapi_extra=UPLOAD_REQUEST_BODY)
+async def extract_id_upload(http_request: Request, x_priority: Optional[str] = Header(None)):
+    """
+    Extract data from an uploaded Egyptian ID card image (multipart/form-data)
+    
+    - **file**: JPEG, PNG or WebP image (10MB max)
+    - **request_id**: Optional request identifier (auto-generated if not provided)
+    - **deadline_ms** / **allow_partial**: Optional time budget, as for `/extract-id`
+    - **priority** (or **X-Priority** header): `interactive` (default) or `bulk`
+    """
+    received_id = str(uuid.uuid4())
+    content, fields = await read_upload_form(http_request, received_id)
+    try:
+        form = UploadForm(**fields)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    return await handle_extraction(
+        form.request_id or received_id,
+        lambda: resolved(content),
+        deadline_ms=form.deadline_ms,
+        allow_partial=form.allow_partial,
+        http_request=http_request,
+        priority=resolve_priority(form.priority or x_priority)
+    )
+
+@app.post("/extract-id/raw", response_model=IDCardResponse)
+async def extract_id_raw(http_request: Request, x_request_id: Optional[str] = Header(None),
+                         x_deadline_ms: Optional[int] = Header(None, gt=0), x_allow_partial: bool = Header(False),
+                         x_priority: Optional[str] = Header(None)):
+    """
+    Extract data from raw image bytes sent as the request body (application/octet-stream)
+    
+    - **X-Request-ID** header: Optional request identifier (auto-generated if not provided)
+    - **X-Deadline-Ms** / **X-Allow-Partial** headers: Optional time budget, as for `/extract-id`
+    - **X-Priority** header: `interactive` (default) or `bulk`
+    """
+    request_id = x_request_id or str(uuid.uuid4())
+    return await handle_extraction(
+        request_id,
+        lambda: read_upload(http_request.stream(), request_id),
+        deadline_ms=x_deadline_ms,
+        allow_partial=x_allow_partial,
+        http_request=http_request,
+        priority=resolve_priority(x_priority)
+    )
+
+@app.post("/extract-id/batch")
+async def extract_id_batch(http_request: Request):
+    """
+    Extract data from several Egyptian ID card images, streaming one NDJSON line per image
+    
+    - JSON body: `{"image_urls": [...], "request_id": "optional", "priority": "optional"}`
+    - multipart/form-data: one or more `files` fields and optional `request_id` and `priority`
+    - **X-Priority** header: alternative to the `priority` field (`interactive` by default)
+    
+    Each line carries `index`, `success` and either `extracted_data` or `error` and `error_code`.
+    Lines are emitted as soon as each image finishes, so they may arrive out of order.
+    """
+    content_type = http_request.headers.get("content-type", "")
+    
+    if content_type.startswith("multipart/form-data"):
+        # Parsed as it arrives: each file is capped while it is received, and the body is
+        # rejected as soon as it carries more than MAX_BATCH_ITEMS files
+        request_id = str(uuid.uuid4())
+        try:
+            with upload_errors(request_id):
+                uploads, fields = await http_client.read_multipart_files(
+                    http_request.stream(), content_type, MAX_BATCH_ITEMS, allowed_types=http_client.IMAGE_TYPES
+                )
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid batch request: {str(e)}"
+            )
+        request_id = fields.get("request_id") or request_id
+        priority = resolve_priority(fields.get("priority") or http_request.headers.get("x-priority"))
+        sources = [{"filename": filename} for filename, _ in uploads]
+    else:
+        try:
+            batch = BatchRequest(**await http_request.json())
+        except (ValueError, TypeError) as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid batch request: {str(e)}"
+            )
+        request_id = batch.request_id
+        priority = resolve_priority(batch.priority or http_request.headers.get("x-priority"))
+        sources = [{"image_url": str(url)} for url in batch.image_urls]
+    
+    if not sources:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Batch request contains no images"
+        )
+    if len(sources) > MAX_BATCH_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch request contains {len(sources)} images. Maximum is {MAX_BATCH_ITEMS}"
+        )
+    
+    if content_type.startswith("multipart/form-data"):
+        # Uploads have been read already (or rejected one by one)
+        loaders = [lambda outcome=outcome: resolved(outcome) for _, outcome in uploads]
+    else:
+        loaders = [
+            lambda url=source["image_url"]: http_client.fetch(url, allowed_types=http_client.IMAGE_TYPES)
+            for source in sources
+        ]
+    
+    # The middleware charged one request; each further image costs a token too
+    client = getattr(http_request.state, "rate_limit_client", None)
+    if client is not None:
+        await rate_limiter.charge_async(client, len(sources) - 1)
+    
+    logger.info(f"[{request_id}] Processing batch of {len(sources)} images")
+    return StreamingResponse(stream_batch(request_id, sources, loaders, priority), media_type="application/x-ndjson")
+
+@app.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def create_job(request: JobRequest, x_priority: Optional[str] = Header(None)):
+    """
+    Queue an ID extraction job and return immediately
+    
+    - **image_url**: Valid URL pointing to an image file
+    - **request_id**: Optional request identifier (auto-generated if not provided)
+    - **callback_url**: Optional URL that receives the finished job as a JSON POST
+    - **priority** (or **X-Priority** header): `bulk` (default) or `interactive`
+    
+    Poll `GET /jobs/{job_id}` for the result.
+    """
+    payload = {
+        "image_url": str(request.image_url),
+        "request_id": request.request_id,
+        "priority": resolve_priority(request.priority or x_priority, default=BULK)
+    }
+    callback_url = str(request.callback_url) if request.callback_url else None
+    job_id = await asyncio.to_thread(job_queue.enqueue, payload, callback_url)
+    job_wakeup.set()
+    
+    logger.info(f"[{request.request_id}] Queued job {job_id}")
+    return job_response(await asyncio.to_thread(job_queue.get, job_id))
+
+@app.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_job(job_id: str):
+    """
+    Get the status of a job, with its extracted data or error once finished
+    """
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found"
+        )
+    return job_response(job)
 
 @app.get("/validate-image")
 async def validate_image_endpoint(image_url: str):
@@ -322,7 +1074,7 @@ async def validate_image_endpoint(image_url: str):
     try:
         logger.info(f"[{request_id}] Validating image URL: {image_url}")
         
-        is_valid = validate_image_url(image_url)
+        is_valid = await validate_image_url(image_url)
         
         return {
             "valid": is_valid,
@@ -356,10 +1108,11 @@ async def http_exception_handler(request, exc):
             success=False,
             request_id=request_id,
             error=exc.detail,
-            error_code=ErrorCodes.INTERNAL_ERROR,
+            error_code=STATUS_ERROR_CODES.get(exc.status_code, ErrorCodes.INTERNAL_ERROR),
             detail=exc.detail,
             timestamp=datetime.now().isoformat()
-        ).dict()
+        ).dict(),
+        headers=getattr(exc, "headers", None)
     )
 
 @app.exception_handler(Exception)
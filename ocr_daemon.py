@@ -0,0 +1,167 @@
+"""
+Warm extraction daemon for local integrations (PHP, cron scripts)
+Keeps the models loaded and serves extraction requests on a Unix domain socket, so callers
+skip the import and model loading cost of a fresh Python process per image.
+
+Protocol: every message, in both directions, is a 4-byte big-endian length followed by
+that many bytes of UTF-8 JSON. A connection may carry any number of request/response pairs.
+Requests are extraction requests in the format of extract_single.py --serve ({"url": ...},
+{"path": ...}, {"base64": ...} or {"image": "<url or path>"}, with optional "fields"), or
+{"command": "ping"}; responses use the output schema of extract_single.py.
+
+This module only depends on the standard library; the extraction handler is supplied by
+the caller (see extract_single.py --daemon).
+"""
+
+import os
+import json
+import socket
+import struct
+import logging
+import threading
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger("ocr_daemon")
+
+# Daemon configuration (overridable through the environment)
+DEFAULT_SOCKET = os.environ.get("OCR_DAEMON_SOCKET", "/tmp/egyptian_id_ocr.sock")
+DEFAULT_TIMEOUT = float(os.environ.get("OCR_DAEMON_TIMEOUT", 60))
+DEFAULT_THREADS = int(os.environ.get("OCR_DAEMON_THREADS", 1))
+
+# Largest message accepted from a peer
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024  # Room for a base64-encoded image at the download size cap
+
+_HEADER = struct.Struct(">I")
+
+class DaemonUnavailable(ConnectionError):
+    """Raised when no daemon is listening on the socket"""
+
+def _recv_exactly(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Read size bytes, or return None if the peer closed the connection first"""
+    buffer = bytearray()
+    while len(buffer) < size:
+        chunk = sock.recv(size - len(buffer))
+        if not chunk:
+            return None
+        buffer.extend(chunk)
+    return bytes(buffer)
+
+def send_message(sock: socket.socket, message: Dict[str, Any]):
+    """Write one length-prefixed JSON message"""
+    body = json.dumps(message, ensure_ascii=False).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(body)) + body)
+
+def recv_message(sock: socket.socket) -> Optional[Dict[str, Any]]:
+    """Read one length-prefixed JSON message; None at end of stream"""
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    (size,) = _HEADER.unpack(header)
+    if size > MAX_MESSAGE_BYTES:
+        raise ValueError(f"Message of {size} bytes exceeds the {MAX_MESSAGE_BYTES} byte limit")
+    body = _recv_exactly(sock, size)
+    if body is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return json.loads(body.decode("utf-8"))
+
+def request(message: Dict[str, Any], socket_path: str = DEFAULT_SOCKET,
+            timeout: float = DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    """Send one request to the daemon and wait for its response
+
+    Raises DaemonUnavailable when nothing is listening, so callers can fall back to
+    running the extraction themselves.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            raise DaemonUnavailable(f"No extraction daemon on {socket_path}: {str(e)}")
+        send_message(sock, message)
+        response = recv_message(sock)
+        if response is None:
+            raise ConnectionError("Extraction daemon closed the connection")
+        return response
+    finally:
+        sock.close()
+
+def extract(image: str, socket_path: str = DEFAULT_SOCKET, timeout: float = DEFAULT_TIMEOUT) -> Dict[str, Any]:
+    """Ask the daemon to extract the ID card in image (URL, file:// URL or path)"""
+    return request({"image": image}, socket_path, timeout)
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, handler: Callable[[Dict[str, Any]], Dict[str, Any]], executor: ThreadPoolExecutor):
+        self.extract = handler
+        self.executor = executor
+        super().__init__(socket_path, _ConnectionHandler)
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    """Serve request/response pairs on one client connection until it closes"""
+
+    def handle(self):
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (ValueError, ConnectionError) as e:
+                logger.warning(f"Dropping connection: {str(e)}")
+                return
+            if message is None:
+                return
+            send_message(self.request, self.respond(message))
+
+    def respond(self, message: Any) -> Dict[str, Any]:
+        if not isinstance(message, dict):
+            return {"error": "Invalid request: Request must be a JSON object", "status": "error"}
+        if message.get("command") == "ping":
+            return {"status": "ok", "pid": os.getpid()}
+        # Extraction runs on the warm worker threads, not the connection thread
+        return self.server.executor.submit(self.server.extract, message).result()
+
+def _in_use(socket_path: str) -> bool:
+    """True if a daemon already answers on socket_path"""
+    try:
+        return request({"command": "ping"}, socket_path, timeout=5).get("status") == "ok"
+    except (OSError, ValueError):
+        return False
+
+def serve(handler: Callable[[Dict[str, Any]], Dict[str, Any]], socket_path: str = DEFAULT_SOCKET,
+          threads: int = DEFAULT_THREADS, warm_up: Optional[Callable[[], None]] = None,
+          stop: Optional[threading.Event] = None):
+    """Serve extraction requests on socket_path until stop is set
+
+    handler maps a request dict to a response dict and must not raise. Each of the
+    threads worker threads runs warm_up once before taking requests, as models are
+    loaded per thread.
+    """
+    if os.path.exists(socket_path):
+        if _in_use(socket_path):
+            raise RuntimeError(f"Another extraction daemon is listening on {socket_path}")
+        os.unlink(socket_path)  # Left behind by a daemon that died
+
+    executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="ocr-daemon", initializer=warm_up)
+    # Load the models on every worker thread before accepting connections
+    for future in [executor.submit(lambda: None) for _ in range(threads)]:
+        future.result()
+
+    old_umask = os.umask(0o117)  # Socket readable and writable by owner and group only
+    try:
+        server = _Server(socket_path, handler, executor)
+    finally:
+        os.umask(old_umask)
+
+    stop = stop or threading.Event()
+    threading.Thread(target=lambda: (stop.wait(), server.shutdown()), daemon=True).start()
+    logger.info(f"Extraction daemon listening on {socket_path} with {threads} worker threads")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        executor.shutdown(wait=True)
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        logger.info("Extraction daemon stopped")
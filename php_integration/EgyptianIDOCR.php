@@ -4,7 +4,9 @@
  * Egyptian ID OCR Integration Class
  * 
  * This class provides methods to integrate with the Egyptian ID OCR service
- * using direct Python execution from PHP.
+ * using direct Python execution from PHP. When the extraction daemon
+ * (python3 extract_single.py --daemon) is running, images are sent to it over
+ * its Unix socket instead, so the models do not have to be loaded per image.
  * 
  * @author Abdelrahman Saleh
  * @version 1.0.0
@@ -15,6 +17,7 @@ class EgyptianIDOCR
     private $servicePath;
     private $timeout;
     private $dbConnection;
+    private $socketPath;
     
     /**
      * Constructor
@@ -23,13 +26,15 @@ class EgyptianIDOCR
      * @param string $servicePath Path to the OCR service directory
      * @param int $timeout Timeout in seconds for OCR processing (default: 60)
      * @param PDO $dbConnection Database connection for storing results
+     * @param string|null $socketPath Extraction daemon socket (default: '/tmp/egyptian_id_ocr.sock', null disables)
      */
-    public function __construct($pythonPath = 'python3', $servicePath = null, $timeout = 60, $dbConnection = null)
+    public function __construct($pythonPath = 'python3', $servicePath = null, $timeout = 60, $dbConnection = null, $socketPath = '/tmp/egyptian_id_ocr.sock')
     {
         $this->pythonPath = $pythonPath;
         $this->servicePath = $servicePath ?: __DIR__ . '/../';
         $this->timeout = $timeout;
         $this->dbConnection = $dbConnection;
+        $this->socketPath = $socketPath;
     }
     
     /**
@@ -47,14 +52,21 @@ class EgyptianIDOCR
                 throw new Exception('Invalid image URL provided');
             }
             
-            // Prepare the Python command
-            $command = $this->buildCommand($imageUrl);
+            // Use the warm daemon when it is running
+            $result = $this->requestDaemon(['image' => $imageUrl]);
             
-            // Execute the command
-            $output = $this->executeCommand($command);
-            
-            // Parse the output
-            $result = $this->parseOutput($output);
+            if ($result === null) {
+                // Prepare the Python command
+                $command = $this->buildCommand($imageUrl);
+                
+                // Execute the command
+                $output = $this->executeCommand($command);
+                
+                // Parse the output
+                $result = $this->parseOutput($output);
+            } elseif (($result['status'] ?? '') !== 'success') {
+                throw new Exception('Extraction failed: ' . ($result['error'] ?? 'unknown error'));
+            }
             
             // Save to database if requested and connection available
             if ($saveToDatabase && $this->dbConnection) {
@@ -132,6 +144,66 @@ class EgyptianIDOCR
         return implode("\n", $output);
     }
     
+    /**
+     * Send a request to the extraction daemon
+     * 
+     * Messages are a 4-byte big-endian length followed by UTF-8 JSON.
+     * 
+     * @param array $message Request message
+     * @return array|null Daemon response, or null if no daemon is running
+     * @throws Exception If the daemon fails while handling the request
+     */
+    private function requestDaemon(array $message)
+    {
+        if (!$this->socketPath || !file_exists($this->socketPath)) {
+            return null;
+        }
+        
+        $socket = @stream_socket_client('unix://' . $this->socketPath, $errno, $errstr, 5);
+        if ($socket === false) {
+            return null;
+        }
+        
+        try {
+            stream_set_timeout($socket, $this->timeout);
+            $body = json_encode($message, JSON_UNESCAPED_UNICODE | JSON_UNESCAPED_SLASHES);
+            fwrite($socket, pack('N', strlen($body)) . $body);
+            
+            $length = unpack('N', $this->readExactly($socket, 4))[1];
+            $response = json_decode($this->readExactly($socket, $length), true);
+        } finally {
+            fclose($socket);
+        }
+        
+        if (json_last_error() !== JSON_ERROR_NONE) {
+            throw new Exception('Failed to parse daemon response');
+        }
+        
+        return $response;
+    }
+    
+    /**
+     * Read an exact number of bytes from a stream
+     * 
+     * @param resource $socket Stream to read from
+     * @param int $length Number of bytes
+     * @return string Bytes read
+     * @throws Exception If the stream closes or times out first
+     */
+    private function readExactly($socket, $length)
+    {
+        $data = '';
+        while (strlen($data) < $length) {
+            $chunk = fread($socket, $length - strlen($data));
+            if ($chunk === false || $chunk === '') {
+                $meta = stream_get_meta_data($socket);
+                throw new Exception($meta['timed_out'] ? 'Extraction daemon timed out' : 'Extraction daemon closed the connection');
+            }
+            $data .= $chunk;
+        }
+        return $data;
+    }
+    
     /**
      * Parse the Python script output
      * 
@@ -258,6 +330,12 @@ class EgyptianIDOCR
     public function testConnection()
     {
         try {
+            // A running daemon answers a ping
+            $response = $this->requestDaemon(['command' => 'ping']);
+            if ($response !== null) {
+                return ($response['status'] ?? '') === 'ok';
+            }
+            
             // Test with a simple command
             $command = escapeshellcmd($this->pythonPath) . ' --version';
             exec($command, $output, $returnCode);
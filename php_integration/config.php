@@ -17,6 +17,7 @@ define('DB_CHARSET', 'utf8mb4');
 define('PYTHON_PATH', 'python3');  // Path to Python executable
 define('SERVICE_PATH', '/path/to/ID_Extraction/');  // Path to OCR service directory
 define('OCR_TIMEOUT', 60);  // Timeout in seconds
+define('OCR_SOCKET', '/tmp/egyptian_id_ocr.sock');  // Extraction daemon socket (python3 extract_single.py --daemon)
 
 // Optional: Logging Configuration
 define('LOG_LEVEL', 'INFO');  // DEBUG, INFO, WARNING, ERROR
@@ -2,17 +2,63 @@
 """
 Process users.json file and extract national ID numbers from images
 Adds 'national_id_number' field to each user object
+
+Users flow through three stages joined by bounded queues, all running at once: concurrent
+downloads, decoding/PDF rendering on a thread pool, and batched inference on worker threads
+with warm models. Results are written in input order.
+
+PDFs are opened one page at a time, at OCR_PDF_DPI and then OCR_PDF_MAX_DPI if needed,
+and stop at the first page with a valid national ID. Pages that are a single embedded JPEG
+scan are decoded directly with pypdf instead of being rasterized.
+
+Input and output are streamed: a JSON array is parsed incrementally (or JSON lines read
+line by line) and each enriched user is written as soon as it is ready, so memory use does
+not grow with the number of users.
+
+Finished users are recorded in a SQLite progress journal next to the output, and the
+output only replaces its destination once complete. After a crash, --resume reuses the
+journal so only the remaining users are processed.
+
+Users whose files have the same normalized http(s) URL or local path, or turn out to have
+identical content once downloaded, are extracted once and share the result (disable with --no-dedup).
+
+Progress (users done, images/s, ETA, success rate) is shown live on stderr unless
+--no-progress is given. The run ends with a summary of stage timing percentiles and
+failure reasons, also written as JSON to output_file + .stats.json (see --stats).
+
+Large backfills can be split across machines with --shard i/N (users are assigned by a
+stable hash of user_id), and the shard outputs combined again with the merge subcommand:
+  python process_users.py users.json --shard 1/4          (on each node, 1/4 .. 4/4)
+  python process_users.py merge users.json users.shard-*-of-4.json -o users_processed.json
 """
 
+import io
+import re
 import json
+import math
+import time
+import hashlib
 import sys
 import os
-import tempfile
-import requests
+import queue
+import sqlite3
 import logging
 import warnings
-from utils import detect_and_process_id_card
-from pdf2image import convert_from_path, convert_from_bytes
+import argparse
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+import cv2
+import numpy as np
+from utils import detect_and_process_id_cards, decode_image, warm_up_models
+import http_client
+from pdf2image import convert_from_bytes, pdfinfo_from_bytes
+
+try:
+    from pypdf import PdfReader  # Lets scanned PDF pages skip rasterization
+except ImportError:  # Without it every page is rasterized
+    PdfReader = None
 
 # Suppress all logging and warnings
 logging.disable(logging.CRITICAL)
@@ -24,157 +70,1057 @@ sys.stderr = open(os.devnull, 'w')
 # Suppress ultralytics warnings
 os.environ['ULTRALYTICS_OFFLINE'] = '1'
 
-def download_file_from_url(url):
-    """Download file from URL and save to temporary file"""
-    try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Determine file extension from URL or content type
-        if url.lower().endswith('.pdf'):
-            suffix = ".pdf"
-        elif url.lower().endswith(('.jpg', '.jpeg')):
-            suffix = ".jpg"
-        elif url.lower().endswith('.png'):
-            suffix = ".png"
-        else:
-            suffix = ".tmp"
-        
-        # Create temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
-            temp_file.write(response.content)
-            return temp_file.name
-    except Exception as e:
-        raise Exception(f"Failed to download file: {str(e)}")
+# Pipeline configuration (overridable through the environment or the command line)
+DEFAULT_CONNECTIONS = int(os.environ.get("OCR_DOWNLOAD_CONCURRENCY", 8))
+DEFAULT_DECODERS = int(os.environ.get("OCR_DECODE_THREADS", 2))
+DEFAULT_THREADS = int(os.environ.get("OCR_WORKER_THREADS", 1))
+DEFAULT_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+# Results remembered for reuse by later users with the same file URL or content
+DEDUP_CACHE_SIZE = int(os.environ.get("OCR_DEDUP_CACHE_SIZE", 100000))
 
-def convert_pdf_to_image(pdf_path):
-    """Convert PDF to images and return all pages as image paths"""
-    try:
-        # Convert PDF to images (all pages)
-        images = convert_from_path(pdf_path, dpi=300)
-        
-        if not images:
-            raise Exception("No pages found in PDF")
-        
-        # Save all pages as temporary images
-        image_paths = []
-        for i, image in enumerate(images):
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f"_page_{i+1}.jpg") as temp_file:
-                image.save(temp_file.name, 'JPEG', quality=95)
-                image_paths.append(temp_file.name)
-        
-        return image_paths
-    except Exception as e:
-        raise Exception(f"Failed to convert PDF to image: {str(e)}")
+# PDF pages are rendered at the lower DPI first, and again at the higher one when that
+# gives no valid national ID
+DEFAULT_PDF_DPI = int(os.environ.get("OCR_PDF_DPI", 150))
+MAX_PDF_DPI = int(os.environ.get("OCR_PDF_MAX_DPI", 300))
+# Smallest embedded page image (shorter side, in pixels) taken as the scan itself rather
+# than a logo or thumbnail on a rendered page
+MIN_EMBEDDED_IMAGE_SIDE = 300
+NATIONAL_ID_LENGTH = 14
 
-def extract_national_id(file_url):
-    """Extract national ID from image URL or PDF"""
-    temp_file_path = None
-    pdf_temp_paths = []
-    
-    try:
-        # Handle URL vs local file
-        if file_url.startswith(('http://', 'https://')):
-            # Download file from URL
-            temp_file_path = download_file_from_url(file_url)
-            file_path = temp_file_path
-        elif file_url.startswith('file://'):
-            # Handle file:// URLs
-            file_path = file_url[7:]  # Remove 'file://' prefix
+# Progress reporting: redraw interval on a terminal, and seconds between progress lines
+# when stderr is redirected to a log
+PROGRESS_REFRESH = 0.5
+PROGRESS_INTERVAL = float(os.environ.get("OCR_PROGRESS_INTERVAL", 10))
+STAGES = ("download", "decode", "infer")
+
+# Users file formats: a JSON array, or one JSON object per line
+JSON = "json"
+JSONL = "jsonl"
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+
+# Streaming parser limits
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_CHARS = 16 * 1024 * 1024
+_WHITESPACE = re.compile(r'\s*')
+
+class ArgumentParser(argparse.ArgumentParser):
+    """Print usage errors on stdout (stderr is silenced)"""
+
+    def error(self, message):
+        self.print_usage(sys.stdout)
+        print(f"Error: {message}")
+        sys.exit(1)
+
+class UserTask:
+    """One user record moving through the pipeline"""
+
+    def __init__(self, index: int, user: Dict[str, Any]):
+        self.index = index
+        self.user = user
+        self.content: Optional[bytes] = None
+        self.image: Optional[np.ndarray] = None  # First page, for PDFs
+        self.pdf: Optional[PdfPages] = None
+        self.pdf_dpi: Optional[int] = None  # DPI the first page was rendered at (None if embedded)
+        self.national_id = ""
+        self.error: Optional[str] = None
+        self.resumed = False  # Result taken from the progress journal
+        self.failure: Optional[str] = None  # Failure reason, "stage: kind"
+        self.timings: Dict[str, float] = {}  # Seconds spent in each stage
+        self.images = 0  # Images run through inference (PDFs may need several)
+        self.keys: List[str] = []  # Deduplication keys this task computes the result for
+        self.followers: List[UserTask] = []  # Duplicates waiting for this task's result
+        self.duplicate: Optional[str] = None  # "url" or "content" when another task's result was reused
+
+def read_file(file_url: str) -> bytes:
+    """Download a file URL, or read a file:// URL or local path"""
+    if file_url.startswith(('http://', 'https://')):
+        return http_client.fetch_sync(file_url)
+    if file_url.startswith('file://'):
+        file_url = file_url[7:]  # Remove 'file://' prefix
+    with open(file_url, 'rb') as f:
+        return f.read()
+
+class PdfPages:
+    """Pages of a PDF, turned into BGR images one at a time on request
+
+    A page that is just an embedded JPEG scan is decoded directly (needs pypdf); other
+    pages are rasterized in memory at the requested DPI.
+    """
+
+    def __init__(self, content: bytes):
+        self.content = content
+        self.reader = None
+        if PdfReader is not None:
+            try:
+                self.reader = PdfReader(io.BytesIO(content))
+            except Exception:
+                pass  # Left to poppler, which copes with more damaged files
+        try:
+            self.count = len(self.reader.pages) if self.reader else pdfinfo_from_bytes(content)["Pages"]
+        except Exception as e:
+            raise Exception(f"Failed to convert PDF to image: {str(e)}")
+        if not self.count:
+            raise Exception("Failed to convert PDF to image: No pages found in PDF")
+
+    def page(self, number: int, dpi: int = DEFAULT_PDF_DPI) -> Tuple[np.ndarray, Optional[int]]:
+        """Image of page number (1-based), and the DPI it was rendered at (None if embedded)"""
+        image = self._embedded_scan(number)
+        if image is not None:
+            return image, None
+        try:
+            pages = convert_from_bytes(self.content, dpi=dpi, first_page=number, last_page=number)
+            if not pages:
+                raise Exception(f"Page {number} could not be rendered")
+            return cv2.cvtColor(np.array(pages[0].convert('RGB')), cv2.COLOR_RGB2BGR), dpi
+        except Exception as e:
+            raise Exception(f"Failed to convert PDF to image: {str(e)}")
+
+    def _embedded_scan(self, number: int) -> Optional[np.ndarray]:
+        """The page's only image, if it is a JPEG large enough to be the scan itself"""
+        if self.reader is None:
+            return None
+        try:
+            images = self.reader.pages[number - 1].images
+            if len(images) != 1 or not images[0].name.lower().endswith(('.jpg', '.jpeg')):
+                return None
+            image = decode_image(images[0].data)
+        except Exception:
+            return None
+        return image if min(image.shape[:2]) >= MIN_EMBEDDED_IMAGE_SIDE else None
+
+def file_key(file_url: str) -> str:
+    """Deduplication key of a file: the normalized URL of an http(s) file, or the absolute path of a local one"""
+    if file_url.startswith(('http://', 'https://')):
+        try:
+            return http_client.normalize_url(file_url)
+        except ValueError:
+            return file_url  # Malformed (e.g. a bad port): the download stage reports it for this user
+    if file_url.startswith('file://'):
+        file_url = file_url[7:]  # Read as a path, where '#' and '?' are part of the name
+    return os.path.abspath(file_url)
+
+def failure_kind(error: Exception) -> str:
+    """Short grouping key for an error: its type, or the message before any detail"""
+    if type(error) is Exception:
+        return str(error).split(':', 1)[0][:80]
+    return type(error).__name__
+
+def national_id_of(outcome) -> str:
+    """National ID from a pipeline outcome (extraction tuple or exception)"""
+    return "" if isinstance(outcome, Exception) else outcome[3] or ""
+
+def is_valid_national_id(national_id: str) -> bool:
+    return len(national_id) == NATIONAL_ID_LENGTH and national_id.isdigit()
+
+class UserPipeline:
+    """Download, decode and inference stages joined by bounded queues
+
+    Each stage has its own workers, so downloads, decoding and inference all overlap.
+    At most max_in_flight users are between reading and output at any time, which also
+    bounds the buffer used to restore input order.
+
+    With dedup, a user whose file has the same key (see file_key) as another user's, or
+    downloads to the same bytes, is not extracted again: it waits for that user's result,
+    or reuses it from a cache of recent results.
+    """
+
+    def __init__(self, connections: int = DEFAULT_CONNECTIONS, decoders: int = DEFAULT_DECODERS,
+                 threads: int = DEFAULT_THREADS, batch_size: int = DEFAULT_BATCH_SIZE, dedup: bool = True):
+        self.connections = connections
+        self.decoders = decoders
+        self.threads = threads
+        self.batch_size = batch_size
+        self.dedup = dedup
+        self._dedup_lock = threading.Lock()
+        self._leaders: Dict[str, UserTask] = {}  # Tasks computing the result for a key
+        self._results: OrderedDict = OrderedDict()  # Recent results by key, least recent first
+        self.max_in_flight = connections + decoders + 2 * threads * batch_size
+        self._lock = threading.Lock()
+        self._pending: Dict[int, UserTask] = {}
+        self._next = 0
+        self._failure: Optional[BaseException] = None
+
+    def run(self, users: Iterable[Dict[str, Any]], emit: Callable[[UserTask], None],
+            resume: Optional[Callable[[UserTask], bool]] = None):
+        """Process users, calling emit with each finished task in input order
+
+        resume, when given, may fill in a task's result from an earlier run and return True
+        to skip processing it.
+        """
+        self._emit = emit
+        self._in_flight = threading.BoundedSemaphore(self.max_in_flight)
+        downloads = queue.Queue(maxsize=self.connections)
+        decodes = queue.Queue(maxsize=self.decoders * 2)
+        inferences = queue.Queue(maxsize=self.threads * self.batch_size * 2)
+
+        stages = [
+            self._start(self.connections, "download", self._stage, "download", downloads, self._download, decodes),
+            self._start(self.decoders, "decode", self._stage, "decode", decodes, self._decode, inferences),
+            self._start(self.threads, "infer", self._infer, inferences),
+        ]
+        try:
+            for index, user in enumerate(users):
+                self._in_flight.acquire()
+                if self._failure is not None:
+                    break
+                task = UserTask(index, user)
+                if resume is not None and resume(task):
+                    self._finish(task)
+                elif not self._deduplicate(task, "url", file_key(user['file'])):
+                    downloads.put(task)
+        finally:
+            # Close the stages in order, once each has drained its queue
+            for workers, inbox in zip(stages, (downloads, decodes, inferences)):
+                for _ in workers:
+                    inbox.put(None)
+                for worker in workers:
+                    worker.join()
+        if self._failure is not None:
+            raise self._failure
+
+    def _start(self, count: int, name: str, target: Callable, *args) -> List[threading.Thread]:
+        workers = [threading.Thread(target=target, args=args, name=f"users-{name}-{i}", daemon=True) for i in range(count)]
+        for worker in workers:
+            worker.start()
+        return workers
+
+    def _stage(self, name: str, inbox: queue.Queue, handle: Callable[[UserTask], None], outbox: queue.Queue):
+        """Apply handle to each task and pass it on; failed tasks go straight to the output"""
+        while True:
+            task = inbox.get()
+            if task is None:
+                return
+            started = time.perf_counter()
+            try:
+                if handle(task) is False:
+                    continue  # A duplicate, settled along with the task it duplicates
+            except Exception as e:
+                task.error = str(e)
+                task.failure = f"{name}: {failure_kind(e)}"
+            task.timings[name] = time.perf_counter() - started
+            if task.failure is None:
+                outbox.put(task)
+            else:
+                self._settle(task)
+
+    def _download(self, task: UserTask) -> bool:
+        task.content = read_file(task.user['file'])
+        if self._deduplicate(task, "sha256", hashlib.sha256(task.content).hexdigest()):
+            task.content = None
+            return False
+        return True
+
+    def _decode(self, task: UserTask):
+        if http_client.sniff_file_type(task.content[:http_client.SNIFF_BYTES]) == "pdf":
+            # Only the first page now; later pages are rendered if it has no ID
+            task.pdf = PdfPages(task.content)
+            task.image, task.pdf_dpi = task.pdf.page(1)
         else:
-            # Assume it's a local file path
-            file_path = file_url
-        
-        # Check if it's a PDF file
-        if file_path.lower().endswith('.pdf'):
-            # Convert PDF to images (all pages)
-            pdf_temp_paths = convert_pdf_to_image(file_path)
-            
-            # Try to extract ID from each page
-            for i, image_path in enumerate(pdf_temp_paths):
+            task.image = decode_image(task.content)
+        task.content = None
+
+    def _infer(self, inbox: queue.Queue):
+        """Run the first page of whatever is ready through the pipeline in batches"""
+        try:
+            warm_up_models()
+        except Exception:
+            pass  # Reported again for every batch below
+        stopping = False
+        while not stopping:
+            batch = [inbox.get()]
+            while len(batch) < self.batch_size and batch[-1] is not None:
                 try:
-                    print(f"    Trying page {i+1}/{len(pdf_temp_paths)}...")
-                    first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = detect_and_process_id_card(image_path)
-                    
-                    if national_id:
-                        print(f"    ✅ Found ID on page {i+1}: {national_id}")
-                        return national_id
-                except Exception as e:
-                    print(f"    ❌ Page {i+1} failed: {str(e)}")
+                    batch.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                # One end marker per inference thread
+                batch.pop()
+                stopping = True
+            if batch:
+                self._infer_batch(batch)
+
+    def _infer_batch(self, batch: List[UserTask]):
+        started = time.perf_counter()
+        try:
+            outcomes = detect_and_process_id_cards([task.image for task in batch])
+        except Exception as e:
+            outcomes = [e] * len(batch)
+        share = (time.perf_counter() - started) / len(batch)  # Batch time split evenly
+        for task, outcome in zip(batch, outcomes):
+            started = time.perf_counter()
+            task.images = 1
+            try:
+                outcome = self._search_pdf(task, outcome)
+                if not task.national_id:
+                    if isinstance(outcome, Exception):
+                        task.error = str(outcome)
+                        task.failure = f"infer: {failure_kind(outcome)}"
+                    else:
+                        task.failure = "infer: ID number not read"
+            except Exception as e:
+                task.error = str(e)
+                task.failure = f"infer: {failure_kind(e)}"
+            task.timings["infer"] = share + time.perf_counter() - started
+            task.image = task.pdf = None
+            self._settle(task)
+
+    def _search_pdf(self, task: UserTask, outcome):
+        """Take the national ID from the first page, then work through a PDF until one is valid
+
+        A rendered page without a valid ID (no card found, or digits only partly read) is
+        tried once more at MAX_PDF_DPI before moving on; later pages are only rendered
+        when needed.
+        """
+        task.national_id = national_id_of(outcome)
+        number, dpi = 1, task.pdf_dpi
+        while task.pdf is not None and not is_valid_national_id(task.national_id):
+            if dpi is not None and dpi < MAX_PDF_DPI:
+                dpi = MAX_PDF_DPI
+            elif number < task.pdf.count:
+                number, dpi = number + 1, DEFAULT_PDF_DPI
+            else:
+                break
+            image, dpi = task.pdf.page(number, dpi)
+            outcome = detect_and_process_id_cards([image])[0]
+            task.images += 1
+            national_id = national_id_of(outcome)
+            if is_valid_national_id(national_id) or not task.national_id:
+                task.national_id = national_id
+        return outcome
+
+    def _deduplicate(self, task: UserTask, kind: str, value: str) -> bool:
+        """Settle task with the result for kind:value, now or once the task computing it is done
+
+        Returns False when there is no such result or task: task then computes it.
+        """
+        if not self.dedup:
+            return False
+        key = f"{kind}:{value}"
+        with self._dedup_lock:
+            result = self._results.get(key)
+            if result is None:
+                leader = self._leaders.get(key)
+                if leader is None:
+                    self._leaders[key] = task
+                    task.keys.append(key)
+                    return False
+                task.duplicate = "url" if kind == "url" else "content"
+                leader.followers.append(task)
+                return True
+            self._results.move_to_end(key)
+        task.duplicate = "url" if kind == "url" else "content"
+        task.national_id, task.error, task.failure = result
+        self._settle(task, reusable=True)
+        return True
+
+    def _settle(self, task: UserTask, reusable: Optional[bool] = None):
+        """Finish task and hand its result to the duplicates waiting on it
+
+        Only results of inference are kept for later duplicates (reusable defaults to
+        whether task ran inference): a failed download may be transient.
+        """
+        if reusable is None:
+            reusable = task.images > 0
+        result = (task.national_id, task.error, task.failure)
+        with self._dedup_lock:
+            for key in task.keys:
+                del self._leaders[key]
+                if reusable:
+                    self._results[key] = result
+                    if len(self._results) > DEDUP_CACHE_SIZE:
+                        self._results.popitem(last=False)
+            followers, task.followers = task.followers, []
+        self._finish(task)
+        for follower in followers:
+            follower.national_id, follower.error, follower.failure = result
+            self._settle(follower, reusable)
+
+    def _finish(self, task: UserTask):
+        """Emit tasks in input order as the gaps before them fill"""
+        with self._lock:
+            self._pending[task.index] = task
+            while self._next in self._pending:
+                ready = self._pending.pop(self._next)
+                self._next += 1
+                try:
+                    if self._failure is None:
+                        self._emit(ready)
+                except BaseException as e:
+                    self._failure = e
+                finally:
+                    self._in_flight.release()
+
+def user_key(user_id: Any) -> str:
+    """Canonical text form of a user_id; JSON keeps 1 and "1" apart"""
+    return json.dumps(user_id, ensure_ascii=False)
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    """Parse a 1-based shard selector such as 2/8"""
+    index, _, count = value.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, expected i/N such as 1/4")
+    if not 1 <= index <= count:
+        raise argparse.ArgumentTypeError(f"invalid shard {value!r}, i must be between 1 and N")
+    return index, count
+
+def shard_of(user_id: Any, count: int) -> int:
+    """1-based shard of a user: a stable hash of user_id, the same on every machine and run"""
+    digest = hashlib.sha1(user_key(user_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count + 1
+
+def shard_file_name(input_file: str, shard: Tuple[int, int]) -> str:
+    """Default output of a shard: users.json -> users.shard-1-of-4.json"""
+    base, ext = os.path.splitext(input_file)
+    return f"{base}.shard-{shard[0]}-of-{shard[1]}{ext}"
+
+def detect_input_format(path: str) -> str:
+    """JSON lines for .jsonl/.ndjson files or files not starting with '[', otherwise a JSON array"""
+    if path.lower().endswith(JSONL_EXTENSIONS):
+        return JSONL
+    with open(path, 'r', encoding='utf-8') as f:
+        while True:
+            chunk = f.read(1024)
+            if not chunk:
+                return JSON
+            chunk = chunk.lstrip()
+            if chunk:
+                return JSON if chunk[0] == '[' else JSONL
+
+def detect_output_format(path: str) -> str:
+    return JSONL if path.lower().endswith(JSONL_EXTENSIONS) else JSON
+
+def iter_json_array(f: TextIO, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the elements of a JSON array read incrementally from a text stream"""
+    decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+
+    def more() -> bool:
+        # Drop what has been parsed and append the next chunk
+        nonlocal buffer, pos
+        if len(buffer) - pos > MAX_RECORD_CHARS:
+            raise ValueError("JSON record too large or malformed")
+        chunk = f.read(chunk_size)
+        buffer, pos = buffer[pos:] + chunk, 0
+        return bool(chunk)
+
+    def peek() -> str:
+        # Next non-whitespace character, or '' at the end of the stream
+        nonlocal pos
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos < len(buffer):
+                return buffer[pos]
+            if not more():
+                return ''
+
+    if peek() != '[':
+        raise ValueError("Expected a JSON array of users")
+    pos += 1
+    if peek() == ']':
+        return
+    while True:
+        if peek() == '':
+            raise ValueError("Unexpected end of JSON array")
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if more():
                     continue
-            
-            # If no ID found on any page
-            return ""
+                raise
+            if end < len(buffer):
+                break
+            # A value ending exactly at the end of the buffer may continue in the next chunk
+            if not more():
+                end = len(buffer)
+                break
+        pos = end
+        yield value
+
+        separator = peek()
+        if separator == ']':
+            return
+        if separator == '':
+            raise ValueError("Unexpected end of JSON array")
+        if separator != ',':
+            raise ValueError(f"Expected ',' or ']' in JSON array, found {separator!r}")
+        pos += 1
+
+def iter_jsonl(f: TextIO) -> Iterator[Any]:
+    """Yield one JSON value per non-empty line"""
+    for number, line in enumerate(f, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON on line {number}: {str(e)}")
+
+def iter_users(path: str, fmt: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """Stream the users of a JSON array or JSON lines file"""
+    fmt = fmt or detect_input_format(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        yield from (iter_jsonl(f) if fmt == JSONL else iter_json_array(f))
+
+class UsersWriter:
+    """Write users one at a time as JSON lines, or as a JSON array laid out like json.dump(indent=2)"""
+
+    def __init__(self, f: TextIO, fmt: str = JSON):
+        self.f = f
+        self.fmt = fmt
+        self.count = 0
+
+    def write(self, user: Dict[str, Any]):
+        if self.fmt == JSONL:
+            self.f.write(json.dumps(user, ensure_ascii=False) + "\n")
         else:
-            # It's already an image
-            first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = detect_and_process_id_card(file_path)
-            return national_id if national_id else ""
-        
-    except Exception as e:
-        print(f"Error processing {file_url}: {str(e)}")
-        return ""
-    finally:
-        # Clean up temporary files
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-        for pdf_temp_path in pdf_temp_paths:
-            if os.path.exists(pdf_temp_path):
-                os.remove(pdf_temp_path)
-
-def process_users(input_file, output_file=None):
-    """Process users.json and add national_id_number field"""
-    
+            # Raw newlines only occur between tokens, so this nests the record one level
+            text = json.dumps(user, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+            self.f.write(("[\n  " if self.count == 0 else ",\n  ") + text)
+        self.count += 1
+
+    def close(self):
+        """Finish the document (the file itself is left open)"""
+        if self.fmt == JSON:
+            self.f.write("\n]" if self.count else "[]")
+
+class ProgressJournal:
+    """Results of finished users, keyed by user_id, in a SQLite sidecar file
+
+    Records are committed every COMMIT_EVERY users, so a crash costs at most that many
+    users of repeated work.
+    """
+
+    COMMIT_EVERY = 100
+
+    def __init__(self, path: str, reset: bool = False):
+        self.path = path
+        if reset:
+            self.remove()
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS progress (user_id TEXT PRIMARY KEY, national_id TEXT NOT NULL, error TEXT)"
+        )
+        self._conn.commit()
+
+    def get(self, user_id: Any) -> Optional[Tuple[str, Optional[str]]]:
+        """(national_id, error) recorded for user_id, or None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT national_id, error FROM progress WHERE user_id = ?", (user_key(user_id),)
+            ).fetchone()
+
+    def record(self, user_id: Any, national_id: str, error: Optional[str]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO progress (user_id, national_id, error) VALUES (?, ?, ?)",
+                (user_key(user_id), national_id, error)
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.COMMIT_EVERY:
+                self._conn.commit()
+                self._uncommitted = 0
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM progress").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+    def remove(self):
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+
+def format_duration(seconds: float) -> str:
+    """Compact duration such as 45s, 12m05s or 3h20m"""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    if seconds < 3600:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+
+class Timings:
+    """Running percentiles of stage durations in fixed memory
+
+    Durations are counted in log-spaced buckets 5% wide, so percentiles are accurate to
+    about 5% however many users a run has.
+    """
+
+    BASE = 0.0001  # Upper bound of the first bucket, in seconds
+    GROWTH = 1.05
+
+    def __init__(self):
+        self.buckets: Counter = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float):
+        bucket = max(0, math.ceil(math.log(max(seconds, self.BASE) / self.BASE, self.GROWTH)))
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percent: float) -> float:
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.BASE * self.GROWTH ** bucket, self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4),
+            "p50": round(self.percentile(50), 4),
+            "p90": round(self.percentile(90), 4),
+            "p99": round(self.percentile(99), 4),
+            "max": round(self.max, 4),
+        }
+
+class RunStats:
+    """Counts, stage timings and failure reasons of one run, updated as users finish"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.started_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        self.total: Optional[int] = None  # Users in the run, once counted
+        self.processed = 0
+        self.extracted = 0
+        self.resumed = 0
+        self.images = 0
+        self.duplicates: Counter = Counter()  # Users given another user's result, by match kind
+        self.stages = {stage: Timings() for stage in STAGES}
+        self.failures: Counter = Counter()
+        self.failure_examples: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def record(self, task: UserTask):
+        with self._lock:
+            self.processed += 1
+            if task.national_id:
+                self.extracted += 1
+            if task.resumed:
+                self.resumed += 1
+                return
+            if task.duplicate:
+                # Stage times of a duplicate are not those of an extraction
+                self.duplicates[task.duplicate] += 1
+            else:
+                self.images += task.images
+                for stage, seconds in task.timings.items():
+                    self.stages[stage].add(seconds)
+            if not task.national_id:
+                reason = task.failure or "unknown"
+                self.failures[reason] += 1
+                self.failure_examples.setdefault(reason, task.error or "")
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def rates(self) -> Tuple[float, float]:
+        """(users, images) per second processed in this run, not counting resumed users"""
+        elapsed = max(self.elapsed, 1e-9)
+        return (self.processed - self.resumed) / elapsed, self.images / elapsed
+
+    def eta(self) -> Optional[float]:
+        users_per_second, _ = self.rates()
+        if self.total is None or not users_per_second:
+            return None
+        return max(0, self.total - self.processed) / users_per_second
+
+    def status_line(self) -> str:
+        with self._lock:
+            users_per_second, images_per_second = self.rates()
+            done = f"{self.processed}/{self.total}" if self.total is not None else str(self.processed)
+            line = f"{done} users | {images_per_second:.1f} images/s"
+            eta = self.eta()
+            if eta is not None:
+                line += f" | ETA {format_duration(eta)}"
+            if self.processed:
+                line += f" | {100 * self.extracted / self.processed:.1f}% extracted"
+            return line
+
+    def summary(self) -> Dict[str, Any]:
+        """Machine-readable statistics of the run so far"""
+        with self._lock:
+            users_per_second, images_per_second = self.rates()
+            return {
+                "started_at": self.started_at,
+                "elapsed_seconds": round(self.elapsed, 3),
+                "users": {
+                    "total": self.total,
+                    "processed": self.processed,
+                    "extracted": self.extracted,
+                    "failed": self.processed - self.extracted,
+                    "resumed": self.resumed,
+                },
+                "images": self.images,
+                "duplicates": {
+                    "url": self.duplicates["url"],
+                    "content": self.duplicates["content"],
+                    "extractions_saved": sum(self.duplicates.values()),
+                },
+                "users_per_second": round(users_per_second, 3),
+                "images_per_second": round(images_per_second, 3),
+                "success_rate": round(self.extracted / self.processed, 4) if self.processed else None,
+                "stages": {stage: timings.summary() for stage, timings in self.stages.items()},
+                "failures": {
+                    reason: {"count": count, "example": self.failure_examples[reason]}
+                    for reason, count in self.failures.most_common()
+                },
+            }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"Throughput: {summary['users_per_second']:.2f} users/s, {summary['images_per_second']:.2f} images/s "
+              f"over {format_duration(summary['elapsed_seconds'])}")
+        duplicates = summary["duplicates"]
+        if duplicates["extractions_saved"]:
+            print(f"Deduplication: {duplicates['extractions_saved']} extractions saved "
+                  f"({duplicates['url']} same file URL or path, {duplicates['content']} same file content)")
+        if any(stage["count"] for stage in summary["stages"].values()):
+            print("Stage timings in seconds (p50 / p90 / p99 / max):")
+            for stage, timings in summary["stages"].items():
+                if timings["count"]:
+                    print(f"  {stage:<9} {timings['p50']:.3f} / {timings['p90']:.3f} / "
+                          f"{timings['p99']:.3f} / {timings['max']:.3f}")
+        if summary["failures"]:
+            print("Failures:")
+            for reason, failure in summary["failures"].items():
+                print(f"  {failure['count']:>6}  {reason}" + (f" (e.g. {failure['example']})" if failure["example"] else ""))
+
+class ProgressDisplay:
+    """Live progress of a run on the original stderr
+
+    On a terminal the status line is redrawn in place below the per-user output; when
+    stderr is redirected a status line is appended every PROGRESS_INTERVAL seconds.
+    """
+
+    def __init__(self, stats: RunStats, stream: Optional[TextIO] = None):
+        self.stats = stats
+        self.stream = stream or sys.__stderr__  # sys.stderr itself is silenced
+        self.interactive = self.stream.isatty()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="users-progress", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        with self._lock:
+            self._clear()
+
+    @contextmanager
+    def paused(self):
+        """Hide the status line while other output is printed"""
+        with self._lock:
+            self._clear()
+            yield
+            sys.stdout.flush()
+            if self.interactive:
+                self._draw()
+
+    def _run(self):
+        while not self._stop.wait(PROGRESS_REFRESH if self.interactive else PROGRESS_INTERVAL):
+            with self._lock:
+                self._draw()
+
+    def _draw(self):
+        if self.interactive:
+            self.stream.write("\r\x1b[K" + self.stats.status_line())
+        else:
+            self.stream.write(self.stats.status_line() + "\n")
+        self.stream.flush()
+
+    def _clear(self):
+        if self.interactive:
+            self.stream.write("\r\x1b[K")
+            self.stream.flush()
+
+def count_users(input_file: str, input_format: str, shard: Optional[Tuple[int, int]], stats: RunStats):
+    """Set stats.total by reading through the input (run alongside the pipeline)"""
+    try:
+        stats.total = sum(1 for _ in select_users(iter_users(input_file, input_format), shard))
+    except Exception:
+        pass  # Progress is shown without a total or ETA
+
+def select_users(users: Iterable[Dict[str, Any]], shard: Optional[Tuple[int, int]]) -> Iterable[Dict[str, Any]]:
+    """The users of shard (i, N), or all users"""
+    if shard is None:
+        return users
+    return (user for user in users if shard_of(user['user_id'], shard[1]) == shard[0])
+
+def process_users(input_file, output_file=None, connections=DEFAULT_CONNECTIONS, decoders=DEFAULT_DECODERS,
+                  threads=DEFAULT_THREADS, batch_size=DEFAULT_BATCH_SIZE, input_format=None, output_format=None,
+                  resume=False, retry_failed=False, journal_file=None, shard=None, progress=True, stats_file=None,
+                  dedup=True):
+    """Process users.json and add national_id_number field
+
+    shard, an (i, N) pair, restricts the run to the users of shard i out of N. Run
+    statistics are written as JSON to stats_file (default: output_file + .stats.json).
+    With dedup, users sharing a file URL or identical file content are extracted once.
+    """
+
     if output_file is None:
         output_file = input_file  # Overwrite original file
-    
-    # Read the users.json file
+    in_place = os.path.abspath(output_file) == os.path.abspath(input_file)
+
     try:
-        with open(input_file, 'r', encoding='utf-8') as f:
-            users = json.load(f)
+        input_format = input_format or detect_input_format(input_file)
     except Exception as e:
         print(f"Error reading {input_file}: {str(e)}")
-        return
-    
-    print(f"Processing {len(users)} users...")
-    
-    # Process each user
-    for i, user in enumerate(users):
-        print(f"Processing user {i+1}/{len(users)} (ID: {user['user_id']})")
-        
-        # Extract national ID
-        national_id = extract_national_id(user['file'])
-        
+        return False
+    output_format = output_format or (input_format if in_place else detect_output_format(output_file))
+
+    # Users are written to a partial file that replaces the output only once complete,
+    # so the input (possibly the same file) and any previous output stay intact until then
+    partial_file = output_file + ".partial"
+    journal = ProgressJournal(journal_file or output_file + ".progress", reset=not resume)
+    if resume:
+        print(f"Resuming: {journal.count()} users already processed")
+
+    def resume_task(task):
+        done = journal.get(task.user['user_id'])
+        if done is None or (retry_failed and not done[0]):
+            return False
+        task.national_id, task.error = done
+        task.resumed = True
+        return True
+
+    users = select_users(iter_users(input_file, input_format), shard)
+    if shard is not None:
+        print(f"Processing shard {shard[0]}/{shard[1]} of users from {input_file}...")
+    else:
+        print(f"Processing users from {input_file}...")
+
+    stats = RunStats()
+    stats_file = stats_file or output_file + ".stats.json"
+    settings = {"connections": connections, "decoders": decoders, "threads": threads, "batch_size": batch_size,
+                "dedup": dedup}
+    display = ProgressDisplay(stats) if progress and sys.__stderr__ is not None else None
+    if display is not None:
+        # The total is only needed for the ETA, so it is counted while the run starts
+        threading.Thread(target=count_users, args=(input_file, input_format, shard, stats), daemon=True).start()
+        display.start()
+
+    def emit(task):
         # Add national_id_number field
-        user['national_id_number'] = national_id
-        
-        if national_id:
-            print(f"  ✅ Extracted ID: {national_id}")
+        task.user['national_id_number'] = task.national_id
+        writer.write(task.user)
+        stats.record(task)
+        if task.resumed:
+            return
+        journal.record(task.user['user_id'], task.national_id, task.error)
+
+        lines = [f"Processed user {task.index + 1} (ID: {task.user['user_id']})"
+                 + (f" - same file {'URL or path' if task.duplicate == 'url' else 'content'} as another user" if task.duplicate else "")]
+        if task.national_id:
+            lines.append(f"  ✅ Extracted ID: {task.national_id}")
+        else:
+            lines.append(f"  ❌ Failed to extract ID{': ' + task.error if task.error else ''}")
+        if display is not None:
+            with display.paused():
+                print("\n".join(lines))
         else:
-            print(f"  ❌ Failed to extract ID")
-    
-    # Save the updated data
+            print("\n".join(lines))
+
+    def finish(status):
+        if display is not None:
+            display.stop()
+        write_stats(stats_file, dict(status=status, input_file=input_file, output_file=output_file,
+                                     shard=f"{shard[0]}/{shard[1]}" if shard else None,
+                                     settings=settings, **stats.summary()))
+
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
-        print(f"\n✅ Successfully saved updated data to {output_file}")
+        with open(partial_file, 'w', encoding='utf-8') as f:
+            writer = UsersWriter(f, output_format)
+            UserPipeline(connections, decoders, threads, batch_size, dedup).run(users, emit, resume_task)
+            writer.close()
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial_file, output_file)
+    except BaseException as e:
+        journal.close()
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        if isinstance(e, KeyboardInterrupt):
+            finish("interrupted")
+            print("\nInterrupted; run again with --resume to continue")
+            raise
+        finish("failed")
+        print(f"Error processing {input_file}: {str(e)}")
+        print("Run again with --resume to continue from the last checkpoint")
+        return False
+
+    # The output is complete: the journal is no longer needed
+    journal.close()
+    journal.remove()
+    finish("completed")
+    print(f"\n✅ Successfully saved {stats.processed} users ({stats.extracted} IDs extracted, "
+          f"{stats.resumed} from the previous run) to {output_file}")
+    stats.print_summary()
+    print(f"Run statistics written to {stats_file}")
+    return True
+
+def write_stats(stats_file: str, summary: Dict[str, Any]):
+    """Write run statistics as JSON; a failure here does not fail the run"""
+    try:
+        with open(stats_file, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+    except OSError as e:
+        print(f"Could not write run statistics to {stats_file}: {str(e)}")
+
+def merge_shards(input_file, shard_files, output_file, input_format=None, output_format=None):
+    """Combine shard outputs into one users file in the order of the original input
+
+    Every shard output lists its users in input order, so each input user is matched
+    against the next unread user of every shard; memory use does not depend on the
+    number of users. Users no shard produced are copied from the input without
+    national_id_number. Returns False if any user is missing.
+    """
+    try:
+        input_format = input_format or detect_input_format(input_file)
     except Exception as e:
-        print(f"Error saving {output_file}: {str(e)}")
+        print(f"Error reading {input_file}: {str(e)}")
+        return False
+    output_format = output_format or detect_output_format(output_file)
+    partial_file = output_file + ".partial"
+
+    problems = {"missing": [], "failed": [], "unexpected": []}
+    counts = {"merged": 0, "missing": 0, "failed": 0, "unexpected": 0}
+
+    def note(kind, user_id):
+        counts[kind] += 1
+        if len(problems[kind]) < 20:
+            problems[kind].append(user_id)
+
+    try:
+        streams = [iter_users(path) for path in shard_files]
+        heads = [next(stream, None) for stream in streams]
+        with open(partial_file, 'w', encoding='utf-8') as f:
+            writer = UsersWriter(f, output_format)
+            for user in iter_users(input_file, input_format):
+                key = user_key(user['user_id'])
+                for n, head in enumerate(heads):
+                    if head is not None and user_key(head['user_id']) == key:
+                        user = head
+                        heads[n] = next(streams[n], None)
+                        counts["merged"] += 1
+                        if not user.get('national_id_number'):
+                            note("failed", user['user_id'])
+                        break
+                else:
+                    note("missing", user['user_id'])
+                writer.write(user)
+            writer.close()
+
+        # Shard records that match no input user (e.g. a shard of another input file)
+        for head, stream in zip(heads, streams):
+            while head is not None:
+                note("unexpected", head['user_id'])
+                head = next(stream, None)
+        os.replace(partial_file, output_file)
+    except Exception as e:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        print(f"Error merging shards: {str(e)}")
+        return False
+
+    print(f"Merged {counts['merged']} users from {len(shard_files)} shards into {output_file}")
+    for kind, description in (("missing", "missing from every shard"), ("failed", "without an extracted ID"),
+                              ("unexpected", "in shards but not in the input")):
+        if counts[kind]:
+            more = f" (and {counts[kind] - len(problems[kind])} more)" if counts[kind] > len(problems[kind]) else ""
+            print(f"  ❌ {counts[kind]} users {description}: {', '.join(map(str, problems[kind]))}{more}")
+    return counts["missing"] == 0 and counts["unexpected"] == 0
+
+def merge_main(argv):
+    parser = ArgumentParser(
+        prog="process_users.py merge",
+        description="Combine the outputs of --shard runs into one users file in input order"
+    )
+    parser.add_argument("input_file", help="The users file the shards were produced from")
+    parser.add_argument("shard_files", nargs="+", help="Shard outputs")
+    parser.add_argument("-o", "--output", required=True, help="Merged users file")
+    parser.add_argument("--input-format", choices=(JSON, JSONL), help="Users file format (default: detected from the file)")
+    parser.add_argument("--output-format", choices=(JSON, JSONL), help="Output format (default: from the output file extension)")
+    args = parser.parse_args(argv)
+
+    for path in [args.input_file] + args.shard_files:
+        if not os.path.exists(path):
+            print(f"Error: File {path} not found")
+            sys.exit(1)
+
+    if not merge_shards(args.input_file, args.shard_files, args.output, args.input_format, args.output_format):
+        sys.exit(1)
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: python process_users.py <input_file> [output_file]")
-        print("Example: python process_users.py users.json")
-        print("Example: python process_users.py users.json users_processed.json")
+    if sys.argv[1:2] == ["merge"]:
+        merge_main(sys.argv[2:])
+        return
+
+    parser = ArgumentParser(
+        description="Add national_id_number to every user in a users.json file",
+        epilog="Example: python process_users.py users.json users_processed.json\n"
+               "Merge shard outputs: python process_users.py merge users.json SHARD_FILE... -o OUTPUT",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("input_file", help="JSON array or JSON lines of users with user_id and file")
+    parser.add_argument("output_file", nargs="?", help="Where to write the users (default: overwrite input_file)")
+    parser.add_argument("--connections", type=int, default=DEFAULT_CONNECTIONS, help="Concurrent downloads")
+    parser.add_argument("--decoders", type=int, default=DEFAULT_DECODERS, help="Threads decoding images and rendering PDFs")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="Inference threads, each with its own models")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Images per inference batch")
+    parser.add_argument("--input-format", choices=(JSON, JSONL), help="Users file format (default: detected from the file)")
+    parser.add_argument("--output-format", choices=(JSON, JSONL), help="Output format (default: from the output file extension)")
+    parser.add_argument("--resume", action="store_true", help="Skip users finished by an interrupted run (see --journal)")
+    parser.add_argument("--retry-failed", action="store_true", help="With --resume, process users whose extraction failed again")
+    parser.add_argument("--journal", help="Progress journal (default: output_file + .progress)")
+    parser.add_argument("--no-dedup", dest="dedup", action="store_false",
+                        help="Extract every user's file, even when another user has the same URL or content")
+    parser.add_argument("--no-progress", dest="progress", action="store_false", help="Do not show live progress on stderr")
+    parser.add_argument("--stats", help="Where to write run statistics as JSON (default: output_file + .stats.json)")
+    parser.add_argument("--shard", type=parse_shard, help="Only process shard i of N, e.g. 1/4 (default output: input.shard-i-of-N.json)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input_file):
+        print(f"Error: File {args.input_file} not found")
         sys.exit(1)
-    
-    input_file = sys.argv[1]
-    output_file = sys.argv[2] if len(sys.argv) > 2 else None
-    
-    if not os.path.exists(input_file):
-        print(f"Error: File {input_file} not found")
+
+    output_file = args.output_file
+    if args.shard is not None:
+        output_file = output_file or shard_file_name(args.input_file, args.shard)
+        if os.path.abspath(output_file) == os.path.abspath(args.input_file):
+            parser.error("a shard cannot overwrite the input file")
+
+    if not process_users(args.input_file, output_file, connections=args.connections, decoders=args.decoders,
+                         threads=args.threads, batch_size=args.batch_size, input_format=args.input_format,
+                         output_format=args.output_format, resume=args.resume, retry_failed=args.retry_failed,
+                         journal_file=args.journal, shard=args.shard, progress=args.progress, stats_file=args.stats,
+                         dedup=args.dedup):
         sys.exit(1)
-    
-    process_users(input_file, output_file)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,198 @@
+"""
+Per-client token-bucket rate limiting for the Egyptian ID OCR service
+Each client (API key or IP address) gets a bucket of `burst` tokens refilled at `rate`
+tokens per second; a request spends one token. Buckets live in process memory, or in a
+SQLite database shared by all worker processes on the host.
+"""
+
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, NamedTuple, Optional, Tuple
+
+# Rate limit configuration (overridable through the environment)
+DEFAULT_RATE = float(os.environ.get("OCR_RATE_LIMIT_RPS", 0))  # Off unless configured
+DEFAULT_BURST = float(os.environ.get("OCR_RATE_LIMIT_BURST", 20))
+DEFAULT_STORE = os.environ.get("OCR_RATE_LIMIT_STORE", "memory")
+DEFAULT_QUOTAS = os.environ.get("OCR_RATE_LIMIT_QUOTAS", "")
+
+# Idle buckets are dropped from memory once this many clients are tracked
+MAX_TRACKED_CLIENTS = 10000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+class Decision(NamedTuple):
+    """Outcome of a rate limit check"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float  # Seconds until the bucket is full again
+    retry_after: float  # Seconds until the next request would be allowed
+
+def _refill(tokens: float, updated: float, now: float, rate: float, burst: float) -> float:
+    """Tokens in a bucket after refilling it from `updated` to `now`"""
+    return min(burst, tokens + (now - updated) * rate)
+
+def parse_quotas(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Parse per-key quotas written as "key=rate:burst,key2=rate:burst" """
+    quotas = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, limits = entry.partition("=")
+        rate, _, burst = limits.partition(":")
+        quotas[key.strip()] = (float(rate), float(burst or rate))
+    return quotas
+
+class MemoryStore:
+    """Buckets kept in this process"""
+
+    blocking = False
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key: str, cost: float, rate: float, burst: float, force: bool = False) -> Tuple[bool, float]:
+        """Spend cost tokens if available (or regardless, with force); returns (taken, tokens left)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            taken = force or tokens >= cost
+            if taken:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > MAX_TRACKED_CLIENTS:
+                self._evict(now, rate, burst)
+            return taken, tokens
+
+    def _evict(self, now: float, rate: float, burst: float):
+        """Forget buckets that have refilled completely (they start full anyway)"""
+        for key, (tokens, updated) in list(self._buckets.items()):
+            if _refill(tokens, updated, now, rate, burst) >= burst:
+                del self._buckets[key]
+
+class SQLiteStore:
+    """Buckets in a SQLite database, shared by the worker processes of one host"""
+
+    blocking = True  # May wait on another process's write lock
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        """Short-lived connection, as in job_queue"""
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        try:
+            conn.execute("PRAGMA synchronous=NORMAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def take(self, key: str, cost: float, rate: float, burst: float, force: bool = False) -> Tuple[bool, float]:
+        """Spend cost tokens if available (or regardless, with force); returns (taken, tokens left)"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = _refill(row[0], row[1], now, rate, burst) if row else burst
+                taken = force or tokens >= cost
+                if taken:
+                    tokens -= cost
+                conn.execute(
+                    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                    (key, tokens, now)
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return taken, tokens
+
+def open_store(url: str = DEFAULT_STORE):
+    """Open a bucket store: "memory", or sqlite:///path shared between processes"""
+    if url == "memory":
+        return MemoryStore()
+    scheme, separator, location = url.partition("://")
+    if separator and scheme == "sqlite":
+        return SQLiteStore(location[1:])
+    raise ValueError(f"Unknown rate limit store: {url}")
+
+class RateLimiter:
+    """Token-bucket limits per client, with optional per-key quotas"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: float = DEFAULT_BURST, store=None,
+                 quotas: Optional[Dict[str, Tuple[float, float]]] = None):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.store = store if store is not None else open_store()
+        self.quotas = quotas if quotas is not None else parse_quotas(DEFAULT_QUOTAS)
+        self._allowed = 0
+        self._limited = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def limits_for(self, client: str) -> Tuple[float, float]:
+        """(rate, burst) for a client key such as "key:abc" or "ip:10.0.0.1" """
+        _, _, identity = client.partition(":")
+        return self.quotas.get(identity, (self.rate, self.burst))
+
+    def check(self, client: str, cost: float = 1) -> Decision:
+        """Spend cost tokens from the client's bucket if it has them"""
+        rate, burst = self.limits_for(client)
+        taken, tokens = self.store.take(client, cost, rate, burst)
+        if taken:
+            self._allowed += 1
+        else:
+            self._limited += 1
+        return Decision(
+            allowed=taken,
+            limit=int(burst),
+            remaining=max(0, int(tokens)),
+            reset=(burst - tokens) / rate if rate else 0.0,
+            retry_after=0.0 if taken else (cost - tokens) / rate if rate else 0.0
+        )
+
+    def charge(self, client: str, cost: float):
+        """Spend extra tokens for work discovered after admission (e.g. batch items); may go into debt"""
+        if cost > 0:
+            rate, burst = self.limits_for(client)
+            self.store.take(client, cost, rate, burst, force=True)
+
+    async def check_async(self, client: str, cost: float = 1) -> Decision:
+        """check from the event loop, off the loop for stores that may block"""
+        if self.store.blocking:
+            return await asyncio.to_thread(self.check, client, cost)
+        return self.check(client, cost)
+
+    async def charge_async(self, client: str, cost: float):
+        """charge from the event loop, off the loop for stores that may block"""
+        if self.store.blocking:
+            await asyncio.to_thread(self.charge, client, cost)
+        else:
+            self.charge(client, cost)
+
+    def stats(self) -> Dict[str, float]:
+        """Rate limiting counters for this process"""
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "allowed": self._allowed,
+            "limited": self._limited,
+        }
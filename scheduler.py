@@ -0,0 +1,525 @@
+"""
+Inference scheduling for the Egyptian ID OCR services
+Runs blocking extraction work on a dedicated, bounded executor with admission control,
+coalesces concurrent single-image requests into micro-batches, lets identical
+concurrent requests share one computation, adapts the number of requests in flight
+to the latency the executor delivers, and drops optional OCR stages under heavy backlog
+"""
+
+import os
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Executor configuration (overridable through the environment)
+DEFAULT_WORKERS = int(os.environ.get("OCR_WORKERS", max(1, (os.cpu_count() or 1) // 2)))
+DEFAULT_MAX_QUEUE = int(os.environ.get("OCR_MAX_QUEUE", 16))
+DEFAULT_RETRY_AFTER = int(os.environ.get("OCR_RETRY_AFTER", 5))
+
+# Micro-batching configuration
+DEFAULT_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+DEFAULT_MIN_WINDOW = float(os.environ.get("OCR_BATCH_WINDOW_MIN_MS", 2)) / 1000
+DEFAULT_MAX_WINDOW = float(os.environ.get("OCR_BATCH_WINDOW_MAX_MS", 20)) / 1000
+
+# Priority lanes with their scheduling weights; the first lane is the protected one
+INTERACTIVE = "interactive"
+BULK = "bulk"
+DEFAULT_LANES = {
+    INTERACTIVE: float(os.environ.get("OCR_INTERACTIVE_WEIGHT", 4)),
+    BULK: float(os.environ.get("OCR_BULK_WEIGHT", 1)),
+}
+DEFAULT_P99_TARGET = float(os.environ.get("OCR_INTERACTIVE_P99_MS", 2000)) / 1000
+LATENCY_SAMPLES = 500
+LATENCY_HORIZON = 60
+
+# Adaptive concurrency limit configuration
+DEFAULT_LIMIT_MIN = int(os.environ.get("OCR_LIMIT_MIN", 1))
+DEFAULT_LIMIT_MAX = int(os.environ.get("OCR_LIMIT_MAX", DEFAULT_WORKERS * DEFAULT_BATCH_SIZE + DEFAULT_MAX_QUEUE))
+DEFAULT_LIMIT_INITIAL = int(os.environ.get("OCR_LIMIT_INITIAL", DEFAULT_WORKERS * DEFAULT_BATCH_SIZE))
+DEFAULT_LIMIT_WINDOW = int(os.environ.get("OCR_LIMIT_WINDOW", 32))
+DEFAULT_LIMIT_TOLERANCE = float(os.environ.get("OCR_LIMIT_TOLERANCE", 1.5))
+
+# Requests waiting for a batch at which optional OCR stages are dropped (0 disables a level)
+DEFAULT_DEGRADE_ADDRESS_DEPTH = int(os.environ.get("OCR_DEGRADE_ADDRESS_DEPTH", max(1, DEFAULT_BATCH_SIZE // 2)))
+DEFAULT_DEGRADE_NAMES_DEPTH = int(os.environ.get("OCR_DEGRADE_NAMES_DEPTH", DEFAULT_BATCH_SIZE))
+
+class QueueFullError(Exception):
+    """Raised when the executor cannot admit more work"""
+
+    def __init__(self, retry_after: int, queued: int):
+        super().__init__(f"Extraction queue is full ({queued} requests waiting)")
+        self.retry_after = retry_after
+        self.queued = queued
+
+class InferenceExecutor:
+    """Bounded thread pool for blocking download, validation and model inference"""
+
+    def __init__(self, max_workers: int = DEFAULT_WORKERS, max_queue: int = DEFAULT_MAX_QUEUE,
+                 retry_after: int = DEFAULT_RETRY_AFTER):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr-worker")
+        self._lock = threading.Lock()
+        self._running = 0
+        self._queued = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def _admit(self):
+        """Reserve a queue slot or raise QueueFullError"""
+        with self._lock:
+            if self._queued + self._running >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after, self._queued)
+            self._queued += 1
+
+    def _timed(self, submitted: float, fn: Callable, args: tuple) -> Tuple[Any, float, float]:
+        """Run fn on a worker thread and measure queue wait and processing time separately"""
+        started = time.perf_counter()
+        with self._lock:
+            self._queued -= 1
+            self._running += 1
+        try:
+            result = fn(*args)
+        finally:
+            with self._lock:
+                self._running -= 1
+                self._completed += 1
+        return result, started - submitted, time.perf_counter() - started
+
+    async def run(self, fn: Callable, *args) -> Tuple[Any, float, float]:
+        """Run fn(*args) on the executor and return (result, queue_time, processing_time)"""
+        self._admit()
+        submitted = time.perf_counter()
+        future = self._pool.submit(self._timed, submitted, fn, args)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A job cancelled before a worker picked it up never reaches _timed
+            if future.cancel():
+                with self._lock:
+                    self._queued -= 1
+            raise
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of executor load"""
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._queued,
+                "completed": self._completed,
+                "rejected": self._rejected,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+class MicroBatcher:
+    """Collects concurrent submissions for a short window and runs them as one batch on the executor
+
+    batch_fn receives the list of submitted items and must return one outcome per item (a
+    result or an exception). The collection window adapts to load: it shrinks towards
+    min_window while requests arrive alone, and grows towards max_window while other
+    requests keep arriving during it. New batches are only formed when an executor worker
+    is free, so under a burst requests pile up and batches fill naturally.
+
+    Submissions go to one queue per priority lane. Batches are filled by weighted fair
+    queueing across lanes. While the p99 latency of the first (most important) lane is above
+    p99_target, batches are filled from that lane only, and the other lanes may not take the
+    last free worker (when there is more than one).
+
+    expired_outcome, when given, is called on each item as it is taken for a batch; an item
+    for which it returns an outcome (e.g. one whose deadline has passed) gets that outcome
+    at once instead of a place in the batch.
+    """
+
+    def __init__(self, executor: InferenceExecutor, batch_fn: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = DEFAULT_BATCH_SIZE, min_window: float = DEFAULT_MIN_WINDOW,
+                 max_window: float = DEFAULT_MAX_WINDOW, max_queue: int = DEFAULT_MAX_QUEUE,
+                 lanes: Optional[Dict[str, float]] = None, p99_target: float = DEFAULT_P99_TARGET,
+                 expired_outcome: Optional[Callable[[Any], Any]] = None):
+        self.executor = executor
+        self.batch_fn = batch_fn
+        self.expired_outcome = expired_outcome
+        self.max_batch_size = max_batch_size
+        self.min_window = min_window
+        self.max_window = max_window
+        self.max_queue = max_queue
+        self.window = min_window
+        self.weights = dict(lanes or DEFAULT_LANES)
+        self.priority_lane = next(iter(self.weights))
+        self.p99_target = p99_target
+        self._pending: Dict[str, Deque[Tuple[Any, asyncio.Future, float]]] = {lane: deque() for lane in self.weights}
+        self._virtual_time = {lane: 0.0 for lane in self.weights}
+        self._latencies: Dict[str, Deque[Tuple[float, float]]] = {lane: deque(maxlen=LATENCY_SAMPLES) for lane in self.weights}
+        self._lane_counts = {lane: {"submitted": 0, "completed": 0, "rejected": 0} for lane in self.weights}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+        self._running = 0
+        self._batches = 0
+        self._items = 0
+        self._rejected = 0
+        self._expired = 0
+
+    def _ensure_started(self):
+        """Start the collector on the running event loop"""
+        if self._collector is None or self._collector.done():
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self.executor.max_workers)
+            self._collector = asyncio.create_task(self._collect())
+
+    async def submit(self, item: Any, lane: Optional[str] = None) -> Tuple[Any, float, float]:
+        """Queue item in a priority lane for the next batch and return (outcome, queue_time, processing_time)"""
+        lane = lane or self.priority_lane
+        if lane not in self._pending:
+            raise ValueError(f"Unknown priority lane: {lane}")
+        self._ensure_started()
+        pending = self._pending[lane]
+        if len(pending) >= self.max_queue:
+            self._rejected += 1
+            self._lane_counts[lane]["rejected"] += 1
+            raise QueueFullError(self.executor.retry_after, len(pending))
+        if not pending:
+            # An idle lane does not bank credit: it rejoins at the current virtual time
+            active = [self._virtual_time[other] for other, queue in self._pending.items() if queue]
+            self._virtual_time[lane] = max([self._virtual_time[lane]] + active)
+        future = asyncio.get_running_loop().create_future()
+        pending.append((item, future, time.perf_counter()))
+        self._lane_counts[lane]["submitted"] += 1
+        self._wakeup.set()
+        return await future
+
+    def depth(self, lane: Optional[str] = None) -> int:
+        """Submissions waiting for a batch, in one lane or in all of them"""
+        if lane is not None:
+            return len(self._pending[lane])
+        return sum(len(queue) for queue in self._pending.values())
+
+    async def _collect(self):
+        """Form batches from pending submissions whenever a worker is free"""
+        loop = asyncio.get_running_loop()
+        while True:
+            while not self.depth():
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            # Requests keep accumulating while every worker is busy
+            await self._slots.acquire()
+
+            deadline = loop.time() + self.window
+            while self.depth() < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            batch = self._take_batch()
+            if not batch:
+                self._slots.release()
+                if self.depth():
+                    # Work is held back for the priority lane; wait for a submission or a free worker
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                continue
+
+            self._adapt(len(batch))
+            self._running += 1
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    def _take_batch(self) -> List[Tuple[Any, asyncio.Future, float, str]]:
+        """Pick the next batch across lanes by weighted fair queueing"""
+        lanes = list(self._pending)
+        if self.p99_target and self.p99(self.priority_lane) > self.p99_target:
+            if self._pending[self.priority_lane]:
+                # The priority lane is missing its latency target: it gets the whole batch
+                lanes = [self.priority_lane]
+            elif self.executor.max_workers > 1 and self._running + 1 >= self.executor.max_workers:
+                # Keep the last worker free for the next priority request
+                return []
+
+        batch = []
+        while len(batch) < self.max_batch_size:
+            candidates = [lane for lane in lanes if self._pending[lane]]
+            if not candidates:
+                break
+            lane = min(candidates, key=lambda candidate: self._virtual_time[candidate])
+            item, future, submitted = self._pending[lane].popleft()
+            if future.done():  # Skip submitters that gave up
+                continue
+            outcome = self.expired_outcome(item) if self.expired_outcome else None
+            if outcome is not None:
+                # Answered without taking a worker's time
+                self._expired += 1
+                self._lane_counts[lane]["completed"] += 1
+                future.set_result((outcome, time.perf_counter() - submitted, 0.0))
+                continue
+            self._virtual_time[lane] += 1 / self.weights[lane]
+            batch.append((item, future, submitted, lane))
+        return batch
+
+    def _adapt(self, batch_size: int):
+        """Shrink the window when requests arrive alone, grow it when they arrive together"""
+        if batch_size <= 1:
+            self.window = max(self.min_window, self.window / 2)
+        else:
+            self.window = min(self.max_window, self.window * 1.5)
+
+    async def _dispatch(self, batch: List[Tuple[Any, asyncio.Future, float, str]]):
+        """Run one batch on the executor and fan the outcomes back out to the submitters"""
+        dispatched = time.perf_counter()
+        self._batches += 1
+        self._items += len(batch)
+        try:
+            outcomes, queue_time, processing_time = await self.executor.run(
+                self.batch_fn, [item for item, _, _, _ in batch]
+            )
+        except Exception as e:
+            outcomes, queue_time, processing_time = [e] * len(batch), 0.0, 0.0
+        finally:
+            self._running -= 1
+            self._slots.release()
+            self._wakeup.set()
+
+        finished = time.perf_counter()
+        for (_, future, submitted, lane), outcome in zip(batch, outcomes):
+            self._lane_counts[lane]["completed"] += 1
+            self._latencies[lane].append((finished, finished - submitted))
+            if not future.done():
+                future.set_result((outcome, dispatched - submitted + queue_time, processing_time))
+
+    def p99(self, lane: str) -> float:
+        """p99 latency (queueing included) of a lane over the last LATENCY_HORIZON seconds"""
+        horizon = time.perf_counter() - LATENCY_HORIZON
+        samples = sorted(latency for finished, latency in self._latencies[lane] if finished >= horizon)
+        return samples[int(0.99 * (len(samples) - 1))] if samples else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of batching behaviour"""
+        return {
+            "pending": self.depth(),
+            "batches": self._batches,
+            "items": self._items,
+            "rejected": self._rejected,
+            "expired": self._expired,
+            "average_batch_size": round(self._items / self._batches, 2) if self._batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "window_ms": round(self.window * 1000, 2),
+            "p99_target_ms": round(self.p99_target * 1000, 2),
+            "lanes": {
+                lane: {
+                    "weight": self.weights[lane],
+                    "pending": len(self._pending[lane]),
+                    **self._lane_counts[lane],
+                    "p99_ms": round(self.p99(lane) * 1000, 2),
+                }
+                for lane in self.weights
+            },
+        }
+
+    async def shutdown(self):
+        """Stop collecting new batches"""
+        if self._collector is not None:
+            self._collector.cancel()
+
+class SingleFlight:
+    """Runs at most one computation per key at a time; concurrent callers with the same key
+    await the computation already in flight instead of starting their own
+
+    The shared computation runs as its own task, so a caller that goes away does not cancel
+    it for the others; it is cancelled once every caller has gone.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self._computations = 0
+        self._saved = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn(), or the computation already in flight for key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+            self._computations += 1
+        else:
+            self._saved += 1
+
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                task.cancel()  # No-op once it has finished
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        """Drop a finished computation so later requests start afresh"""
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case every caller went away
+
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of deduplication behaviour"""
+        return {
+            "in_flight": len(self._inflight),
+            "computations": self._computations,
+            "saved": self._saved,
+        }
+
+class AdaptiveLimiter:
+    """AIMD limit on the number of requests in flight, driven by their p95 latency
+
+    Latencies are collected in windows of `window` samples. When a window's p95 stays within
+    `tolerance` times the baseline (the lowest p95 seen, drifting slowly towards recent
+    values) and the limit was actually in use, the limit grows by one; when it rises above
+    that, the limit is cut by `backoff`. Requests beyond the limit are shed with QueueFullError.
+    """
+
+    def __init__(self, initial_limit: int = DEFAULT_LIMIT_INITIAL, min_limit: int = DEFAULT_LIMIT_MIN,
+                 max_limit: int = DEFAULT_LIMIT_MAX, window: int = DEFAULT_LIMIT_WINDOW,
+                 tolerance: float = DEFAULT_LIMIT_TOLERANCE, backoff: float = 0.75,
+                 retry_after: int = DEFAULT_RETRY_AFTER):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = min(max(initial_limit, min_limit), self.max_limit)
+        self.window = window
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.retry_after = retry_after
+        self.baseline: Optional[float] = None
+        self.last_p95: Optional[float] = None
+        self._lock = threading.Lock()
+        self._samples: List[float] = []
+        self._inflight = 0
+        self._peak = 0
+        self._rejected = 0
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        """Hold an in-flight slot for the duration of the block, or raise QueueFullError"""
+        with self._lock:
+            if self._inflight >= self.limit:
+                self._rejected += 1
+                raise QueueFullError(self.retry_after, self._inflight)
+            self._inflight += 1
+            self._peak = max(self._peak, self._inflight)
+        started = time.perf_counter()
+        succeeded = False
+        try:
+            yield
+            succeeded = True
+        finally:
+            with self._lock:
+                self._inflight -= 1
+                # Rejections and cancellations say nothing about service latency
+                if succeeded:
+                    self._record(time.perf_counter() - started)
+
+    def _record(self, latency: float):
+        """Add a latency sample and adjust the limit at the end of each window"""
+        self._samples.append(latency)
+        if len(self._samples) < self.window:
+            return
+
+        samples = sorted(self._samples)
+        p95 = samples[int(0.95 * (len(samples) - 1))]
+        self._samples.clear()
+        self.last_p95 = p95
+
+        if self.baseline is None or p95 < self.baseline:
+            self.baseline = p95
+        else:
+            # Let the baseline follow lasting shifts in the workload (e.g. larger images)
+            self.baseline = 0.95 * self.baseline + 0.05 * p95
+
+        if p95 > self.baseline * self.tolerance:
+            self.limit = max(self.min_limit, int(self.limit * self.backoff))
+        elif self._peak >= self.limit // 2 + 1 and self.limit < self.max_limit:
+            # Only probe upwards when the current limit is actually being used
+            self.limit += 1
+        self._peak = self._inflight
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of the limiter state"""
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self._inflight,
+                "rejected": self._rejected,
+                "p95_ms": round(self.last_p95 * 1000, 2) if self.last_p95 is not None else None,
+                "baseline_ms": round(self.baseline * 1000, 2) if self.baseline is not None else None,
+            }
+
+class DegradationPolicy:
+    """Picks the optional OCR fields to skip from the current backlog depth
+
+    Past address_depth waiting requests the address (and the unused serial number) is no
+    longer read; past names_depth the names are dropped as well, leaving the national ID
+    and what is decoded from it. Full extraction resumes as soon as the backlog drains.
+    """
+
+    LEVELS = (
+        (),
+        ("address", "serial"),
+        ("address", "serial", "first_name", "second_name"),
+    )
+
+    def __init__(self, depth: Callable[[], int], address_depth: int = DEFAULT_DEGRADE_ADDRESS_DEPTH,
+                 names_depth: int = DEFAULT_DEGRADE_NAMES_DEPTH):
+        self.depth = depth
+        self.address_depth = address_depth
+        self.names_depth = names_depth
+        self.level = 0
+        self._lock = threading.Lock()
+        self._degraded = [0] * len(self.LEVELS)
+
+    def fields_to_skip(self, items: int = 1) -> Tuple[str, ...]:
+        """Fields to skip for the next `items` images, given the backlog right now"""
+        depth = self.depth()
+        level = 0
+        if self.names_depth and depth >= self.names_depth:
+            level = 2
+        elif self.address_depth and depth >= self.address_depth:
+            level = 1
+        with self._lock:
+            if level != self.level:
+                logger.warning(f"Backlog of {depth} requests: degradation level {self.level} -> {level}")
+            self.level = level
+            self._degraded[level] += items
+        return self.LEVELS[level]
+
+    def stats(self) -> Dict[str, Any]:
+        """Snapshot of the degradation state"""
+        with self._lock:
+            return {
+                "level": self.level,
+                "skipped_fields": list(self.LEVELS[self.level]),
+                "address_depth": self.address_depth,
+                "names_depth": self.names_depth,
+                "skipped_address_items": self._degraded[1],
+                "skipped_names_items": self._degraded[2],
+            }
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Tests for the streaming helpers in http_client
+"""
+
+import asyncio
+
+import pytest
+
+import http_client
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\0" * 1000
+BOUNDARY = "test-boundary"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+
+def multipart_parts(files, fields=None, file_field="file"):
+    """multipart/form-data body as one chunk per part, for files given as (filename, content)"""
+    for name, value in (fields or {}).items():
+        yield f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for filename, content in files:
+        yield (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n\r\n'
+        ).encode() + content + b"\r\n"
+    yield f"--{BOUNDARY}--\r\n".encode()
+
+async def stream(chunks, received=None):
+    """Async byte stream over chunks, recording in received how many were read"""
+    for chunk in chunks:
+        if received is not None:
+            received.append(chunk)
+        yield chunk
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_read_multipart_files_reads_every_file_and_field():
+    body = multipart_parts([("a.jpg", JPEG), ("b.jpg", JPEG + b"b")], {"request_id": "r1"}, file_field="files")
+
+    files, fields = run(http_client.read_multipart_files(stream(body), CONTENT_TYPE, 4, allowed_types=http_client.IMAGE_TYPES))
+
+    assert files == [("a.jpg", JPEG), ("b.jpg", JPEG + b"b")]
+    assert fields == {"request_id": "r1"}
+
+def test_read_multipart_files_keeps_per_file_errors():
+    body = multipart_parts([("big.jpg", JPEG * 10), ("text.txt", b"plain text here"), ("ok.jpg", JPEG)], file_field="files")
+
+    files, _ = run(http_client.read_multipart_files(
+        stream(body), CONTENT_TYPE, 8, max_bytes=len(JPEG) * 2, allowed_types=http_client.IMAGE_TYPES
+    ))
+
+    assert isinstance(files[0][1], http_client.DownloadTooLargeError)
+    assert isinstance(files[1][1], http_client.UnsupportedContentError)
+    assert files[2] == ("ok.jpg", JPEG)
+
+def test_read_multipart_files_stops_reading_past_max_files():
+    received = []
+    body = multipart_parts([("a.jpg", JPEG)] * 100, file_field="files")
+
+    with pytest.raises(ValueError, match="More than 3"):
+        run(http_client.read_multipart_files(stream(body, received), CONTENT_TYPE, 3))
+    assert len(received) == 4
+
+def test_read_multipart_files_caps_the_total_size():
+    received = []
+    # Every file fails on its own, but together they may not exceed max_files * max_bytes
+    body = multipart_parts([("big.jpg", JPEG * 10)] * 3 + [("a.jpg", JPEG)] * 10, file_field="files")
+
+    with pytest.raises(http_client.DownloadTooLargeError):
+        run(http_client.read_multipart_files(stream(body, received), CONTENT_TYPE, 3, max_bytes=len(JPEG) * 2))
+    assert len(received) == 1
+
+def test_read_multipart_returns_the_file_and_fields():
+    body = multipart_parts([("card.jpg", JPEG)], {"request_id": "r1", "deadline_ms": "500"})
+
+    content, fields = run(http_client.read_multipart(stream(body), CONTENT_TYPE, allowed_types=http_client.IMAGE_TYPES))
+
+    assert content == JPEG
+    assert fields == {"request_id": "r1", "deadline_ms": "500"}
+
+def test_read_multipart_stops_reading_an_oversized_file():
+    received = []
+    chunks = [next(multipart_parts([("card.jpg", b"")], file_field="file"))[:-2]] + [JPEG] * 100 + [b"\r\n--" + BOUNDARY.encode() + b"--\r\n"]
+
+    with pytest.raises(http_client.DownloadTooLargeError):
+        run(http_client.read_multipart(stream(chunks, received), CONTENT_TYPE, max_bytes=len(JPEG) * 3))
+    assert len(received) < 10
+
+def test_read_multipart_checks_the_file_signature():
+    body = multipart_parts([("notes.txt", b"plain text, not an image")])
+
+    with pytest.raises(http_client.UnsupportedContentError):
+        run(http_client.read_multipart(stream(body), CONTENT_TYPE, allowed_types=http_client.IMAGE_TYPES))
+
+@pytest.mark.parametrize("body, content_type, message", [
+    (multipart_parts([], {"request_id": "r1"}), CONTENT_TYPE, "Missing file field"),
+    (list(multipart_parts([("card.jpg", JPEG)]))[:-1], CONTENT_TYPE, "Incomplete multipart body"),
+    (multipart_parts([("card.jpg", JPEG)]), "multipart/form-data", "Missing multipart boundary"),
+    (multipart_parts([("card.jpg", JPEG)], {"note": "x" * (http_client.MAX_FORM_FIELD_BYTES + 1)}), CONTENT_TYPE, "too large"),
+])
+def test_read_multipart_rejects_malformed_bodies(body, content_type, message):
+    with pytest.raises(ValueError, match=message):
+        run(http_client.read_multipart(stream(body), content_type))
+
+def test_read_limited_stops_at_the_cap():
+    received = []
+
+    with pytest.raises(http_client.DownloadTooLargeError):
+        run(http_client.read_limited(stream([JPEG] * 100, received), max_bytes=len(JPEG) * 3))
+    assert len(received) == 4
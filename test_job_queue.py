@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Tests for the SQLite job queue: leasing, lease expiry and retention
+"""
+
+import os
+import time
+import tempfile
+
+import pytest
+
+import job_queue
+from job_queue import COMPLETED, FAILED, QUEUED, RUNNING, SQLiteJobQueue
+
+@pytest.fixture
+def make_queue():
+    directory = tempfile.mkdtemp()
+    return lambda **options: SQLiteJobQueue(os.path.join(directory, "jobs.db"), **options)
+
+PAYLOAD = {"image_url": "https://example.com/card.jpg", "request_id": "job-test"}
+
+def test_lease_and_complete(make_queue):
+    queue = make_queue()
+    job_id = queue.enqueue(PAYLOAD, "https://example.com/callback")
+
+    job = queue.lease("worker-1")
+
+    assert job["id"] == job_id and job["status"] == RUNNING and job["attempts"] == 1
+    assert queue.lease("worker-2") is None
+    assert queue.complete(job_id, "worker-1", {"national_id": "29001010112345"})
+    finished = queue.get(job_id)
+    assert finished["status"] == COMPLETED
+    assert job_queue.public_view(finished)["extracted_data"] == {"national_id": "29001010112345"}
+
+def test_expired_lease_is_taken_over(make_queue):
+    queue = make_queue(visibility_timeout=0.05)
+    job_id = queue.enqueue(PAYLOAD)
+    queue.lease("worker-1")
+
+    time.sleep(0.1)
+    job = queue.lease("worker-2")
+
+    assert job["id"] == job_id and job["lease_owner"] == "worker-2" and job["attempts"] == 2
+    # The first worker lost the lease and can no longer finish the job
+    assert not queue.complete(job_id, "worker-1", {})
+    assert not queue.extend(job_id, "worker-1")
+    assert queue.complete(job_id, "worker-2", {})
+
+def test_extended_lease_is_not_taken_over(make_queue):
+    queue = make_queue(visibility_timeout=0.2)
+    job_id = queue.enqueue(PAYLOAD)
+    queue.lease("worker-1")
+
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.extend(job_id, "worker-1")
+
+    assert queue.lease("worker-2") is None
+
+def test_job_that_keeps_expiring_is_abandoned(make_queue):
+    queue = make_queue(visibility_timeout=0.01, max_attempts=2)
+    job_id = queue.enqueue(PAYLOAD, "https://example.com/callback")
+    for worker in ("worker-1", "worker-2"):
+        assert queue.lease(worker)["id"] == job_id
+        time.sleep(0.02)
+
+    abandoned = []
+    assert queue.lease("worker-3", abandoned) is None
+
+    assert [job["id"] for job in abandoned] == [job_id]
+    assert abandoned[0]["status"] == FAILED and abandoned[0]["callback_url"] == "https://example.com/callback"
+    assert queue.stats()[FAILED] == 1
+
+def test_release_does_not_count_the_attempt(make_queue):
+    queue = make_queue()
+    job_id = queue.enqueue(PAYLOAD)
+    queue.lease("worker-1")
+
+    queue.release(job_id, "worker-1")
+
+    job = queue.get(job_id)
+    assert job["status"] == QUEUED and job["attempts"] == 0
+    assert queue.lease_many("worker-2", 5)[0]["id"] == job_id
+
+def test_purge_keeps_the_newest_finished_jobs(make_queue):
+    queue = make_queue(retention=2)
+    for _ in range(4):
+        job_id = queue.enqueue(PAYLOAD)
+        queue.lease("worker")
+        queue.fail(job_id, "worker", "broken", "PROCESSING_FAILED")
+    queue.enqueue(PAYLOAD)
+
+    assert queue.purge() == 2
+    assert queue.stats() == {QUEUED: 1, RUNNING: 0, COMPLETED: 0, FAILED: 2}
+
+def test_backend_must_implement_the_interface():
+    class Incomplete(job_queue.JobQueue):
+        def enqueue(self, payload, callback_url=None, job_id=None):
+            return "id"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_open_queue_urls(tmp_path):
+    assert isinstance(job_queue.open_queue(f"sqlite:///{tmp_path}/a.db"), SQLiteJobQueue)
+    assert isinstance(job_queue.open_queue(str(tmp_path / "b.db")), SQLiteJobQueue)
+    with pytest.raises(ValueError):
+        job_queue.open_queue("redis://localhost")
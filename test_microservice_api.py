@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+In-process tests for the Egyptian ID OCR Microservice endpoints
+The YOLO models and OCR are replaced by fakes, so no model weights or running server are needed
+"""
+
+import os
+import json
+import time
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+os.environ.setdefault("OCR_JOB_DB", os.path.join(tempfile.mkdtemp(), "jobs.db"))
+
+import utils
+import rate_limit
+import microservice
+from fastapi.testclient import TestClient
+
+with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "d2.jpg"), "rb") as f:
+    TEST_IMAGE = f.read()
+
+FIELD_NAMES = {0: "firstName", 1: "lastName", 2: "address", 3: "nid"}
+FIELD_TEXTS = {"first_name": "محمد", "second_name": "أحمد", "address": "القاهرة"}
+NATIONAL_ID = "29001010112345"
+
+class FakeClass:
+    """The class tensor of a YOLO box: read both with int() and with [0].item()"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __int__(self):
+        return self.value
+
+    def __getitem__(self, index):
+        return np.int64(self.value)
+
+def fake_result(boxes, names=None):
+    """A YOLO result with one box per (class, x1, y1, x2, y2)"""
+    return SimpleNamespace(
+        boxes=[SimpleNamespace(cls=FakeClass(cls), xyxy=np.array([bbox])) for cls, *bbox in boxes],
+        names=names or {},
+    )
+
+class FakeModel:
+    """Stands in for one of the YOLO models: returns the same boxes for every image"""
+
+    def __init__(self, boxes, names=None):
+        self.boxes = boxes
+        self.names = names
+
+    def __call__(self, images):
+        return [fake_result(self.boxes, self.names) for _ in images]
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(microservice.app) as client:
+        yield client
+
+@pytest.fixture
+def fake_pipeline(monkeypatch):
+    """Fake models for all three stages; returns the per-field OCR delays to tune"""
+    models = {
+        "detect_id_card.pt": FakeModel([(0, 0, 0, 600, 380)]),
+        "detect_odjects.pt": FakeModel(
+            [(0, 10, 10, 200, 60), (1, 10, 70, 200, 120), (2, 10, 130, 400, 180), (3, 200, 300, 580, 340)], FIELD_NAMES
+        ),
+        "detect_id.pt": FakeModel([(int(digit), 20 * i, 0, 20 * i + 15, 30) for i, digit in enumerate(NATIONAL_ID)]),
+    }
+    delays = {}
+
+    def extract_text(image, bbox, lang="ara"):
+        name = {10: "first_name", 70: "second_name", 130: "address"}[bbox[1]]
+        time.sleep(delays.get(name, 0))
+        return FIELD_TEXTS[name]
+
+    monkeypatch.setattr(utils, "get_model", lambda weights: models[weights])
+    monkeypatch.setattr(utils, "extract_text", extract_text)
+    return delays
+
+def test_deadline_returns_fields_read_before_it_ran_out(client, fake_pipeline, monkeypatch):
+    """The first OCR field finishes, the second one runs past the deadline: the partial result keeps both"""
+    async def fetch(url, allowed_types=None):
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    fake_pipeline["second_name"] = 0.5
+
+    response = client.post("/extract-id", json={
+        "image_url": "https://example.com/partial.jpg",
+        "deadline_ms": 300,
+        "allow_partial": True,
+    })
+
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["partial"] is True
+    assert data["extracted_data"]["first_name"] == "محمد"
+    assert data["extracted_data"]["second_name"] == "أحمد"
+    assert data["extracted_data"]["address"] == "Not processed"
+    assert "address" in data["skipped_fields"]
+
+def test_deadline_without_allow_partial_is_504(client, fake_pipeline, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    fake_pipeline["second_name"] = 0.5
+
+    response = client.post("/extract-id", json={"image_url": "https://example.com/late.jpg", "deadline_ms": 300})
+
+    assert response.status_code == 504
+
+def test_deadline_bounds_the_download(client, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        await microservice.asyncio.sleep(5)
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+
+    started = time.monotonic()
+    response = client.post("/extract-id", json={
+        "image_url": "https://example.com/slow.jpg",
+        "deadline_ms": 200,
+        "allow_partial": True,
+    })
+
+    assert response.status_code == 504
+    assert time.monotonic() - started < 2
+
+def post_concurrently(client, payloads):
+    with ThreadPoolExecutor(len(payloads)) as pool:
+        return list(pool.map(lambda payload: client.post("/extract-id", json=payload), payloads))
+
+def test_identical_requests_share_one_extraction(client, fake_pipeline, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        await microservice.asyncio.sleep(0.3)
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    saved = microservice.single_flight.stats()["saved"]
+
+    responses = post_concurrently(client, [{"image_url": "https://example.com/shared.jpg"}] * 2)
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert microservice.single_flight.stats()["saved"] == saved + 1
+
+def test_deadlined_requests_are_not_shared(client, fake_pipeline, monkeypatch):
+    """A later caller must not inherit an earlier caller's budget or be cancelled with it"""
+    async def fetch(url, allowed_types=None):
+        await microservice.asyncio.sleep(0.3)
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    saved = microservice.single_flight.stats()["saved"]
+
+    responses = post_concurrently(client, [{"image_url": "https://example.com/own.jpg", "deadline_ms": 5000}] * 2)
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert microservice.single_flight.stats()["saved"] == saved
+
+BOUNDARY = "test-boundary"
+
+def multipart_parts(files, fields=None, file_field="files"):
+    """multipart/form-data body as one chunk per part, for files given as (filename, content)"""
+    for name, value in (fields or {}).items():
+        yield f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    for filename, content in files:
+        yield (
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'
+        ).encode() + content + b"\r\n"
+    yield f"--{BOUNDARY}--\r\n".encode()
+
+MULTIPART_HEADERS = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+def ndjson(response):
+    return sorted((json.loads(line) for line in response.text.splitlines()), key=lambda line: line["index"])
+
+def test_batch_streams_one_line_per_uploaded_file(client, fake_pipeline):
+    files = [("card.jpg", TEST_IMAGE), ("notes.txt", b"not an image at all"), ("huge.jpg", TEST_IMAGE[:64] + b"\0" * (11 * 1024 * 1024))]
+
+    response = client.post("/extract-id/batch", content=b"".join(multipart_parts(files, {"request_id": "batch"})), headers=MULTIPART_HEADERS)
+
+    assert response.status_code == 200
+    lines = ndjson(response)
+    assert [line["filename"] for line in lines] == ["card.jpg", "notes.txt", "huge.jpg"]
+    assert lines[0]["success"] is True and lines[0]["extracted_data"]["national_id"] == NATIONAL_ID
+    assert lines[1]["error_code"] == "INVALID_IMAGE"
+    assert lines[2]["error_code"] == "INVALID_IMAGE" and "too large" in lines[2]["error"]
+    assert [line["request_id"] for line in lines] == ["batch-0", "batch-1", "batch-2"]
+
+def test_batch_upload_over_the_item_cap_is_rejected(client):
+    files = [("card.jpg", TEST_IMAGE)] * (microservice.MAX_BATCH_ITEMS + 1)
+
+    response = client.post("/extract-id/batch", content=b"".join(multipart_parts(files)), headers=MULTIPART_HEADERS)
+
+    assert response.status_code == 400
+    assert f"More than {microservice.MAX_BATCH_ITEMS}" in response.json()["detail"]
+
+def test_batch_of_urls_streams_successes_and_failures(client, fake_pipeline, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        if url.endswith("missing.jpg"):
+            raise microservice.http_client.DownloadError("Failed to download image: 404")
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    urls = ["https://example.com/a.jpg", "https://example.com/missing.jpg", "https://example.com/b.jpg"]
+
+    response = client.post("/extract-id/batch", json={"image_urls": urls, "request_id": "urls"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = ndjson(response)
+    assert [line["image_url"] for line in lines] == urls
+    assert [line["success"] for line in lines] == [True, False, True]
+    assert lines[1]["error_code"] == "DOWNLOAD_FAILED"
+
+@pytest.mark.parametrize("payload", [{"image_urls": []}, {"image_urls": ["not a url"]}, {"urls": []}])
+def test_batch_rejects_bad_json_bodies(client, payload):
+    response = client.post("/extract-id/batch", json=payload)
+
+    assert response.status_code == 400
+
+def test_batch_of_urls_over_the_item_cap_is_rejected(client):
+    urls = [f"https://example.com/{i}.jpg" for i in range(microservice.MAX_BATCH_ITEMS + 1)]
+
+    response = client.post("/extract-id/batch", json={"image_urls": urls})
+
+    assert response.status_code == 400
+
+def test_upload_extracts_the_file_with_form_fields(client, fake_pipeline):
+    body = b"".join(multipart_parts([("card.jpg", TEST_IMAGE)], {"request_id": "upload-1", "priority": "bulk"}, file_field="file"))
+
+    response = client.post("/extract-id/upload", content=body, headers=MULTIPART_HEADERS)
+
+    assert response.status_code == 200, response.text
+    assert response.json()["request_id"] == "upload-1"
+    assert response.json()["extracted_data"]["national_id"] == NATIONAL_ID
+
+def test_upload_over_the_size_cap_is_413(client):
+    oversized = TEST_IMAGE[:64] + b"\0" * (microservice.http_client.MAX_DOWNLOAD_BYTES + 1)
+
+    response = client.post("/extract-id/upload", files={"file": ("huge.jpg", oversized, "image/jpeg")})
+
+    assert response.status_code == 413
+
+@pytest.mark.parametrize("files, data, status_code", [
+    ({"file": ("notes.txt", b"plain text, not an image", "text/plain")}, {}, 400),
+    ({"other": ("card.jpg", TEST_IMAGE, "image/jpeg")}, {}, 400),
+    ({"file": ("card.jpg", TEST_IMAGE, "image/jpeg")}, {"deadline_ms": "0"}, 422),
+    ({"file": ("card.jpg", TEST_IMAGE, "image/jpeg")}, {"priority": "urgent"}, 400),
+])
+def test_upload_rejects_bad_requests(client, files, data, status_code):
+    response = client.post("/extract-id/upload", files=files, data=data)
+
+    assert response.status_code == status_code
+
+def test_raw_body_is_extracted(client, fake_pipeline):
+    response = client.post("/extract-id/raw", content=TEST_IMAGE, headers={"X-Request-ID": "raw-1"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()["request_id"] == "raw-1"
+    assert response.json()["extracted_data"]["national_id"] == NATIONAL_ID
+
+def test_raw_body_over_the_size_cap_is_413(client):
+    oversized = TEST_IMAGE[:64] + b"\0" * (microservice.http_client.MAX_DOWNLOAD_BYTES + 1)
+
+    response = client.post("/extract-id/raw", content=oversized)
+
+    assert response.status_code == 413
+
+def test_raw_body_that_is_not_an_image_is_400(client):
+    response = client.post("/extract-id/raw", content=b"%PDF-1.4 not an image")
+
+    assert response.status_code == 400
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(f"/jobs/{job_id}").json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+def test_job_runs_in_the_background_and_calls_back(client, fake_pipeline, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        return TEST_IMAGE
+    callbacks = []
+    async def post_json(url, payload, timeout=10, retries=3):
+        callbacks.append((url, payload))
+        return True
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    monkeypatch.setattr(microservice.http_client, "post_json", post_json)
+
+    response = client.post("/jobs", json={
+        "image_url": "https://example.com/job.jpg",
+        "request_id": "job-1",
+        "callback_url": "https://example.com/callback",
+    })
+
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "completed" and job["request_id"] == "job-1"
+    assert job["extracted_data"]["national_id"] == NATIONAL_ID
+    for _ in range(100):
+        if callbacks:
+            break
+        time.sleep(0.05)
+    assert callbacks == [("https://example.com/callback", job)]
+
+def test_failed_job_reports_its_error(client, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        raise microservice.http_client.DownloadError("Failed to download image: 404")
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+
+    response = client.post("/jobs", json={"image_url": "https://example.com/missing.jpg"})
+
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["status"] == "failed" and job["error_code"] == "DOWNLOAD_FAILED"
+
+def test_unknown_job_is_404(client):
+    response = client.get("/jobs/no-such-job")
+
+    assert response.status_code == 404
+    assert response.json()["error_code"] == "JOB_NOT_FOUND"
+
+@pytest.fixture
+def rate_limited(monkeypatch):
+    """Two requests per client, refilled at one per minute"""
+    monkeypatch.setattr(microservice.rate_limiter, "rate", 1 / 60)
+    monkeypatch.setattr(microservice.rate_limiter, "burst", 2)
+    monkeypatch.setattr(microservice.rate_limiter, "store", rate_limit.MemoryStore())
+
+def test_rate_limit_answers_429_with_retry_after(client, rate_limited):
+    headers = {"X-API-Key": "tenant-a"}
+
+    responses = [client.get("/jobs/no-such-job", headers=headers) for _ in range(3)]
+
+    assert [response.status_code for response in responses] == [404, 404, 429]
+    assert responses[0].headers["X-RateLimit-Limit"] == "2"
+    assert responses[1].headers["X-RateLimit-Remaining"] == "0"
+    limited = responses[2]
+    assert limited.json()["error_code"] == "RATE_LIMITED"
+    assert 0 < int(limited.headers["Retry-After"]) <= 60
+    # Other clients and exempt endpoints are not affected
+    assert client.get("/jobs/no-such-job", headers={"X-API-Key": "tenant-b"}).status_code == 404
+    assert client.get("/health", headers=headers).status_code == 200
+
+def test_batch_costs_one_token_per_image(client, rate_limited, fake_pipeline, monkeypatch):
+    async def fetch(url, allowed_types=None):
+        return TEST_IMAGE
+    monkeypatch.setattr(microservice.http_client, "fetch", fetch)
+    headers = {"X-API-Key": "tenant-c"}
+
+    response = client.post("/extract-id/batch", json={"image_urls": ["https://example.com/a.jpg", "https://example.com/b.jpg"]}, headers=headers)
+
+    assert response.status_code == 200
+    assert client.get("/jobs/no-such-job", headers=headers).status_code == 429
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Tests for the extraction daemon protocol, with a fake extraction handler
+"""
+
+import os
+import time
+import socket
+import tempfile
+import threading
+
+import pytest
+
+import ocr_daemon
+
+@pytest.fixture
+def socket_path():
+    path = os.path.join(tempfile.mkdtemp(), "ocr.sock")
+    stop = threading.Event()
+    server = threading.Thread(
+        target=ocr_daemon.serve, args=(lambda message: {"status": "success", "image": message.get("image")}, path),
+        kwargs={"threads": 1, "stop": stop}, daemon=True
+    )
+    server.start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.05)
+    yield path
+    stop.set()
+    server.join(5)
+
+def test_extract_round_trip(socket_path):
+    assert ocr_daemon.extract("card.jpg", socket_path) == {"status": "success", "image": "card.jpg"}
+
+def test_non_object_message_gets_an_error_reply(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect(socket_path)
+    try:
+        ocr_daemon.send_message(sock, [1, 2])
+        assert ocr_daemon.recv_message(sock) == {"error": "Invalid request: Request must be a JSON object", "status": "error"}
+
+        # The connection stays usable
+        ocr_daemon.send_message(sock, {"command": "ping"})
+        assert ocr_daemon.recv_message(sock)["status"] == "ok"
+    finally:
+        sock.close()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Tests for the PDF and streaming helpers of process_users
+"""
+
+import io
+import sys
+import json
+
+import numpy as np
+import pytest
+from PIL import Image
+
+stderr = sys.stderr
+import process_users
+sys.stderr = stderr  # process_users silences stderr when imported
+
+def scanned_pdf(width: int, height: int) -> bytes:
+    """A one-page PDF whose page is a single embedded JPEG, as scanners produce"""
+    pixels = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="PDF", resolution=150)
+    return buffer.getvalue()
+
+@pytest.fixture
+def rasterized(monkeypatch):
+    """Records the pages rasterized through pdf2image"""
+    calls = []
+
+    def convert_from_bytes(content, dpi, first_page, last_page):
+        calls.append((first_page, dpi))
+        return [Image.new("RGB", (200, 100))]
+
+    monkeypatch.setattr(process_users, "convert_from_bytes", convert_from_bytes)
+    return calls
+
+def test_pypdf_is_installed():
+    assert process_users.PdfReader is not None
+
+def test_embedded_jpeg_page_skips_rasterization(rasterized):
+    pages = process_users.PdfPages(scanned_pdf(640, 400))
+
+    image, dpi = pages.page(1)
+
+    assert pages.count == 1
+    assert dpi is None
+    assert image.shape == (400, 640, 3)
+    assert rasterized == []
+
+def test_small_embedded_image_is_rasterized(rasterized):
+    pages = process_users.PdfPages(scanned_pdf(120, 80))
+
+    image, dpi = pages.page(1, 150)
+
+    assert dpi == 150
+    assert rasterized == [(1, 150)]
+
+USERS = [
+    {"user_id": 1, "name": "محمد", "file_url": "https://example.com/a.jpg"},
+    {"user_id": "2", "nested": {"list": [1, 2.5, None, True]}, "text": "with ] and , inside"},
+    12345,
+    "plain string",
+    [],
+]
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 64 * 1024])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_json_array_matches_json_loads(chunk_size, indent):
+    text = json.dumps(USERS, ensure_ascii=False, indent=indent)
+
+    assert list(process_users.iter_json_array(io.StringIO(text), chunk_size)) == USERS
+
+@pytest.mark.parametrize("text", ["[]", "  [ ]  ", "\n[\n]\n"])
+def test_iter_json_array_empty(text):
+    assert list(process_users.iter_json_array(io.StringIO(text), 2)) == []
+
+def test_iter_json_array_is_lazy():
+    stream = io.StringIO('[{"user_id": 1}, {"user_id": 2}, ' + "x" * 1000)
+
+    users = process_users.iter_json_array(stream, 8)
+
+    assert next(users) == {"user_id": 1}
+    assert stream.tell() < 100
+
+@pytest.mark.parametrize("text, message", [
+    ('{"user_id": 1}', "Expected a JSON array"),
+    ('[{"user_id": 1}, ', "Unexpected end"),
+    ('[{"user_id": 1}', "Unexpected end"),
+    ('[{"user_id": 1} {"user_id": 2}]', "Expected ','"),
+    ('[{"user_id": }]', ""),
+])
+def test_iter_json_array_rejects_malformed_input(text, message):
+    with pytest.raises(ValueError, match=message):
+        list(process_users.iter_json_array(io.StringIO(text), 4))
+
+def test_iter_json_array_bounds_a_single_record(monkeypatch):
+    monkeypatch.setattr(process_users, "MAX_RECORD_CHARS", 100)
+
+    with pytest.raises(ValueError, match="too large"):
+        list(process_users.iter_json_array(io.StringIO('[{"name": "' + "x" * 1000 + '"}]'), 16))
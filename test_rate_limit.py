@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Tests for the token-bucket rate limiter and its bucket stores
+"""
+
+import os
+import time
+import tempfile
+
+import pytest
+
+from rate_limit import MemoryStore, RateLimiter, SQLiteStore, open_store, parse_quotas
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request):
+    if request.param == "memory":
+        return MemoryStore()
+    return SQLiteStore(os.path.join(tempfile.mkdtemp(), "buckets.db"))
+
+def test_burst_then_limited_with_retry_after(store):
+    limiter = RateLimiter(rate=2, burst=3, store=store, quotas={})
+
+    decisions = [limiter.check("ip:10.0.0.1") for _ in range(4)]
+
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    assert [decision.remaining for decision in decisions[:3]] == [2, 1, 0]
+    assert decisions[-1].limit == 3
+    assert 0 < decisions[-1].retry_after <= 0.5
+    assert limiter.stats()["allowed"] == 3 and limiter.stats()["limited"] == 1
+
+def test_bucket_refills_over_time(store):
+    limiter = RateLimiter(rate=20, burst=1, store=store, quotas={})
+    assert limiter.check("ip:10.0.0.1").allowed
+    assert not limiter.check("ip:10.0.0.1").allowed
+
+    time.sleep(0.1)
+
+    assert limiter.check("ip:10.0.0.1").allowed
+
+def test_clients_have_separate_buckets(store):
+    limiter = RateLimiter(rate=1, burst=1, store=store, quotas={})
+
+    assert limiter.check("ip:10.0.0.1").allowed
+    assert limiter.check("ip:10.0.0.2").allowed
+    assert not limiter.check("ip:10.0.0.1").allowed
+
+def test_charge_can_go_into_debt(store):
+    limiter = RateLimiter(rate=1, burst=5, store=store, quotas={})
+    limiter.check("key:abc")
+
+    limiter.charge("key:abc", 10)
+
+    decision = limiter.check("key:abc")
+    assert not decision.allowed
+    assert decision.retry_after > 5
+
+def test_quotas_override_the_defaults():
+    limiter = RateLimiter(rate=1, burst=1, store=MemoryStore(), quotas=parse_quotas("partner=10:50, other=2"))
+
+    assert limiter.limits_for("key:partner") == (10.0, 50.0)
+    assert limiter.limits_for("key:other") == (2.0, 2.0)
+    assert limiter.limits_for("ip:10.0.0.1") == (1, 1)
+    assert limiter.check("key:partner").limit == 50
+
+def test_disabled_by_default_rate():
+    assert not RateLimiter(rate=0, store=MemoryStore(), quotas={}).enabled
+
+def test_open_store():
+    assert isinstance(open_store("memory"), MemoryStore)
+    assert isinstance(open_store(f"sqlite:///{tempfile.mkdtemp()}/buckets.db"), SQLiteStore)
+    with pytest.raises(ValueError):
+        open_store("redis://localhost")
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Tests for the request coalescing helpers in scheduler
+"""
+
+import asyncio
+
+from scheduler import SingleFlight
+
+def run(coro):
+    return asyncio.run(coro)
+
+def test_concurrent_callers_share_one_computation():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", compute) for _ in range(5)))
+        return results, calls, flight.stats()
+
+    results, calls, stats = run(scenario())
+
+    assert results == ["result"] * 5
+    assert calls == [1]
+    assert stats == {"in_flight": 0, "computations": 1, "saved": 4}
+
+def test_different_keys_and_later_calls_compute_again():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def compute(value):
+            calls.append(value)
+            await asyncio.sleep(0.01)
+            return value
+
+        first = await asyncio.gather(flight.do("a", lambda: compute("a")), flight.do("b", lambda: compute("b")))
+        again = await flight.do("a", lambda: compute("a"))
+        return first, again, calls
+
+    first, again, calls = run(scenario())
+
+    assert first == ["a", "b"] and again == "a"
+    assert calls == ["a", "b", "a"]
+
+def test_errors_reach_every_caller():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("broken image")
+
+        return await asyncio.gather(*(flight.do("key", compute) for _ in range(3)), return_exceptions=True)
+
+    results = run(scenario())
+
+    assert all(isinstance(result, ValueError) for result in results)
+
+def test_caller_going_away_does_not_cancel_the_others():
+    async def scenario():
+        flight = SingleFlight()
+        finished = asyncio.Event()
+
+        async def compute():
+            await asyncio.sleep(0.05)
+            finished.set()
+            return "result"
+
+        leaving = asyncio.create_task(flight.do("key", compute))
+        staying = asyncio.create_task(flight.do("key", compute))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        return await staying, finished.is_set()
+
+    assert run(scenario()) == ("result", True)
+
+def test_computation_is_cancelled_once_every_caller_has_gone():
+    async def scenario():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.create_task(flight.do("key", compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return cancelled.is_set(), flight.stats()["in_flight"]
+
+    assert run(scenario()) == (True, 0)
@@ -1,11 +1,58 @@
 from ultralytics import YOLO
 import cv2
 import re
+import time
+import threading
+import numpy as np
 import easyocr
 
 # Initialize EasyOCR reader (this should be done once for efficiency)
 reader = easyocr.Reader(['ar'], gpu=False)
 
+# YOLO models are loaded once per worker thread (predictors are not thread-safe)
+_thread_models = threading.local()
+
+# Raised when no ID card is found in the input image
+class NoIDCardDetected(ValueError):
+    pass
+
+# Raised when an image runs out of time (or is abandoned) between pipeline stages
+# partial holds the text fields read before that happened
+class DeadlineExceeded(TimeoutError):
+    def __init__(self, partial=None):
+        super().__init__("Processing deadline exceeded")
+        self.partial = partial or {}
+
+# Class to carry a request's time budget and cancellation into the pipeline stages
+class Deadline:
+    def __init__(self, timeout=None):
+        self.expires_at = time.monotonic() + timeout if timeout is not None else None
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def expired(self):
+        return self.cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    def remaining(self):
+        if self.expires_at is None:
+            return None
+        return 0.0 if self.cancelled else max(0.0, self.expires_at - time.monotonic())
+
+# Function to check an optional deadline
+def deadline_expired(deadline):
+    return deadline is not None and deadline.expired()
+
+# Function to get a warm YOLO model for the current thread
+def get_model(weights):
+    models = getattr(_thread_models, 'models', None)
+    if models is None:
+        models = _thread_models.models = {}
+    if weights not in models:
+        models[weights] = YOLO(weights)
+    return models[weights]
+
 # Function to preprocess the cropped image
 def preprocess_image(cropped_image):
     gray_image = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2GRAY)   
@@ -22,8 +69,12 @@ def extract_text(image, bbox, lang='ara'):
 
 # Function to detect national ID numbers in a cropped image
 def detect_national_id(cropped_image):
-    model = YOLO('detect_id.pt')  # Load the model directly in the function
+    model = get_model('detect_id.pt')
     results = model(cropped_image)
+    return read_national_id(results, cropped_image)
+
+# Function to read the national ID digits (left to right) from digit detection results
+def read_national_id(results, cropped_image):
     detected_info = []
 
     for result in results:
@@ -58,7 +109,7 @@ def expand_bbox_height(bbox, scale=1.2, image_shape=None):
 # Function to process the cropped image
 def process_image(cropped_image):
     # Load the trained YOLO model for objects (fields) detection
-    model = YOLO('detect_odjects.pt')
+    model = get_model('detect_odjects.pt')
     results = model(cropped_image)
 
     # Variables to store extracted values
@@ -74,24 +125,13 @@ def process_image(cropped_image):
         output_path = 'd2.jpg'
         result.save(output_path)
 
-        for box in result.boxes:
-            bbox = box.xyxy[0].tolist()
-            class_id = int(box.cls[0].item())
-            class_name = result.names[class_id]
-            bbox = [int(coord) for coord in bbox]
-
-            if class_name == 'firstName':
-                first_name = extract_text(cropped_image, bbox, lang='ara')
-            elif class_name == 'lastName':
-                second_name = extract_text(cropped_image, bbox, lang='ara')
-            elif class_name == 'serial':
-                serial = extract_text(cropped_image, bbox, lang='eng')
-            elif class_name == 'address':
-                address = extract_text(cropped_image, bbox, lang='ara')
-            elif class_name == 'nid':
-                expanded_bbox = expand_bbox_height(bbox, scale=1.5, image_shape=cropped_image.shape)
-                cropped_nid = cropped_image[expanded_bbox[1]:expanded_bbox[3], expanded_bbox[0]:expanded_bbox[2]]
-                nid = detect_national_id(cropped_nid)
+        fields = extract_fields(cropped_image, result)
+        first_name = fields['first_name']
+        second_name = fields['second_name']
+        serial = fields['serial']
+        address = fields['address']
+        if fields['nid_crop'] is not None:
+            nid = detect_national_id(fields['nid_crop'])
 
     merged_name = f"{first_name} {second_name}"
     # print(f"First Name: {first_name}")
@@ -163,24 +203,182 @@ def decode_egyptian_id(id_number):
         'Gender': gender
     }
 
+# Function to decode image bytes (JPEG/PNG/WebP) into a BGR array
+def decode_image(content):
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return image
+
 # Function to detect the ID card and pass it to the existing code
-def detect_and_process_id_card(image_path):
+def detect_and_process_id_card(image):
+    # Accept either an image path or an already decoded BGR array
+    if isinstance(image, str):
+        image = cv2.imread(image)
+
     # Load the ID card detection model
-    id_card_model = YOLO('detect_id_card.pt')
+    id_card_model = get_model('detect_id_card.pt')
 
     # Perform inference to detect the ID card
-    id_card_results = id_card_model(image_path)
-
-    # Load the original image using OpenCV
-    image = cv2.imread(image_path)
+    id_card_results = id_card_model(image)
 
     # Crop the ID card from the image
+    cropped_image = None
     for result in id_card_results:
         for box in result.boxes:
             x1, y1, x2, y2 = map(int, box.xyxy[0])  # Get bounding box coordinates
             cropped_image = image[y1:y2, x1:x2]
 
+    if cropped_image is None:
+        raise NoIDCardDetected("No ID card detected in image")
+
     # Pass the cropped image to the existing processing function
     return process_image(cropped_image)
 
+# Text fields read by OCR: detected class name -> (field name, OCR language)
+TEXT_FIELDS = {
+    'firstName': ('first_name', 'ara'),
+    'lastName': ('second_name', 'ara'),
+    'serial': ('serial', 'eng'),
+    'address': ('address', 'ara'),
+}
+
+# Function to pick the text fields already read from a card
+def read_text_fields(fields):
+    return {name: fields[name] for name in ('first_name', 'second_name', 'address') if name in fields['read']}
+
+# Function to OCR the text fields of one card and crop its national ID region
+# The deadline is checked before each OCR crop; fields named in skip are not read
+def extract_fields(cropped_image, result, deadline=None, skip=()):
+    fields = {'first_name': '', 'second_name': '', 'address': '', 'serial': '', 'nid_crop': None, 'read': set()}
+
+    crops = []
+    for box in result.boxes:
+        bbox = [int(coord) for coord in box.xyxy[0].tolist()]
+        class_name = result.names[int(box.cls[0].item())]
+
+        if class_name in TEXT_FIELDS:
+            if TEXT_FIELDS[class_name][0] not in skip:
+                crops.append((TEXT_FIELDS[class_name], bbox))
+        elif class_name == 'nid':
+            expanded_bbox = expand_bbox_height(bbox, scale=1.5, image_shape=cropped_image.shape)
+            fields['nid_crop'] = cropped_image[expanded_bbox[1]:expanded_bbox[3], expanded_bbox[0]:expanded_bbox[2]]
+
+    for (name, lang), bbox in crops:
+        if deadline_expired(deadline):
+            raise DeadlineExceeded(read_text_fields(fields))
+        fields[name] = extract_text(cropped_image, bbox, lang=lang)
+        fields['read'].add(name)
+
+    return fields
+
+# Function to run the whole pipeline on a batch of images with one YOLO call per stage
+# Returns one entry per image: the extraction tuple, or the exception raised for that image
+# Images whose deadline (optional, one per image) expires are dropped at the next stage
+# with a DeadlineExceeded carrying the fields read so far; skips (optional, one per image)
+# name text fields not to OCR
+def detect_and_process_id_cards(images, deadlines=None, skips=None):
+    images = [cv2.imread(image) if isinstance(image, str) else image for image in images]
+    deadlines = deadlines or [None] * len(images)
+    skips = skips or [()] * len(images)
+    outcomes = [None] * len(images)
+
+    # Stage 1: ID card detection
+    live = []
+    for i in range(len(images)):
+        if deadline_expired(deadlines[i]):
+            outcomes[i] = DeadlineExceeded()
+        else:
+            live.append(i)
+    crops = {}
+    card_results = get_model('detect_id_card.pt')([images[i] for i in live]) if live else []
+    for i, result in zip(live, card_results):
+        for box in result.boxes:
+            x1, y1, x2, y2 = map(int, box.xyxy[0])
+            crops[i] = images[i][y1:y2, x1:x2]
+        if i not in crops:
+            outcomes[i] = NoIDCardDetected("No ID card detected in image")
+
+    # Stage 2: field detection and OCR of the text fields
+    indexes = []
+    for i in crops:
+        if deadline_expired(deadlines[i]):
+            outcomes[i] = DeadlineExceeded()
+        else:
+            indexes.append(i)
+    fields = {}
+    field_results = get_model('detect_odjects.pt')([crops[i] for i in indexes]) if indexes else []
+    for i, result in zip(indexes, field_results):
+        try:
+            fields[i] = extract_fields(crops[i], result, deadlines[i], skips[i])
+        except Exception as e:
+            outcomes[i] = e
+
+    # Stage 3: national ID digit detection
+    nid_indexes = []
+    for i in list(fields):
+        if deadline_expired(deadlines[i]):
+            outcomes[i] = DeadlineExceeded(read_text_fields(fields.pop(i)))
+        elif fields[i]['nid_crop'] is not None:
+            nid_indexes.append(i)
+    nids = {}
+    digit_results = get_model('detect_id.pt')([fields[i]['nid_crop'] for i in nid_indexes]) if nid_indexes else []
+    for i, result in zip(nid_indexes, digit_results):
+        nids[i] = read_national_id([result], fields[i]['nid_crop'])
+
+    for i, card in fields.items():
+        try:
+            nid = nids.get(i, '')
+            decoded_info = decode_egyptian_id(nid)
+            merged_name = f"{card['first_name']} {card['second_name']}"
+            outcomes[i] = (card['first_name'], card['second_name'], merged_name, nid, card['address'], decoded_info["Birth Date"], decoded_info["Governorate"], decoded_info["Gender"])
+        except Exception as e:
+            outcomes[i] = e
+
+    return outcomes
+
+# Function to load every model on the calling thread ahead of the first request
+def warm_up_models():
+    for weights in ('detect_id_card.pt', 'detect_odjects.pt', 'detect_id.pt'):
+        get_model(weights)
+
+# Function to turn the fields read before a deadline into API response fields
+# Returns the fields and the names of those that were never reached
+def to_partial_response_fields(partial):
+    fields = {name: "Not processed" for name in ('first_name', 'second_name', 'full_name', 'national_id', 'address', 'birth_date', 'governorate', 'gender')}
+    for name, value in partial.items():
+        fields[name] = value or "Not detected"
+    if 'first_name' in partial and 'second_name' in partial:
+        fields['full_name'] = f"{partial['first_name']} {partial['second_name']}".strip() or "Not detected"
+    return fields, [name for name, value in fields.items() if value == "Not processed"]
+
+# Function to turn the pipeline result tuple into the API response fields
+# Fields named in skipped were deliberately not read and are marked as such
+def to_response_fields(result, skipped=()):
+    if not result or len(result) != 8:
+        raise ValueError("Invalid extraction result")
+
+    first_name, second_name, full_name, national_id, address, birth_date, governorate, gender = result
+
+    # A national ID must have exactly 14 digits
+    if not national_id or len(national_id) != 14:
+        national_id = "Invalid format"
+
+    fields = {
+        "first_name": first_name or "Not detected",
+        "second_name": second_name or "Not detected",
+        "full_name": full_name or "Not detected",
+        "national_id": national_id,
+        "address": address or "Not detected",
+        "birth_date": birth_date or "Not detected",
+        "governorate": governorate or "Not detected",
+        "gender": gender or "Not detected"
+    }
+    for name in skipped:
+        if name in fields:
+            fields[name] = "Not processed"
+    if 'first_name' in skipped and 'second_name' in skipped:
+        fields['full_name'] = "Not processed"
+    return fields
+
 # print(detect_and_process_id_card("font_ID.jpg"))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Standalone extraction worker for the Egyptian ID OCR service
+Leases jobs from the shared job queue, runs them through the warm pipeline in utils and
+writes the results back. Inference nodes run only this process (no FastAPI), so they can be
+added or removed independently of the API tier.
+
+Usage: python worker.py [--queue sqlite:///jobs.db] [--threads 1] [--batch-size 8]
+"""
+
+import os
+import sys
+import time
+import signal
+import socket
+import asyncio
+import logging
+import argparse
+import threading
+from typing import Any, Dict, List
+
+from utils import detect_and_process_id_cards, decode_image, to_response_fields, warm_up_models, NoIDCardDetected
+from job_queue import DEFAULT_QUEUE_URL, JobQueue, open_queue, public_view
+import http_client
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("worker")
+
+# Worker configuration (overridable through the environment or the command line)
+DEFAULT_THREADS = int(os.environ.get("OCR_WORKER_THREADS", 1))
+DEFAULT_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+DEFAULT_POLL_INTERVAL = float(os.environ.get("OCR_JOB_POLL_INTERVAL", 1.0))
+
+class InvalidImageError(Exception):
+    """Raised when a downloaded file cannot be decoded as an image"""
+
+def error_code(exc: Exception) -> str:
+    """Map a job failure to the error codes used by the HTTP service"""
+    if isinstance(exc, (InvalidImageError, http_client.UnsupportedContentError, http_client.DownloadTooLargeError)):
+        return "INVALID_IMAGE"
+    if isinstance(exc, http_client.DownloadError):
+        return "DOWNLOAD_FAILED"
+    if isinstance(exc, NoIDCardDetected):
+        return "NO_ID_DETECTED"
+    return "EXTRACTION_FAILED"
+
+async def download_all(urls: List[str]) -> List[Any]:
+    """Download the job images concurrently; failed downloads are returned as exceptions"""
+    return await asyncio.gather(
+        *(http_client.fetch(url, allowed_types=http_client.IMAGE_TYPES) for url in urls),
+        return_exceptions=True
+    )
+
+async def send_callbacks(jobs: List[Dict[str, Any]]):
+    """Deliver the final state of finished jobs to their callback URLs"""
+    delivered = await asyncio.gather(*(http_client.post_json(job["callback_url"], public_view(job)) for job in jobs))
+    for job, ok in zip(jobs, delivered):
+        if not ok:
+            logger.warning(f"[{job['payload']['request_id']}] Callback for job {job['id']} could not be delivered")
+
+def process_batch(queue: JobQueue, worker_id: str, jobs: List[Dict[str, Any]]):
+    """Run a batch of leased jobs through the pipeline and store their outcomes"""
+    outcomes = http_client.run_sync(download_all([job["payload"]["image_url"] for job in jobs]))
+
+    images, indexes = [], []
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            continue
+        try:
+            images.append(decode_image(outcome))
+            indexes.append(i)
+        except ValueError as e:
+            outcomes[i] = InvalidImageError(str(e))
+
+    # Downloads may have eaten into the visibility timeout
+    for job in jobs:
+        queue.extend(job["id"], worker_id)
+
+    for i, result in zip(indexes, detect_and_process_id_cards(images)):
+        try:
+            outcomes[i] = result if isinstance(result, Exception) else to_response_fields(result)
+        except Exception as e:
+            outcomes[i] = e
+
+    callbacks = []
+    for job, outcome in zip(jobs, outcomes):
+        request_id = job["payload"]["request_id"]
+        if isinstance(outcome, Exception):
+            logger.error(f"[{request_id}] Job {job['id']} failed: {str(outcome)}")
+            finished = queue.fail(job["id"], worker_id, str(outcome), error_code(outcome))
+        else:
+            logger.info(f"[{request_id}] Job {job['id']} completed")
+            finished = queue.complete(job["id"], worker_id, outcome)
+
+        if not finished:
+            logger.warning(f"[{request_id}] Lease on job {job['id']} expired; result discarded")
+        elif job["callback_url"]:
+            callbacks.append(queue.get(job["id"]))
+
+    if callbacks:
+        http_client.run_sync(send_callbacks(callbacks))
+
+def run_worker(queue: JobQueue, worker_id: str, batch_size: int, poll_interval: float, stop: threading.Event):
+    """Lease and process batches of jobs until stop is set"""
+    warm_up_models()
+    logger.info(f"Worker {worker_id} ready")
+    while not stop.is_set():
+        try:
+            abandoned = []
+            jobs = queue.lease_many(worker_id, batch_size, abandoned)
+            callbacks = [job for job in abandoned if job["callback_url"]]
+            if callbacks:
+                http_client.run_sync(send_callbacks(callbacks))
+            if not jobs:
+                stop.wait(poll_interval)
+                continue
+
+            started = time.perf_counter()
+            try:
+                process_batch(queue, worker_id, jobs)
+            except Exception:
+                # Hand unfinished jobs back instead of waiting for their leases to expire
+                for job in jobs:
+                    queue.release(job["id"], worker_id)
+                raise
+            logger.info(f"Worker {worker_id} processed {len(jobs)} jobs in {time.perf_counter() - started:.2f}s")
+        except Exception as e:
+            logger.error(f"Worker {worker_id} error: {str(e)}")
+            stop.wait(poll_interval)
+    logger.info(f"Worker {worker_id} stopped")
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued ID extraction jobs")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_URL, help="Job queue URL (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_THREADS, help="Worker threads, each with its own models")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Jobs leased and inferred together")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds to wait when the queue is empty")
+    parser.add_argument("--worker-id", default=f"{socket.gethostname()}-{os.getpid()}", help="Prefix for lease owner ids")
+    args = parser.parse_args()
+
+    try:
+        queue = open_queue(args.queue)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Finish the current batch on SIGTERM/SIGINT, then exit
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    threads = [
+        threading.Thread(
+            target=run_worker,
+            args=(queue, f"{args.worker_id}-{i}", args.batch_size, args.poll_interval, stop),
+            name=f"ocr-worker-{i}"
+        )
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+    http_client.run_sync(http_client.close())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())